@@ -1,52 +1,59 @@
 import os
-import json
+import time
 import cv2
 import zxingcpp
-from pylibdmtx.pylibdmtx import decode as dmtx_decode
+
+from decode_chain import DecoderChain, Strategy, iter_tiles, decode_rois
+
+# ---------- 识别策略 ----------
+def _run_pylibdmtx(img, detectors, timeout_ms):
+    # pylibdmtx只在DM模式下第一次识别时导入（模块已导入时开销可以忽略）
+    from pylibdmtx.pylibdmtx import decode as dmtx_decode
+    dmtx_results = dmtx_decode(img, timeout=timeout_ms, max_count=1)
+    if not dmtx_results:
+        return None
+    best_result = max(dmtx_results, key=lambda r: len(r.data))
+    return best_result.data.decode("utf-8", errors="strict")
+
+def _run_zxing(img, detectors):
+    results = zxingcpp.read_barcodes(img)
+    return results[0].text if results else None
+
+# 识别链，策略说明：
+#     - 模式一：pylibdmtx（原图+2倍放大，专业DM码库，优先）
+#     - 模式二：ZXing（原图+2倍灰度图，后备方案）
+DM_CHAIN = DecoderChain([
+    Strategy("M1-pylibdmtx", "original", _run_pylibdmtx, timeout_ms=500),
+    Strategy("M1-pylibdmtx-2x", "2x", _run_pylibdmtx, timeout_ms=500),
+    Strategy("M2-ZXing-DM", "original", _run_zxing),
+    Strategy("M2-ZXing-DM-2x-灰度", "2x_gray", _run_zxing),
+], mode="DM", code_name="DM码")
 
 # ---------- 解码逻辑 ----------
-def _decode_with_backoffs(img):
-    """多模式DM码识别，针对Data Matrix码优化
-    
-    策略说明：
-        - 模式一：pylibdmtx（原图+2倍放大，专业DM码库，优先）
-        - 模式二：ZXing（原图+2倍灰度图，后备方案）
+def _decode_traced(img, order=None, budget=None):
+    """多模式DM码识别，同时返回各策略耗时
     
     Args:
         img: 输入图像
+        order: 策略尝试顺序（策略名列表），None表示默认顺序
+        budget: 单个孔位的时间预算（秒），None表示不限
         
     Returns:
-        tuple: (识别方法标签, 识别结果) 或 (None, None)
+        tuple: (识别方法标签, 识别结果, 各策略耗时列表)，未识别时前两项为None
     """
-    # 预处理：计算2倍放大图像，使用INTER_NEAREST插值避免边缘伪影
-    img2x = cv2.resize(img, None, fx=2.0, fy=2.0, interpolation=cv2.INTER_NEAREST)
-    
-    # 模式一：pylibdmtx专门识别DM码（优先使用）
-    dmtx_results = dmtx_decode(img, timeout=500, max_count=1)
-    if dmtx_results:
-        best_result = max(dmtx_results, key=lambda r: len(r.data))
-        return "M1-pylibdmtx", best_result.data.decode("utf-8", errors="strict")
-    
-    # 2倍放大图识别DM码
-    dmtx_results = dmtx_decode(img2x, timeout=500, max_count=1)
-    if dmtx_results:
-        best_result = max(dmtx_results, key=lambda r: len(r.data))
-        return "M1-pylibdmtx-2x", best_result.data.decode("utf-8", errors="strict")
-    
-    # 模式二：ZXing识别（后备方案）
-    results = zxingcpp.read_barcodes(img)
-    if results:
-        return "M2-ZXing-DM", results[0].text
+    return DM_CHAIN.decode(img, order, budget)
+
+def _decode_with_backoffs(img):
+    """多模式DM码识别，针对Data Matrix码优化（策略见DM_CHAIN）
     
-    # 2倍放大灰度图
-    img2x_gray = cv2.resize(img, None, fx=2.0, fy=2.0, interpolation=cv2.INTER_NEAREST)
-    img2x_gray = cv2.cvtColor(img2x_gray, cv2.COLOR_BGR2GRAY)
+    Args:
+        img: 输入图像
         
-    results = zxingcpp.read_barcodes(img2x_gray)
-    if results:
-        return "M2-ZXing-DM-2x-灰度", results[0].text
-
-    return None, None
+    Returns:
+        tuple: (识别方法标签, 识别结果) 或 (None, None)
+    """
+    method, data, _ = DM_CHAIN.decode(img)
+    return method, data
 
 def decode_dm_code(image_path):
     """识别单个图像中的DM码"""
@@ -61,7 +68,54 @@ def decode_dm_code(image_path):
         return data
     return None
 
+# ---------- 整板识别 ----------
+def detect_dm_plate(image, processor, tiles=1, stats=None):
+    """整板一次性识别多个DM码，并按条码中心点分配到孔位
+    
+    使用ZXing多码识别（pylibdmtx在整图上过慢），只有未分配到结果的孔位才需要逐孔识别。
+    
+    Args:
+        image: 整板图像
+        processor: 已加载模板的TubePlateProcessor
+        tiles: 每个方向的分块数，大于1时除整图外还会分块识别小尺寸条码
+        stats: 可选的StrategyStats，记录整板识别耗时
+        
+    Returns:
+        dict: {label: 识别结果}
+    """
+    start = time.perf_counter()
+    symbols = []
+    for x0, y0, tile in iter_tiles(image, tiles):
+        try:
+            for result in zxingcpp.read_barcodes(tile, formats=zxingcpp.BarcodeFormat.DataMatrix):
+                p = result.position
+                cx = (p.top_left.x + p.top_right.x + p.bottom_left.x + p.bottom_right.x) / 4
+                cy = (p.top_left.y + p.top_right.y + p.bottom_left.y + p.bottom_right.y) / 4
+                symbols.append((result.text, x0 + cx, y0 + cy))
+        except Exception as e:
+            print(f"ZXing整板识别失败: {e}")
+
+    assigned = processor.assign_symbols(symbols, image.shape[1], image.shape[0])
+    if stats is not None:
+        stats.record([("P-整板识别", time.perf_counter() - start, bool(assigned))])
+    print(f"整板识别: 找到 {len(symbols)} 个条码，分配到 {len(assigned)} 个孔位")
+    return assigned
+
 # ---------- 批量处理 ----------
+def decode_dm_rois(rois, *args, **kwargs):
+    """批量识别内存中的ROI图像中的DM码，参数和返回值见decode_chain.decode_rois"""
+    return decode_rois(DM_CHAIN, _decode_traced, rois, *args, **kwargs)
+
+def _iter_png_rois(cut_results_dir, png_files):
+    """逐个读取目录中的PNG图像，生成 (label, ndarray) 序列"""
+    for png_file in png_files:
+        image_path = os.path.join(cut_results_dir, png_file)
+        img = cv2.imread(image_path, cv2.IMREAD_COLOR)
+        if img is None:
+            print(f"无法读取图片: {image_path}")
+            continue
+        yield os.path.splitext(png_file)[0], img
+
 def process_dm_codes(cut_results_dir="cut_results", output_file="dm_results.json"):
     """批量处理目录中的PNG图像，识别其中的DM码"""
     if not os.path.exists(cut_results_dir):
@@ -74,23 +128,7 @@ def process_dm_codes(cut_results_dir="cut_results", output_file="dm_results.json
         return {}
 
     print(f"找到 {len(png_files)} 个 PNG 文件，开始识别DM码...")
-    results = {}
-
-    for png_file in png_files:
-        label = os.path.splitext(png_file)[0]
-        image_path = os.path.join(cut_results_dir, png_file)
-        dm_data = decode_dm_code(image_path)
-        if dm_data:
-            results[label] = dm_data
-            print(f"识别成功: {label} -> {dm_data}")
-        else:
-            print(f"未识别到DM码: {label}")
-
-    with open(output_file, 'w', encoding='utf-8') as f:
-        json.dump(results, f, ensure_ascii=False, indent=2)
-
-    print(f"识别结果已保存到: {output_file}")
-    return results
+    return decode_dm_rois(_iter_png_rois(cut_results_dir, png_files), output_file)
 
 # ---------- 主入口 ----------
 if __name__ == "__main__":
@@ -2,24 +2,33 @@ import os
 import sys
 import json
 import threading
+import queue
 import time
+# 记录启动时导入模块的耗时（matplotlib、qreader/torch和pylibdmtx在需要时才导入，不计入）
+_import_start = time.perf_counter()
 import tkinter as tk
 from tkinter import ttk, scrolledtext, messagebox, filedialog
 from datetime import datetime
-import matplotlib.pyplot as plt
-from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
 import numpy as np
-from PIL import Image, ImageTk
-import requests
 import cv2
 import platform
 import random
 import string
 
 # 导入我们的模块
-from cut import TubePlateProcessor
-from QR import process_qr_codes
-from DM import process_dm_codes
+from cut import TubePlateProcessor, save_rois_async
+from QR import decode_qr_rois, detect_qr_plate, warmup_qreader, qreader_load_seconds, qreader_ready
+from DM import decode_dm_rois, detect_dm_plate
+from decode_pool import shutdown_executors
+from decode_chain import StrategyStats, get_ranking
+from well_cache import get_well_cache
+from decode_cache import DecodeCache
+from watcher import FolderWatcher
+from job_queue import JobQueue
+from uploader import ResultUploader
+from payload_codec import build_plate_payload, generate_data_id
+from stage_trace import configure_tracing, close_tracing, trace_context, span, traced_iter
+_import_seconds = time.perf_counter() - _import_start
 
 # 资源路径处理函数
 if getattr(sys, 'frozen', False):
@@ -52,10 +61,44 @@ class GeeseUI:
         self.monitoring = True
         self.auto_send = True  # 自动发送开关
         self.qr_results = {}
+        self.well_status = {}  # 各孔位的识别状态：ok、failed、timeout、empty
         self.server_url = "http://172.16.1.141:10511/apiEntitySample/GetSampleScanData.json"  # 默认后端接口地址
         self.watch_dir = "picture"  # 默认监控文件夹路径
-        self.processing_lock = threading.Lock()  # 图片处理互斥锁
+        self.processing_lock = threading.Lock()  # 图片编号互斥锁
+        self._job_seq = 0  # 已开始处理的图片编号
+        self._published_seq = 0  # 当前显示结果对应的图片编号（只在主线程中读写）
+        self.result_channel = queue.Queue()  # 识别线程发布的孔位结果，主线程定时批量取出更新界面
+        self.ui_batch_ms = 100  # 界面批量更新的间隔（毫秒）
+        self.outbox_path = "outbox.jsonl"  # 待上传结果的发件箱文件，后端不可用时结果保存在这里等待重试
+        self.batch_url = ""  # 批量上传接口地址，为空时每块孔板单独上传；只写路径（如 /api/qr_results/batch）时按后端接口地址解析
+        self.batch_size = 10  # 每个批量请求最多包含的孔板数
+        self.compression = "none"  # 上传请求体的压缩方式：none、gzip或zstd
+        self.compact_payload = False  # 是否只上传有结果的孔位（附带行列数，后端还原完整孔板）
+        self._session_token = ''.join(random.choices(string.ascii_letters + string.digits, k=8))  # 本次运行的标识
         self.code_mode = "QR"  # 识别模式：QR或DM
+        self.save_cut_results = False  # 是否把切割结果写入cut_results目录（调试用）
+        self.workers = 0  # 并行识别的工作数，0表示自动
+        self.worker_mode = "thread"  # 并行方式：thread（线程）或process（进程）
+        self.queue_workers = 1  # 图片处理队列的消费线程数
+        self.queue_size = 32  # 图片处理队列容量
+        self.adaptive_order = True  # 是否按历史成功率调整识别策略顺序
+        self.well_budget_ms = 1500  # 单个孔位的识别时间预算（毫秒），0表示不限
+        self.plate_timeout_s = 60  # 整块孔板的识别时间上限（秒），0表示不限
+        self.skip_empty_wells = True  # 是否跳过识别判定为空的孔位
+        self.plate_first = False  # 是否先整板一次性识别，只对未识别的孔位逐孔识别
+        self.plate_tiles = 1  # 整板识别时每个方向的分块数，1表示只识别整图
+        self.reuse_unchanged_wells = False  # 是否把每块孔板都当作重拍：未变化的孔位先用上次成功的策略识别
+        self._reshoot_next = False  # 下一块孔板是否为重拍同一孔板（点击"重拍同一孔板"后只对下一块生效）
+        self.decode_cache_size = 4096  # 内存中缓存的孔位识别结果数，0表示不使用识别结果缓存
+        self.decode_cache_db = "decode_cache.db"  # 识别结果磁盘缓存文件，为空时只使用内存缓存
+        self.decode_cache_db_mb = 64  # 识别结果磁盘缓存大小上限（MB）
+        self.preload_models = False  # 启动后是否在后台预热QReader模型，否则在第一次需要时才加载
+        self._warmup_state = None  # QReader预热状态：None（未预热）、running或failed
+        self._qreader_load_logged = False  # 是否已记录QReader的加载耗时
+        self.trace_path = ""  # 各阶段耗时的跟踪文件，为空时不记录
+        self.trace_format = "jsonl"  # 跟踪文件格式：jsonl或chrome（Chrome Trace Event格式）
+        self.trace_max_mb = 20  # 单个跟踪文件的大小上限（MB），超过后轮转
+        self.trace_backups = 3  # 保留的旧跟踪文件数
         
         # 孔版行列数
         self.rows = 9
@@ -80,12 +123,57 @@ class GeeseUI:
         # 加载配置
         self.load_config()
         
+        # 按阶段记录每块孔板的耗时（设置了trace_path时）
+        if configure_tracing(self.trace_path, self.trace_format, self.trace_max_mb, self.trace_backups):
+            self.log(f"阶段耗时记录到: {self.trace_path}")
+        
+        # 创建图片处理队列（固定数量的消费线程，按提交顺序处理）
+        self.job_queue = JobQueue(self.process_image, workers=self.queue_workers, maxsize=self.queue_size,
+                                  on_depth_change=self.on_queue_depth_change, log=self.log)
+        
+        # 按ROI内容寻址的识别结果缓存（同一张图片重复提交时直接返回结果）
+        self.decode_cache = None
+        if self.decode_cache_size:
+            self.decode_cache = DecodeCache(self.decode_cache_size, self.decode_cache_db or None,
+                                            self.decode_cache_db_mb)
+        
+        # 后台上传线程（先写入磁盘发件箱，保持连接，失败时退避重试，不阻塞界面）
+        self.uploader = ResultUploader(
+            self.outbox_path or None,
+            on_outcome=lambda payload, outcome, meta: self.root.after(
+                0, lambda: self.on_upload_done(payload, outcome, meta)),
+            on_pending_change=lambda count: self.root.after(
+                0, lambda: self.outbox_status_var.set(f"待发送: {count}")),
+            log=self.log,
+            batch_url=self.batch_url or None,
+            batch_size=self.batch_size,
+            compression=self.compression)
+        self._upload_error_shown = False  # 接口配置错误的提示框是否已显示（上传成功后重置）
+        # 上次运行留下的结果发往当前配置的接口地址
+        retargeted = self.uploader.retarget(self.server_url)
+        if retargeted:
+            self.log(f"发件箱中 {retargeted} 条结果改为发往当前接口地址")
+        self.outbox_status_var.set(f"待发送: {self.uploader.pending_count()}")
+        
+        # 定时把识别线程发布的孔位结果批量更新到界面
+        self.root.after(self.ui_batch_ms, self.drain_results)
+        
         # 创建处理器
         self._reset_processor_with_template(self.get_template_path())
         
         # 检查模板是否存在
         self.check_template()
         
+        self.log(f"模块导入耗时 {_import_seconds:.2f} 秒")
+        
+        # 窗口显示后再导入matplotlib并创建可视化图形
+        self.root.after(1, self.create_plot)
+        
+        # 开启预加载时在后台预热QReader模型，避免第一个难识别的孔位等待模型加载；
+        # 否则在第一次需要神经网络识别时才导入qreader/torch
+        self.start_warmup()
+        self.update_decoder_status()
+        
         # 如果监控状态为True，则启动监控线程
         if self.monitoring:
             self.log("启动监控...")
@@ -93,6 +181,63 @@ class GeeseUI:
             monitor_thread.daemon = True
             monitor_thread.start()
     
+    def start_warmup(self):
+        """开启预加载且为QR模式时，在后台线程中预热QReader（界面可以立即使用）"""
+        if not self.preload_models or self.code_mode != "QR" or self._warmup_state == "running" or qreader_ready():
+            return
+        if self.worker_mode == "process":
+            # 进程池的工作进程各自加载模型，在界面进程中预热没有作用
+            self.log("进程模式下不预热QReader模型，由各工作进程在首次使用时加载")
+            return
+        self._warmup_state = "running"
+        threading.Thread(target=self.warmup_decoders, daemon=True).start()
+    
+    def warmup_decoders(self):
+        """预热识别模型（在后台线程中运行），预热期间到达的孔板只用基础识别器"""
+        if warmup_qreader():
+            self._warmup_state = None
+            self._qreader_load_logged = True
+            self.log(f"QReader模型已预加载，耗时 {qreader_load_seconds():.2f} 秒")
+        else:
+            self._warmup_state = "failed"
+            self.log("QReader模型预加载失败，将在首次使用时重试")
+        self.root.after(0, self.update_decoder_status)
+    
+    def update_decoder_status(self):
+        """在状态栏显示识别器是否就绪（主线程）"""
+        if self.code_mode != "QR":
+            text = "识别器: 就绪"
+        elif qreader_ready():
+            text = "识别器: 全部就绪"
+        elif self._warmup_state == "running":
+            text = "识别器: 基础识别器就绪，神经网络预热中..."
+        elif self._warmup_state == "failed":
+            text = "识别器: 神经网络加载失败，使用基础识别器"
+        else:
+            text = "识别器: 基础识别器就绪（神经网络首次使用时加载）"
+        self.decoder_status_var.set(text)
+    
+    def create_plot(self):
+        """导入matplotlib并创建结果可视化图形（窗口显示后调用）"""
+        start = time.perf_counter()
+        import matplotlib.pyplot as plt
+        from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+        from plate_view import PlateGridView
+        
+        self.viz_placeholder.destroy()
+        # 创建matplotlib图形
+        self.fig, self.ax = plt.subplots(figsize=(3.6, 3.6), dpi=100)
+        self.canvas = FigureCanvasTkAgg(self.fig, master=self.viz_frame)
+        self.canvas.get_tk_widget().pack(fill=tk.BOTH, expand=True)
+        # 孔板网格的增量渲染器，状态变化时只重绘变化的孔位
+        self.grid_view = PlateGridView(self.ax, self.canvas)
+        
+        # 绑定鼠标点击事件到可视化区域
+        self.canvas.mpl_connect('button_press_event', self.on_visualization_click)
+        
+        self.update_visualization()
+        self.log(f"可视化组件加载耗时 {time.perf_counter() - start:.2f} 秒")
+    
     def get_template_path(self):
         """根据当前行列数生成模板文件名"""
         return f"template_{self.rows}x{self.cols}.json"
@@ -129,6 +274,10 @@ class GeeseUI:
         self.process_single_btn = ttk.Button(template_frame, text="处理单张图片", command=self.process_single_image)
         self.process_single_btn.pack(side=tk.LEFT, padx=5)
         
+        # 重拍同一孔板按钮：下一张图片与上一张是同一块孔板时，未变化的孔位先用上次成功的策略识别
+        self.reshoot_btn = ttk.Button(template_frame, text="重拍同一孔板", command=self.toggle_reshoot)
+        self.reshoot_btn.pack(side=tk.LEFT, padx=5)
+        
         # 接口地址按钮
         self.server_url_btn = ttk.Button(template_frame, text="接口地址", command=self.change_server_url)
         self.server_url_btn.pack(side=tk.LEFT, padx=5)
@@ -156,6 +305,10 @@ class GeeseUI:
         self.monitor_dir_label = ttk.Label(monitor_frame, text=f"监控文件夹: {self.watch_dir}")
         self.monitor_dir_label.pack(side=tk.LEFT, padx=5)
         
+        # 显示处理队列深度
+        self.queue_status_var = tk.StringVar(value="队列: 0")
+        ttk.Label(monitor_frame, textvariable=self.queue_status_var).pack(side=tk.LEFT, padx=5)
+        
         # 第二行：执行日志（左）+ 二维码映射（右）
         row2 = ttk.PanedWindow(main_paned, orient=tk.HORIZONTAL)
         main_paned.add(row2, weight=3)
@@ -230,13 +383,14 @@ class GeeseUI:
         viz_frame = ttk.LabelFrame(row3, text="结果可视化", padding="10")
         row3.add(viz_frame, weight=1)
         
-        # 创建matplotlib图形
-        self.fig, self.ax = plt.subplots(figsize=(3.6, 3.6), dpi=100)
-        self.canvas = FigureCanvasTkAgg(self.fig, master=viz_frame)
-        self.canvas.get_tk_widget().pack(fill=tk.BOTH, expand=True)
-        
-        # 绑定鼠标点击事件到可视化区域
-        self.canvas.mpl_connect('button_press_event', self.on_visualization_click)
+        # matplotlib图形在窗口显示后再创建（见create_plot），先显示占位文字
+        self.viz_frame = viz_frame
+        self.fig = None
+        self.ax = None
+        self.canvas = None
+        self.grid_view = None
+        self.viz_placeholder = ttk.Label(viz_frame, text="正在加载可视化组件...", anchor=tk.CENTER)
+        self.viz_placeholder.pack(fill=tk.BOTH, expand=True)
         
         # 绑定键盘事件到主窗口
         self.root.bind('<Key>', self.on_key_press)
@@ -248,10 +402,19 @@ class GeeseUI:
         row2.sashpos(0, row2.winfo_width() // 2)
         row3.sashpos(0, row3.winfo_width() // 2)
         
-        # 状态栏
+        # 状态栏（右侧显示识别器是否就绪）
+        status_frame = ttk.Frame(self.root)
+        status_frame.pack(side=tk.BOTTOM, fill=tk.X)
+        self.decoder_status_var = tk.StringVar(value="识别器: 加载中...")
+        ttk.Label(status_frame, textvariable=self.decoder_status_var, relief=tk.SUNKEN,
+                  anchor=tk.E).pack(side=tk.RIGHT)
+        # 发件箱中等待上传的结果数
+        self.outbox_status_var = tk.StringVar(value="待发送: 0")
+        ttk.Label(status_frame, textvariable=self.outbox_status_var, relief=tk.SUNKEN,
+                  anchor=tk.E).pack(side=tk.RIGHT)
         self.status_var = tk.StringVar(value="监控运行中...")
-        status_bar = ttk.Label(self.root, textvariable=self.status_var, relief=tk.SUNKEN, anchor=tk.W)
-        status_bar.pack(side=tk.BOTTOM, fill=tk.X)
+        status_bar = ttk.Label(status_frame, textvariable=self.status_var, relief=tk.SUNKEN, anchor=tk.W)
+        status_bar.pack(side=tk.LEFT, fill=tk.X, expand=True)
         
     def ensure_watch_dir_exists(self):
         """确保监控文件夹存在，如果不存在则创建"""
@@ -290,6 +453,62 @@ class GeeseUI:
                 # 加载识别模式（QR或DM），默认为QR
                 self.code_mode = config.get('code_mode', 'QR')
                 
+                # 加载调试选项：是否保存切割结果
+                self.save_cut_results = config.get('save_cut_results', False)
+                
+                # 加载并行识别设置
+                self.workers = config.get('workers', 0)
+                self.worker_mode = config.get('worker_mode', 'thread')
+                
+                # 加载图片处理队列设置
+                self.queue_workers = config.get('queue_workers', 1)
+                self.queue_size = config.get('queue_size', 32)
+                
+                # 加载是否自适应调整识别策略顺序
+                self.adaptive_order = config.get('adaptive_order', True)
+                
+                # 加载识别时间预算
+                self.well_budget_ms = config.get('well_budget_ms', 1500)
+                self.plate_timeout_s = config.get('plate_timeout_s', 60)
+                
+                # 加载是否跳过空孔位
+                self.skip_empty_wells = config.get('skip_empty_wells', True)
+                
+                # 加载整板识别设置
+                self.plate_first = config.get('plate_first', False)
+                self.plate_tiles = config.get('plate_tiles', 1)
+                
+                # 加载是否沿用未变化孔位的结果
+                self.reuse_unchanged_wells = config.get('reuse_unchanged_wells', False)
+                
+                # 加载识别结果缓存设置
+                self.decode_cache_size = config.get('decode_cache_size', 4096)
+                self.decode_cache_db = config.get('decode_cache_db', "decode_cache.db")
+                self.decode_cache_db_mb = config.get('decode_cache_db_mb', 64)
+                
+                # 加载是否预加载识别模型
+                self.preload_models = config.get('preload_models', False)
+                
+                # 加载阶段耗时跟踪设置
+                self.trace_path = config.get('trace_path', "")
+                self.trace_format = config.get('trace_format', "jsonl")
+                self.trace_max_mb = config.get('trace_max_mb', 20)
+                self.trace_backups = config.get('trace_backups', 3)
+                
+                # 加载界面批量更新间隔
+                self.ui_batch_ms = config.get('ui_batch_ms', 100)
+                
+                # 加载发件箱路径
+                self.outbox_path = config.get('outbox_path', "outbox.jsonl")
+                
+                # 加载批量上传设置
+                self.batch_url = config.get('batch_url', "")
+                self.batch_size = config.get('batch_size', 10)
+                
+                # 加载上传编码设置
+                self.compression = config.get('compression', "none")
+                self.compact_payload = config.get('compact_payload', False)
+                
                 # 更新UI控件的值
                 self.rows_var.set(self.rows)
                 self.cols_var.set(self.cols)
@@ -357,6 +576,32 @@ class GeeseUI:
             config["cols"] = self.cols
             config["machine_code"] = self.machine_code
             config["code_mode"] = self.code_mode
+            config["save_cut_results"] = self.save_cut_results
+            config["workers"] = self.workers
+            config["worker_mode"] = self.worker_mode
+            config["queue_workers"] = self.queue_workers
+            config["queue_size"] = self.queue_size
+            config["adaptive_order"] = self.adaptive_order
+            config["well_budget_ms"] = self.well_budget_ms
+            config["plate_timeout_s"] = self.plate_timeout_s
+            config["skip_empty_wells"] = self.skip_empty_wells
+            config["plate_first"] = self.plate_first
+            config["plate_tiles"] = self.plate_tiles
+            config["reuse_unchanged_wells"] = self.reuse_unchanged_wells
+            config["decode_cache_size"] = self.decode_cache_size
+            config["decode_cache_db"] = self.decode_cache_db
+            config["decode_cache_db_mb"] = self.decode_cache_db_mb
+            config["preload_models"] = self.preload_models
+            config["trace_path"] = self.trace_path
+            config["trace_format"] = self.trace_format
+            config["trace_max_mb"] = self.trace_max_mb
+            config["trace_backups"] = self.trace_backups
+            config["ui_batch_ms"] = self.ui_batch_ms
+            config["outbox_path"] = self.outbox_path
+            config["batch_url"] = self.batch_url
+            config["batch_size"] = self.batch_size
+            config["compression"] = self.compression
+            config["compact_payload"] = self.compact_payload
             
             # 保存配置
             with open("config.json", "w") as f:
@@ -398,6 +643,10 @@ class GeeseUI:
             if new_url:
                 self.server_url = new_url
                 self.log(f"接口地址已更新为: {new_url}")
+                # 发件箱中未上传的结果改为发往新地址并立即重试
+                retargeted = self.uploader.retarget(new_url)
+                if retargeted:
+                    self.log(f"发件箱中 {retargeted} 条结果将发往新的接口地址")
                 # 保存配置
                 self.save_config()
                 dialog.destroy()
@@ -548,6 +797,68 @@ class GeeseUI:
             # 在子线程中，使用after调度到主线程执行
             self.root.after(0, _update_log)
     
+    def drain_results(self):
+        """取出识别线程发布的结果，合并为一次界面更新（主线程中定时调用）
+        
+        结果通道中的消息：
+            ("well", 图片编号, label, 识别结果, 状态)：单个孔位的识别结果
+            ("plate", 图片编号, 整板结果, 各孔位状态, 文件名)：整板识别完成
+        较早开始处理的孔板不会覆盖较新孔板的结果，但完成时仍记录到日志并检查是否自动发送。
+        """
+        changed = False
+        finished = False
+        try:
+            while True:
+                try:
+                    message = self.result_channel.get_nowait()
+                except queue.Empty:
+                    break
+                kind, job_seq = message[0], message[1]
+                if job_seq < self._published_seq:
+                    # 多个消费线程并行时较早的孔板可能晚完成：不覆盖显示，但结果照常发送
+                    if kind == "plate":
+                        self.finish_superseded_plate(job_seq, message[2], message[4])
+                    continue
+                if job_seq > self._published_seq:
+                    # 新孔板的第一个结果：清空上一块孔板的显示
+                    self._published_seq = job_seq
+                    self.qr_results = {}
+                    self.well_status = {}
+                    self.send_status_var.set("未发送")
+                
+                if kind == "well":
+                    _, _, label, data, status = message
+                    if data:
+                        self.qr_results[label] = data
+                    self.well_status[label] = status
+                else:
+                    _, _, qr_results, statuses, _ = message
+                    self.qr_results = qr_results
+                    self.well_status = statuses
+                    finished = True
+                changed = True
+            
+            if changed:
+                with span("ui_refresh"):
+                    self.update_stats()
+                    self.update_map()
+                    self.update_visualization()
+            if finished:
+                # 检查是否需要自动发送
+                self.check_and_send_auto()
+        except Exception as e:
+            self.log(f"更新识别结果显示时出错: {e}")
+        finally:
+            self.root.after(self.ui_batch_ms, self.drain_results)
+    
+    def finish_superseded_plate(self, job_seq, qr_results, file_name):
+        """较早开始处理的孔板在较新的孔板之后完成：记录结果并检查是否自动发送（主线程）"""
+        total_positions = self.rows * self.cols
+        self.log(f"{file_name} 识别完成（已有更新的孔板在显示中），识别 {len(qr_results)}/{total_positions}")
+        if qr_results:
+            self.log(f"{file_name} 识别结果: " + ", ".join(f"{label}={data}" for label, data in qr_results.items()))
+        self.check_and_send_auto(qr_results, job_seq)
+    
     def update_stats(self):
         """更新统计信息"""
         self.stats_text.delete(1.0, tk.END)
@@ -563,7 +874,18 @@ class GeeseUI:
         
         stats = f"总位置数: {total_positions}\n"
         stats += f"已识别二维码: {detected_count}\n"
-        stats += f"识别率: {detection_rate:.2f}%\n\n"
+        stats += f"识别率: {detection_rate:.2f}%\n"
+        
+        # 整板超时未识别的孔位
+        timed_out = [pos for pos, status in self.well_status.items() if status == "timeout"]
+        if timed_out:
+            stats += f"超时孔位: {len(timed_out)} ({', '.join(timed_out)})\n"
+        
+        # 预判为空（没有试管）而跳过识别的孔位
+        empty_wells = [pos for pos, status in self.well_status.items() if status == "empty"]
+        if empty_wells:
+            stats += f"空孔位: {len(empty_wells)}\n"
+        stats += "\n"
         
         # 按行统计
         rows = {}
@@ -608,6 +930,18 @@ class GeeseUI:
             self.auto_send_btn.config(text="启用自动发送")
             self.log("自动发送已禁用")
     
+    def toggle_reshoot(self):
+        """标记下一张图片为重拍同一孔板（再次点击取消）"""
+        with self.processing_lock:
+            self._reshoot_next = not self._reshoot_next
+            armed = self._reshoot_next
+        if armed:
+            self.reshoot_btn.config(text="取消重拍")
+            self.log("下一张图片按重拍同一孔板处理：未变化的孔位先用上次成功的策略识别")
+        else:
+            self.reshoot_btn.config(text="重拍同一孔板")
+            self.log("已取消重拍同一孔板")
+    
     def toggle_code_mode(self):
         """切换QR/DM识别模式"""
         if self.code_mode == "QR":
@@ -618,104 +952,132 @@ class GeeseUI:
             self.code_mode = "QR"
             self.code_mode_btn.config(text="QR码")
             self.log("已切换到QR码识别模式")
+            self.start_warmup()
+        self.update_decoder_status()
         
         # 保存配置
         self.save_config()
     
     def generate_data_id(self):
         """生成15位随机数字作为data_id"""
-        return ''.join(random.choices(string.digits, k=15))
+        return generate_data_id()
     
-    def send_results(self, auto_send=False):
-        """发送结果到后端"""
-        if not self.qr_results:
+    def send_results(self, auto_send=False, qr_results=None, plate_seq=None):
+        """发送结果到后端
+        
+        Args:
+            auto_send: 是否为自动发送
+            qr_results: 要发送的孔板结果，None表示当前显示的孔板
+            plate_seq: 孔板的图片编号（qr_results不为None时使用）
+        """
+        if qr_results is None:
+            qr_results = self.qr_results
+            plate_seq = self._published_seq
+        displayed = plate_seq == self._published_seq
+        if not qr_results:
             self.log("没有可发送的二维码识别结果")
             self.send_status_var.set("无数据")
             return
         
         try:
-            # 计算总位置数 - 使用实际应用的行列数
-            total_positions = self.rows * self.cols
-            
             # 生成15位随机数字作为data_id
             data_id = self.generate_data_id()
             
-            # 准备发送的数据
-            # 生成所有孔位的位置标签
-            all_results = {}
-            for row in range(self.rows):
-                for col in range(self.cols):
-                    pos_label = f"{chr(ord('A') + row)}{col + 1}"
-                    all_results[pos_label] = self.qr_results.get(pos_label, "")
-            
-            data = {
-                "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                "total_positions": total_positions,
-                "detected_count": len(self.qr_results),
-                "data_id": data_id,
-                "machine_id": self.machine_code,
-                "results": all_results
-            }
+            # 准备发送的数据（紧凑格式只发送有结果的孔位和行列数，后端按行列数还原空孔位）
+            data = build_plate_payload(qr_results, self.rows, self.cols, self.machine_code, data_id,
+                                       self.compact_payload)
             
-            # 发送POST请求
+            # 在上传线程中发送POST请求，结果回到主线程处理
             if auto_send:
                 self.log("正在自动发送结果到服务器...")
             else:
                 self.log("正在发送结果到服务器...")
+            if displayed:
+                self.send_status_var.set("发送中")
             
-            response = requests.post(self.server_url, json=data, timeout=10)
-            
-            if response.status_code == 200:
-                result = response.json()
-                if result.get('status') == 'success':
-                    # 验证返回的data_id是否与发送的一致
-                    returned_data_id = result.get('data_id')
-                    if returned_data_id == data_id:
-                        if auto_send:
-                            self.log(f"结果自动发送成功，数据ID验证一致: {returned_data_id}")
-                            self.send_status_var.set("已自动发送成功")
-                        else:
-                            self.log(f"结果发送成功，数据ID验证一致: {returned_data_id}")
-                            self.send_status_var.set("发送成功")
-                        
-                        # 提取后端返回的warning和loc_err字段
-                        warning_positions = result.get('warning', [])
-                        loc_err_positions = result.get('loc_err', [])
-                        
-                        # 更新可视化，显示warning和loc_err区域
-                        self.update_visualization(warning_positions, loc_err_positions)
-                    else:
-                        # data_id不一致，提示数据返回错误
-                        self.log(f"数据返回错误：发送的data_id({data_id})与返回的data_id({returned_data_id})不一致")
-                        self.send_status_var.set("数据返回错误")
-                        messagebox.showerror("数据返回错误", 
-                                           f"发送的data_id({data_id})与返回的data_id({returned_data_id})不一致")
-                else:
-                    self.log(f"发送失败: {result.get('message', '未知错误')}")
-                    self.send_status_var.set("发送失败")
-            else:
-                self.log(f"发送失败，HTTP状态码: {response.status_code}")
-                self.send_status_var.set("发送失败")
-                
-        except requests.exceptions.RequestException as e:
-            self.log(f"发送请求时出错: {e}")
-            self.send_status_var.set("连接错误")
+            # 记录发送的孔板，上传完成时只在同一孔板仍在显示时标记warning和loc_err
+            meta = {"auto_send": auto_send, "session": self._session_token, "plate_seq": plate_seq}
+            self.uploader.submit(self.server_url, data, meta)
         except Exception as e:
             self.log(f"发送结果时出错: {e}")
             self.send_status_var.set("发送错误")
     
-    def check_and_send_auto(self):
-        """检查是否满足自动发送条件并发送结果"""
+    def on_upload_done(self, data, outcome, meta):
+        """处理上传结果（主线程）
+        
+        Args:
+            data: 发送的数据
+            outcome: UploadOutcome
+            meta: 提交时的附加信息：auto_send（是否为自动发送）、session和plate_seq（发送时显示的孔板），
+                显示的孔板已更换或结果来自上次运行时不再标记warning和loc_err
+        """
+        data_id = data["data_id"]
+        auto_send = meta.get("auto_send", False)
+        same_plate = meta.get("session") == self._session_token and meta.get("plate_seq") == self._published_seq
+        if outcome.status == "client_error":
+            # 接口地址或认证配置错误：结果保留在发件箱中，需要操作员修正配置
+            self.log(f"发送数据 {data_id} 失败: {outcome.message}，结果保留在发件箱中，"
+                     f"{outcome.retry_in:.0f} 秒后重试")
+            self.send_status_var.set("接口错误，请检查接口地址")
+            if not self._upload_error_shown:
+                self._upload_error_shown = True
+                messagebox.showerror("发送失败", f"{outcome.message}\n\n接口地址: {self.server_url}\n"
+                                               f"结果已保留在发件箱中，修正接口地址后会自动补发。")
+        elif outcome.retry_in is not None:
+            # 后端暂时不可用，结果保留在发件箱中稍后重试
+            self.log(f"发送数据 {data_id} 失败: {outcome.message}，{outcome.retry_in:.0f} 秒后重试")
+            self.send_status_var.set("连接错误，等待重试")
+        elif outcome.status == "success":
+            self._upload_error_shown = False
+            returned_data_id = outcome.result.get('data_id')
+            if auto_send:
+                self.log(f"结果自动发送成功，数据ID验证一致: {returned_data_id}")
+            else:
+                self.log(f"结果发送成功，数据ID验证一致: {returned_data_id}")
+            if same_plate:
+                self.send_status_var.set("已自动发送成功" if auto_send else "发送成功")
+            
+            # 提取后端返回的warning和loc_err字段
+            warning_positions = outcome.result.get('warning', [])
+            loc_err_positions = outcome.result.get('loc_err', [])
+            
+            # 更新可视化，显示warning和loc_err区域
+            if same_plate:
+                self.update_visualization(warning_positions, loc_err_positions)
+            else:
+                self.log(f"数据 {data_id} 对应的孔板已不在显示中，不再标记warning和loc_err")
+        elif outcome.status == "mismatch":
+            # data_id不一致，提示数据返回错误
+            self.log(f"数据返回错误：{outcome.message}")
+            self.send_status_var.set("数据返回错误")
+            messagebox.showerror("数据返回错误", outcome.message)
+        elif outcome.status == "rejected":
+            self.log(f"后端拒绝了数据 {data_id}: {outcome.message}")
+            self.send_status_var.set("发送失败")
+        else:
+            self.log(f"发送结果时出错: {outcome.message}")
+            self.send_status_var.set("发送错误")
+    
+    def check_and_send_auto(self, qr_results=None, plate_seq=None):
+        """检查是否满足自动发送条件并发送结果
+        
+        Args:
+            qr_results: 要检查的孔板结果，None表示当前显示的孔板
+            plate_seq: 孔板的图片编号（qr_results不为None时使用）
+        """
         if not self.auto_send:
             return
+        if qr_results is None:
+            qr_results = self.qr_results
+            plate_seq = self._published_seq
         
         # 计算总位置数 - 使用实际应用的行列数
         total_positions = self.rows * self.cols
         
         # 检查是否识别了100%的结果
-        if len(self.qr_results) == total_positions:
+        if len(qr_results) == total_positions:
             self.log("检测到100%识别率，自动发送结果...")
-            self.send_results(auto_send=True)
+            self.send_results(True, qr_results, plate_seq)
     
     def update_map(self):
         """更新二维码映射"""
@@ -758,115 +1120,50 @@ class GeeseUI:
         self.map_text.tag_config("selected", background="yellow", foreground="black", font=("Arial", 10, "bold"))
     
     def update_visualization(self, warning_positions=None, loc_err_positions=None):
-        """更新可视化图表"""
-        self.ax.clear()
-        
+        """更新可视化图表（只重绘状态变化的孔位）"""
+        if self.grid_view is None:
+            # 可视化组件尚未加载，加载完成后会显示当前结果
+            return
         if not self.qr_results and self.selected_position is None:
-            self.ax.text(0.5, 0.5, "No Data", horizontalalignment='center', verticalalignment='center', transform=self.ax.transAxes)
-        else:
-            # 创建一个动态大小的网格表示行和列
-            grid = np.zeros((self.rows, self.cols))
-            
-            # 填充网格
-            for pos, value in self.qr_results.items():
+            self.grid_view.show_no_data()
+            return
+        
+        # 创建一个动态大小的网格表示行和列：未识别(0)、成功(1)、warning(2)、loc_err(3)
+        grid = np.zeros((self.rows, self.cols), dtype=int)
+        
+        # 填充网格
+        for pos, value in self.qr_results.items():
+            row = ord(pos[0]) - ord('A')
+            col = int(pos[1:]) - 1
+            if 0 <= row < self.rows and 0 <= col < self.cols:
+                if value:
+                    grid[row, col] = 1
+        
+        # 如果提供了warning和loc_err位置，更新网格
+        if warning_positions is not None and loc_err_positions is not None:
+            # 标记warning位置为2（黄色）
+            for pos in warning_positions:
                 row = ord(pos[0]) - ord('A')
                 col = int(pos[1:]) - 1
                 if 0 <= row < self.rows and 0 <= col < self.cols:
-                    if value:
-                        grid[row, col] = 1
-            
-            # 如果提供了warning和loc_err位置，更新网格
-            if warning_positions is not None and loc_err_positions is not None:
-                # 标记warning位置为2（黄色）
-                for pos in warning_positions:
-                    row = ord(pos[0]) - ord('A')
-                    col = int(pos[1:]) - 1
-                    if 0 <= row < self.rows and 0 <= col < self.cols:
-                        grid[row, col] = 2
-                
-                # 标记loc_err位置为3（红色），优先级高于warning
-                for pos in loc_err_positions:
-                    row = ord(pos[0]) - ord('A')
-                    col = int(pos[1:]) - 1
-                    if 0 <= row < self.rows and 0 <= col < self.cols:
-                        grid[row, col] = 3
-                
-                # 使用四种颜色：未识别(灰色)、成功(绿色)、warning(黄色)、loc_err(红色)
-                cmap = plt.cm.colors.ListedColormap(['lightgray', 'green', 'yellow', 'red'])
-                bounds = [-0.5, 0.5, 1.5, 2.5, 3.5]
-                norm = plt.cm.colors.BoundaryNorm(bounds, cmap.N)
-            else:
-                # 使用两种颜色：未识别(灰色)、成功(绿色)
-                cmap = plt.cm.colors.ListedColormap(['lightgray', 'green'])
-                bounds = [-0.5, 0.5, 1.5]
-                norm = plt.cm.colors.BoundaryNorm(bounds, cmap.N)
-            
-            # 标记选中的孔位（优先级最高）
-            if self.selected_position is not None:
-                row = ord(self.selected_position[0]) - ord('A')
-                col = int(self.selected_position[1:]) - 1
-                if 0 <= row < self.rows and 0 <= col < self.cols:
-                    # 使用特殊值4表示选中，在显示时用蓝色边框
-                    grid[row, col] = 4
-            
-            self.ax.imshow(grid, cmap=cmap, norm=norm, interpolation='nearest')
-            
-            # 添加标签
-            row_labels = [chr(ord('A') + i) for i in range(self.rows)]
-            col_labels = [str(i + 1) for i in range(self.cols)]
-            
-            self.ax.set_xticks(np.arange(self.cols))
-            self.ax.set_yticks(np.arange(self.rows))
-            self.ax.set_xticklabels(col_labels)
-            self.ax.set_yticklabels(row_labels)
-            
-            self.ax.set_title("QR Code Recognition Results")
-            
-            # 在方块中心添加位置序号
-            for row in range(self.rows):
-                for col in range(self.cols):
-                    # 未识别成功的位置或标记为negative/loc_err/选中的位置
-                    if grid[row, col] == 0 or grid[row, col] == 2 or grid[row, col] == 3 or grid[row, col] == 4:
-                        pos_label = f"{chr(ord('A') + row)}{col + 1}"
-                        # 根据状态选择文字颜色
-                        if grid[row, col] == 0:  # 灰色
-                            text_color = 'white'
-                        elif grid[row, col] == 2:  # 黄色
-                            text_color = 'black'
-                        elif grid[row, col] == 3:  # 红色
-                            text_color = 'white'
-                        else:  # 选中（蓝色）
-                            text_color = 'white'
-                        
-                        # 如果是选中的孔位，添加蓝色边框
-                        if grid[row, col] == 4:
-                            # 先恢复原始颜色
-                            if pos_label in self.qr_results:
-                                grid[row, col] = 1  # 绿色
-                            elif warning_positions and pos_label in warning_positions:
-                                grid[row, col] = 2  # 黄色
-                            elif loc_err_positions and pos_label in loc_err_positions:
-                                grid[row, col] = 3  # 红色
-                            else:
-                                grid[row, col] = 0  # 灰色
-                        
-                        self.ax.text(col, row, pos_label, 
-                                   ha='center', va='center', 
-                                   color=text_color, fontsize=10, weight='bold')
+                    grid[row, col] = 2
             
-            # 为选中的孔位添加蓝色边框
-            if self.selected_position is not None:
-                row = ord(self.selected_position[0]) - ord('A')
-                col = int(self.selected_position[1:]) - 1
+            # 标记loc_err位置为3（红色），优先级高于warning
+            for pos in loc_err_positions:
+                row = ord(pos[0]) - ord('A')
+                col = int(pos[1:]) - 1
                 if 0 <= row < self.rows and 0 <= col < self.cols:
-                    # 绘制蓝色矩形边框
-                    rect = plt.Rectangle((col - 0.45, row - 0.45), 0.9, 0.9, 
-                                     fill=False, edgecolor='blue', linewidth=1.5)
-                    self.ax.add_patch(rect)
-            
-            # 不添加颜色条
+                    grid[row, col] = 3
         
-        self.canvas.draw()
+        # 选中的孔位用蓝色边框标记
+        selected = None
+        if self.selected_position is not None:
+            row = ord(self.selected_position[0]) - ord('A')
+            col = int(self.selected_position[1:]) - 1
+            if 0 <= row < self.rows and 0 <= col < self.cols:
+                selected = (row, col)
+        
+        self.grid_view.render(grid, selected)
     
     def on_visualization_click(self, event):
         """处理可视化区域的点击事件"""
@@ -1130,50 +1427,26 @@ class GeeseUI:
             monitor_thread.start()
     
     def monitor_directory(self):
-        """监控目录"""
+        """监控目录（Linux下基于inotify事件，其他平台定时扫描）"""
         # 确保监控目录存在
         if not os.path.exists(self.watch_dir):
             os.makedirs(self.watch_dir)
             self.log(f"创建监控目录: {self.watch_dir}")
         
-        # 获取当前文件列表，但不处理已有文件
-        current_files = set(os.listdir(self.watch_dir))
-        
-        while self.monitoring:
-            try:
-                # 获取当前所有文件
-                all_files = set(os.listdir(self.watch_dir))
-                # 检查新文件
-                new_files = all_files - current_files
-                
-                for file_name in new_files:
-                    file_path = os.path.join(self.watch_dir, file_name)
-                    
-                    # 跳过目录
-                    if os.path.isdir(file_path):
-                        continue
-                    
-                    # 检查文件扩展名
-                    if not (file_name.lower().endswith('.jpg') or file_name.lower().endswith('.png') or 
-                            file_name.lower().endswith('.jpeg') or file_name.lower().endswith('.bmp')):
-                        continue
-                    
-                    self.log(f"检测到新图片: {file_name}")
-                    # 等待0.5秒，确保文件完全传输完成
-                    time.sleep(0.5)
-                    # 在单独的线程中处理图片，避免阻塞监控线程
-                    process_thread = threading.Thread(target=self.process_image, args=(file_path,))
-                    process_thread.daemon = True
-                    process_thread.start()
-                
-                # 关键：更新current_files，避免重复处理
-                current_files = all_files
-                
-                time.sleep(1)  # 每秒检查一次
-                
-            except Exception as e:
-                self.log(f"监控过程中出错: {e}")
-                time.sleep(5)  # 出错后等待5秒再继续
+        # 已有文件不处理，只处理之后新增且传输完成的图片
+        watcher = FolderWatcher(self.watch_dir, self.on_new_image, log=self.log)
+        watcher.run(lambda: self.monitoring)
+    
+    def on_new_image(self, file_path):
+        """监控到新图片且文件传输完成后的回调"""
+        self.log(f"检测到新图片: {os.path.basename(file_path)}")
+        # 加入处理队列；队列满时阻塞监控线程，形成背压
+        if self.job_queue.submit(file_path) == "duplicate":
+            self.log(f"图片已在处理队列中，忽略重复提交: {os.path.basename(file_path)}")
+    
+    def on_queue_depth_change(self, waiting, active):
+        """处理队列深度变化时更新界面（线程安全）"""
+        self.root.after(0, lambda: self.queue_status_var.set(f"队列: {waiting} 等待 / {active} 处理中"))
     
     def process_single_image(self):
         """处理单张图片"""
@@ -1186,10 +1459,13 @@ class GeeseUI:
             return
         
         self.log(f"处理单张图片: {file_path}")
-        # 在单独的线程中处理图片，避免阻塞主线程
-        process_thread = threading.Thread(target=self.process_image, args=(file_path,))
-        process_thread.daemon = True
-        process_thread.start()
+        # 加入处理队列，主线程不等待队列空位
+        status = self.job_queue.submit(file_path, block=False)
+        if status == "duplicate":
+            self.log("该图片已在处理队列中，忽略重复提交")
+        elif status == "full":
+            self.log("处理队列已满，请稍后再试")
+            messagebox.showwarning("警告", "处理队列已满，请稍后再试")
     
     def cleanup_old_files(self, directory, max_files=100):
         """清理目录中的旧文件，只保留最近的max_files个文件
@@ -1227,105 +1503,139 @@ class GeeseUI:
             pass
 
     def process_image(self, image_path):
-        """处理图片：切割和识别二维码"""
-        # 使用互斥锁确保图片处理是串行的
+        """处理图片：切割和识别二维码（由处理队列的消费线程调用）"""
+        # 按开始处理的顺序编号，多个消费线程并行时只发布比当前结果更新的孔板
         with self.processing_lock:
+            self._job_seq += 1
+            job_seq = self._job_seq
+            # "重拍同一孔板"只对下一块孔板生效
+            reshoot, self._reshoot_next = self._reshoot_next, False
+        if reshoot:
+            self.log(f"按重拍同一孔板处理: {os.path.basename(image_path)}")
+            self.root.after(0, lambda: self.reshoot_btn.config(text="重拍同一孔板"))
+        
+        # 本块孔板各阶段的耗时都带上图片名和编号记录到跟踪文件
+        with trace_context(image=os.path.basename(image_path), plate=job_seq), span("plate"):
+            self._process_image(image_path, job_seq, reshoot)
+    
+    def _process_image(self, image_path, job_seq, reshoot=False):
+        """切割和识别一张图片，识别结果通过结果通道发布"""
+        try:
+            file_name = os.path.basename(image_path)
+            
+            # 检查文件是否可读
+            if not os.path.exists(image_path):
+                self.log(f"文件不存在: {image_path}")
+                return
+            
+            # 检查模板是否存在
+            template_file = self.get_template_path()
+            if not os.path.exists(template_file):
+                self.log(f"模板文件 {template_file} 不存在，请先画模板")
+                # 在主线程中显示警告对话框
+                self.root.after(0, lambda: messagebox.showwarning("警告", f"模板文件 {template_file} 不存在，请先点击'重新画模板'按钮"))
+                return
+            
+            # 1. 切割图片
+            self.log("步骤1: 切割图片...")
             try:
-                file_name = os.path.basename(image_path)
+                # 清理Result和picture文件夹，只保留最近的100个文件
+                self.cleanup_old_files("Result", max_files=100)
+                self.cleanup_old_files(self.watch_dir, max_files=100)
                 
-                # 检查文件是否可读
-                if not os.path.exists(image_path):
-                    self.log(f"文件不存在: {image_path}")
+                # 读取图片并统计可切割的孔位数
+                with span("imread"):
+                    image = cv2.imread(image_path)
+                if image is None:
+                    self.log(f"无法读取图片: {image_path}")
                     return
-                
-                # 检查模板是否存在
-                template_file = self.get_template_path()
-                if not os.path.exists(template_file):
-                    self.log(f"模板文件 {template_file} 不存在，请先画模板")
-                    # 在主线程中显示警告对话框
-                    self.root.after(0, lambda: messagebox.showwarning("警告", f"模板文件 {template_file} 不存在，请先点击'重新画模板'按钮"))
+                with span("geometry"):
+                    roi_count = self.processor.count_rois(image)
+                if roi_count == 0:
+                    self.log("切割失败，跳过二维码识别")
                     return
                 
-                # 1. 切割图片
-                self.log("步骤1: 切割图片...")
-                try:
-                    # 清理Result和picture文件夹，只保留最近的100个文件
-                    self.cleanup_old_files("Result", max_files=100)
-                    self.cleanup_old_files(self.watch_dir, max_files=100)
-                    
-                    # 确保cut_results目录存在
-                    if not os.path.exists("cut_results"):
-                        os.makedirs("cut_results")
-                        self.log("创建cut_results目录")
-                    else:
-                        # 清空cut_results目录，删除所有文件
-                        for old_name in os.listdir("cut_results"):
-                            old_path = os.path.join("cut_results", old_name)
-                            try:
-                                if os.path.isfile(old_path):
-                                    os.remove(old_path)
-                            except Exception as e:
-                                self.log(f"删除文件 {old_name} 失败: {e}")
-                        self.log("已清空cut_results目录")
-                    
-                    # 获取切割结果
-                    results = self.processor.cut_image(image_path)
-                    if not results:
-                        self.log("切割失败，跳过二维码识别")
-                        return
-                    
-                    # 保存切割结果到cut_results目录
-                    for label, roi in results:
-                        output_path = os.path.join("cut_results", f"{label}.png")
-                        cv2.imwrite(output_path, roi)
-                    
-                    self.log(f"切割完成，共生成 {len(results)} 个子图片")
-                except Exception as e:
-                    self.log(f"切割过程中出错: {e}")
-                    return
+                # 按需逐个切割ROI（原图切片视图，不复制像素）；关闭空孔位预判时识别可以在整板切割完成前开始，
+                # 开启时（默认）要先对整板计算一遍廉价特征，之后才开始识别
+                results = traced_iter("crop", self.processor.iter_cut_image(image))
                 
-                # 2. 识别二维码
-                self.log("步骤2: 识别二维码...")
-                try:
-                    # 确保Result目录存在
-                    if not os.path.exists("Result"):
-                        os.makedirs("Result")
-                        self.log("创建Result目录")
-                    
-                    # 为每个图片创建唯一的输出文件
-                    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                    output_file = os.path.join("Result", f"qr_results_{timestamp}_{os.path.splitext(file_name)[0]}.json")
-                    
-                    # 根据当前模式调用对应的识别函数
-                    if self.code_mode == "QR":
-                        qr_results = process_qr_codes("cut_results", output_file)
-                        self.log(f"二维码识别完成，共识别 {len(qr_results)} 个二维码")
-                    else:
-                        qr_results = process_dm_codes("cut_results", output_file)
-                        self.log(f"DM码识别完成，共识别 {len(qr_results)} 个DM码")
-                    
-                    # 更新当前二维码结果
-                    self.qr_results = qr_results
-                    
-                    # 重置发送状态为"未发送"
-                    self.send_status_var.set("未发送")
-                    
-                    # 更新UI（使用after调度到主线程执行）
-                    self.root.after(0, self.update_stats)
-                    self.root.after(0, self.update_map)
-                    self.root.after(0, lambda: self.update_visualization())
-                    
-                    # 检查是否需要自动发送
-                    self.root.after(0, self.check_and_send_auto)
-                    
-                except Exception as e:
-                    self.log(f"二维码识别过程中出错: {e}")
-                    return
+                # 调试模式下在后台保存切割结果到cut_results目录
+                if self.save_cut_results:
+                    results = list(results)
+                    save_rois_async(results, "cut_results")
+                
+                self.log(f"切割区域已确定，共 {roi_count} 个孔位")
+            except Exception as e:
+                self.log(f"切割过程中出错: {e}")
+                return
+            
+            # 2. 识别二维码
+            self.log("步骤2: 识别二维码...")
+            try:
+                # 确保Result目录存在
+                if not os.path.exists("Result"):
+                    os.makedirs("Result")
+                    self.log("创建Result目录")
                 
-                self.log(f"图片处理完成: {file_name}")
+                # 为每个图片创建唯一的输出文件
+                timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+                output_file = os.path.join("Result", f"qr_results_{timestamp}_{os.path.splitext(file_name)[0]}.json")
+                
+                # 根据当前模式调用对应的识别函数（各孔位并行识别）
+                use_processes = self.worker_mode == "process"
+                plate_stats = StrategyStats()
+                # 按模板和识别模式学习的策略顺序，历史最好的策略优先尝试
+                ranking = get_ranking(template_file, self.code_mode) if self.adaptive_order else None
+                # 单孔预算和整板时限，超时的孔位标记为timeout，已识别的结果立即显示
+                well_budget = self.well_budget_ms / 1000 if self.well_budget_ms else None
+                statuses = {}
+                # 整板先一次性识别，分配到孔位的结果不再逐孔识别
+                known = None
+                if self.plate_first:
+                    detect_plate = detect_qr_plate if self.code_mode == "QR" else detect_dm_plate
+                    with span("plate_detect"):
+                        known = detect_plate(image, self.processor, self.plate_tiles, plate_stats)
+                    self.log(f"整板识别到 {len(known)} 个孔位，其余 {roi_count - len(known)} 个孔位逐孔识别")
+                # 每块孔板都记录各孔位的结果和识别策略（指纹只在重拍时计算）；重拍同一孔板时未变化的孔位先用上次成功的策略识别
+                well_cache = get_well_cache(template_file, self.code_mode)
+                reuse_wells = reshoot or self.reuse_unchanged_wells
+                # 每个孔位识别完成后立即发布到结果通道，界面边识别边显示
+                def on_result(label, data, status):
+                    self.result_channel.put(("well", job_seq, label, data, status))
+                
+                decode_rois = decode_qr_rois if self.code_mode == "QR" else decode_dm_rois
+                with span("decode", mode=self.code_mode):
+                    qr_results = decode_rois(results, output_file, self.workers, use_processes, plate_stats, ranking,
+                                             well_budget, self.plate_timeout_s, statuses, self.skip_empty_wells,
+                                             known, well_cache, self.decode_cache, on_result, reuse_wells)
+                if self.code_mode == "QR":
+                    self.log(f"二维码识别完成，共识别 {len(qr_results)} 个二维码")
+                else:
+                    self.log(f"DM码识别完成，共识别 {len(qr_results)} 个DM码")
+                empty_wells = [label for label, status in statuses.items() if status == "empty"]
+                if empty_wells:
+                    self.log(f"{len(empty_wells)} 个空孔位已跳过识别")
+                timed_out = [label for label, status in statuses.items() if status == "timeout"]
+                if timed_out:
+                    self.log(f"整板识别超过 {self.plate_timeout_s} 秒，{len(timed_out)} 个孔位超时: {', '.join(timed_out)}")
+                self.log(f"各识别策略统计:\n{plate_stats.summary()}")
+                # 本块孔板第一次用到神经网络识别时记录QReader的加载耗时
+                if not self._qreader_load_logged and qreader_load_seconds() is not None:
+                    self._qreader_load_logged = True
+                    self.log(f"QReader模型首次加载耗时 {qreader_load_seconds():.2f} 秒")
+                    self.root.after(0, self.update_decoder_status)
+                
+                # 发布整板的最终结果（由主线程更新界面并检查是否自动发送）
+                self.result_channel.put(("plate", job_seq, qr_results, statuses, file_name))
                 
             except Exception as e:
-                self.log(f"处理图片时发生错误: {e}")
+                self.log(f"二维码识别过程中出错: {e}")
+                return
+            
+            self.log(f"图片处理完成: {file_name}")
+            
+        except Exception as e:
+            self.log(f"处理图片时发生错误: {e}")
     
     def apply_plate_size(self):
         """应用孔版大小设置"""
@@ -1403,9 +1713,18 @@ class GeeseUI:
             self.monitoring = False
             self.log("监控已停止")
         
+        # 停止图片处理队列，关闭识别线程池/进程池
+        self.job_queue.stop()
+        shutdown_executors()
+        if self.decode_cache is not None:
+            self.decode_cache.close()
+        self.uploader.close()
+        close_tracing()
+        
         # 关闭Matplotlib图形和清理资源
         try:
             if hasattr(self, 'fig') and self.fig is not None:
+                import matplotlib.pyplot as plt
                 plt.close(self.fig)
                 self.fig = None
             if hasattr(self, 'canvas') and self.canvas is not None:
@@ -1452,6 +1771,10 @@ class GeeseUI:
                 self.log(f"设置窗口图标失败: {e}")
 
 if __name__ == "__main__":
+    # 打包为exe后使用进程池识别时需要
+    import multiprocessing
+    multiprocessing.freeze_support()
+    
     # 在创建Tk窗口之前设置AppUserModelID，确保任务栏图标正确显示
     if platform.system() == "Windows":
         try:
@@ -1,81 +1,133 @@
 import os
-import json
+import time
+import threading
 import cv2
-import numpy as np
 from pyzbar.pyzbar import decode, ZBarSymbol
 import zxingcpp
-from qreader import QReader
 
-# ---------- 解码逻辑 ----------
-def _decode_with_backoffs(img):
-    """多模式QR码识别，针对不完整QR码优化
+from decode_chain import DecoderChain, Strategy, StrategyUnavailable, iter_tiles, decode_rois, \
+    serialized, unbudgeted
+
+# ---------- QReader模型缓存 ----------
+# qreader依赖ultralytics和torch，导入和构造（加载qrdet检测模型）都很慢，
+# 只在第一次需要神经网络识别时才导入，进程内只创建一次
+_qreader = None
+_qreader_lock = threading.Lock()
+_qreader_load_seconds = None
+_qreader_warming = False  # 后台预热进行中，识别链暂时跳过QReader策略
+# 多线程识别时共享同一个模型，推理需要串行
+_qreader_infer_lock = threading.Lock()
+
+def get_qreader():
+    """获取进程内共享的QReader实例（首次调用时才导入qreader并加载模型）"""
+    global _qreader, _qreader_load_seconds
+    if _qreader is None:
+        with _qreader_lock:
+            if _qreader is None:
+                start = time.perf_counter()
+                from qreader import QReader
+                imported = time.perf_counter()
+                _qreader = QReader()
+                _qreader_load_seconds = time.perf_counter() - start
+                print(f"QReader已加载：导入qreader耗时 {imported - start:.2f} 秒，"
+                      f"加载模型耗时 {_qreader_load_seconds - (imported - start):.2f} 秒")
+    return _qreader
+
+def qreader_load_seconds():
+    """QReader的导入和模型加载总耗时（秒），尚未加载时返回None"""
+    return _qreader_load_seconds
+
+def warmup_qreader():
+    """预热QReader：加载模型并对一张合成的小图做一次推理，供界面启动时在后台线程中调用
     
-    策略说明：
-        - 模式一：Pyzbar和OpenCV（原图+2倍放大）
-        - 模式二：QReader（原图+2倍放大）
-        - 模式三：ZXing（原图+2倍灰度图）
+    预热期间识别链跳过QReader策略，先到的孔板只用基础识别器，不等待模型加载。
     
-    Args:
-        img: 输入图像
-        
     Returns:
-        tuple: (识别方法标签, 识别结果) 或 (None, None)
+        bool: 模型是否加载成功
     """
-    # 预处理：计算2倍放大图像，使用INTER_NEAREST插值避免边缘伪影
-    img2x = cv2.resize(img, None, fx=2.0, fy=2.0, interpolation=cv2.INTER_NEAREST)
-    
-    # 模式一：Pyzbar识别和OpenCV识别（原图和2倍放大图）
+    global _qreader_warming
+    _qreader_warming = True
     try:
-        codes = decode(img, symbols=[ZBarSymbol.QRCODE])
-        if codes:
-            return "M1-Pyzbar", codes[0].data.decode("utf-8", errors="ignore")
-        
-        codes = decode(img2x, symbols=[ZBarSymbol.QRCODE])
-        if codes:
-            return "M1-Pyzbar-2x", codes[0].data.decode("utf-8", errors="ignore")
-    except Exception:
-        pass
+        qreader = get_qreader()
+        # 第一次推理还要初始化torch，用合成的二维码跑一次，真实孔位不再承担这部分开销
+        start = time.perf_counter()
+        image = cv2.resize(cv2.QRCodeEncoder.create().encode("warmup"), (96, 96), interpolation=cv2.INTER_NEAREST)
+        with _qreader_infer_lock:
+            qreader.detect_and_decode(image=cv2.cvtColor(image, cv2.COLOR_GRAY2BGR))
+        print(f"QReader预热推理耗时 {time.perf_counter() - start:.2f} 秒")
+        return True
+    except Exception as e:
+        print(f"QReader模型加载失败: {e}")
+        return False
+    finally:
+        _qreader_warming = False
 
-    try:
-        qrd = cv2.QRCodeDetector()
-        data, _, _ = qrd.detectAndDecode(img)
-        if data:
-            return "M1-OpenCV", data
-        
-        data, _, _ = qrd.detectAndDecode(img2x)
-        if data:
-            return "M1-OpenCV-2x", data
-    except Exception:
-        pass
-    
-    # 模式二：QReader识别（对不完整QR码效果最好）
-    try:
-        qreader = QReader()
+def qreader_ready():
+    """QReader模型是否已加载完成（并且不在预热中）"""
+    return _qreader is not None and not _qreader_warming
+
+# ---------- 识别策略 ----------
+def _run_pyzbar(img, detectors):
+    codes = decode(img, symbols=[ZBarSymbol.QRCODE])
+    return codes[0].data.decode("utf-8", errors="ignore") if codes else None
+
+def _run_opencv(img, detectors):
+    data, _, _ = detectors["opencv"].detectAndDecode(img)
+    return data or None
+
+def _run_qreader(img, detectors):
+    if _qreader_warming:
+        raise StrategyUnavailable("QReader预热中")
+    # 没有预热时第一次用到才加载模型，加载和排队等待推理锁的时间都不计入孔位预算
+    with unbudgeted():
+        qreader = get_qreader()
+    with serialized(_qreader_infer_lock):
         result = qreader.detect_and_decode(image=img)
-        if result and result[0]:
-            return "M2-QReader", result[0]
+    return result[0] if result and result[0] else None
+
+def _run_zxing(img, detectors):
+    results = zxingcpp.read_barcodes(img)
+    return results[0].text if results else None
+
+# 识别链，策略说明：
+#     - 模式一：Pyzbar和OpenCV（原图+2倍放大）
+#     - 模式二：QReader（原图，对不完整QR码效果最好）
+#     - 模式三：ZXing（原图+2倍灰度图）
+QR_CHAIN = DecoderChain([
+    Strategy("M1-Pyzbar", "original", _run_pyzbar),
+    Strategy("M1-Pyzbar-2x", "2x", _run_pyzbar),
+    Strategy("M1-OpenCV", "original", _run_opencv),
+    Strategy("M1-OpenCV-2x", "2x", _run_opencv),
+    Strategy("M2-QReader", "original", _run_qreader),
+    Strategy("M3-ZXing", "original", _run_zxing),
+    Strategy("M3-ZXing-2x-灰度", "2x_gray", _run_zxing),
+], detector_factories={"opencv": cv2.QRCodeDetector}, mode="QR", code_name="二维码")
+
+# ---------- 解码逻辑 ----------
+def _decode_traced(img, order=None, budget=None):
+    """多模式QR码识别，同时返回各策略耗时
+    
+    Args:
+        img: 输入图像
+        order: 策略尝试顺序（策略名列表），None表示默认顺序
+        budget: 单个孔位的时间预算（秒），None表示不限
         
-    except Exception:
-        pass
+    Returns:
+        tuple: (识别方法标签, 识别结果, 各策略耗时列表)，未识别时前两项为None
+    """
+    return QR_CHAIN.decode(img, order, budget)
+
+def _decode_with_backoffs(img):
+    """多模式QR码识别，针对不完整QR码优化（策略见QR_CHAIN）
     
-    # 模式三：ZXing识别
-    try:
-        results = zxingcpp.read_barcodes(img)
-        if results:
-            return "M3-ZXing", results[0].text
+    Args:
+        img: 输入图像
         
-        # 2倍放大灰度图
-        img2x_gray = cv2.resize(img, None, fx=2.0, fy=2.0, interpolation=cv2.INTER_NEAREST)
-        img2x_gray = cv2.cvtColor(img2x_gray, cv2.COLOR_BGR2GRAY)
-            
-        results = zxingcpp.read_barcodes(img2x_gray)
-        if results:
-            return "M3-ZXing-2x-灰度", results[0].text
-            
-    except Exception:
-        pass
-
-    return None, None
+    Returns:
+        tuple: (识别方法标签, 识别结果) 或 (None, None)
+    """
+    method, data, _ = QR_CHAIN.decode(img)
+    return method, data
 
 def decode_qr_code(image_path):
     """识别单个图像中的二维码"""
@@ -90,7 +142,61 @@ def decode_qr_code(image_path):
         return data
     return None
 
+# ---------- 整板识别 ----------
+def detect_qr_plate(image, processor, tiles=1, stats=None):
+    """整板一次性识别多个QR码，并按条码中心点分配到孔位
+    
+    干净的孔板通常一次就能识别出大部分孔位，只有未分配到结果的孔位才需要逐孔识别。
+    
+    Args:
+        image: 整板图像
+        processor: 已加载模板的TubePlateProcessor
+        tiles: 每个方向的分块数，大于1时除整图外还会分块识别小尺寸条码
+        stats: 可选的StrategyStats，记录整板识别耗时
+        
+    Returns:
+        dict: {label: 识别结果}
+    """
+    start = time.perf_counter()
+    symbols = []
+    for x0, y0, tile in iter_tiles(image, tiles):
+        try:
+            for result in zxingcpp.read_barcodes(tile, formats=zxingcpp.BarcodeFormat.QRCode):
+                p = result.position
+                cx = (p.top_left.x + p.top_right.x + p.bottom_left.x + p.bottom_right.x) / 4
+                cy = (p.top_left.y + p.top_right.y + p.bottom_left.y + p.bottom_right.y) / 4
+                symbols.append((result.text, x0 + cx, y0 + cy))
+        except Exception as e:
+            print(f"ZXing整板识别失败: {e}")
+        try:
+            for code in decode(tile, symbols=[ZBarSymbol.QRCODE]):
+                rect = code.rect
+                text = code.data.decode("utf-8", errors="ignore")
+                symbols.append((text, x0 + rect.left + rect.width / 2, y0 + rect.top + rect.height / 2))
+        except Exception as e:
+            print(f"Pyzbar整板识别失败: {e}")
+
+    assigned = processor.assign_symbols(symbols, image.shape[1], image.shape[0])
+    if stats is not None:
+        stats.record([("P-整板识别", time.perf_counter() - start, bool(assigned))])
+    print(f"整板识别: 找到 {len(symbols)} 个条码，分配到 {len(assigned)} 个孔位")
+    return assigned
+
 # ---------- 批量处理 ----------
+def decode_qr_rois(rois, *args, **kwargs):
+    """批量识别内存中的ROI图像中的QR码，参数和返回值见decode_chain.decode_rois"""
+    return decode_rois(QR_CHAIN, _decode_traced, rois, *args, **kwargs)
+
+def _iter_png_rois(cut_results_dir, png_files):
+    """逐个读取目录中的PNG图像，生成 (label, ndarray) 序列"""
+    for png_file in png_files:
+        image_path = os.path.join(cut_results_dir, png_file)
+        img = cv2.imread(image_path, cv2.IMREAD_COLOR)
+        if img is None:
+            print(f"无法读取图片: {image_path}")
+            continue
+        yield os.path.splitext(png_file)[0], img
+
 def process_qr_codes(cut_results_dir="cut_results", output_file="qr_results.json"):
     """批量处理目录中的PNG图像，识别其中的二维码"""
     if not os.path.exists(cut_results_dir):
@@ -103,23 +209,7 @@ def process_qr_codes(cut_results_dir="cut_results", output_file="qr_results.json
         return {}
 
     print(f"找到 {len(png_files)} 个 PNG 文件，开始识别二维码...")
-    results = {}
-
-    for png_file in png_files:
-        label = os.path.splitext(png_file)[0]
-        image_path = os.path.join(cut_results_dir, png_file)
-        qr_data = decode_qr_code(image_path)
-        if qr_data:
-            results[label] = qr_data
-            print(f"识别成功: {label} -> {qr_data}")
-        else:
-            print(f"未识别到二维码: {label}")
-
-    with open(output_file, 'w', encoding='utf-8') as f:
-        json.dump(results, f, ensure_ascii=False, indent=2)
-
-    print(f"识别结果已保存到: {output_file}")
-    return results
+    return decode_qr_rois(_iter_png_rois(cut_results_dir, png_files), output_file)
 
 # ---------- 主入口 ----------
 if __name__ == "__main__":
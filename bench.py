@@ -0,0 +1,219 @@
+"""切割和识别流程的性能测试：生成合成孔板，输出各阶段耗时分位数、每秒孔位数和识别率（JSON）
+
+用法:
+    python bench.py                                   # QR码，9x9、8x12、16x24、20x20各3块孔板
+    python bench.py --mode DM --sizes 8x12 --plates 10 --blur 1.0 --rotation 30 --empty 0.2
+    python bench.py --output bench_qr.json            # 结果写入文件，便于不同版本之间比较
+"""
+import os
+import sys
+import json
+import time
+import random
+import string
+import argparse
+import tempfile
+import contextlib
+import cv2
+import numpy as np
+
+from cut import TubePlateProcessor
+from decode_pool import shutdown_executors
+from decode_chain import StrategyStats
+
+DEFAULT_SIZES = "9x9,8x12,16x24,20x20"
+
+def random_payload(rng, length=10):
+    """随机的样本编号（大写字母和数字）"""
+    return ''.join(rng.choice(string.ascii_uppercase + string.digits) for _ in range(length))
+
+def encode_symbol(mode, payload):
+    """
+    生成条码图像
+    :param mode: "QR" 或 "DM"
+    :param payload: 条码内容
+    :return: 灰度图像（黑色模块为0，白色为255，带静区）
+    """
+    if mode == "QR":
+        return cv2.QRCodeEncoder.create().encode(payload)
+    from pylibdmtx.pylibdmtx import encode as dmtx_encode
+    encoded = dmtx_encode(payload.encode("utf-8"))
+    pixels = np.frombuffer(encoded.pixels, dtype=np.uint8).reshape(encoded.height, encoded.width, encoded.bpp // 8)
+    return cv2.cvtColor(pixels[:, :, :3], cv2.COLOR_RGB2GRAY)
+
+def make_plate(mode, rows, cols, rng, cell=100, code_ratio=0.6, blur=0.0, rotation=0.0, empty=0.1):
+    """
+    生成一块合成孔板
+    :param mode: "QR" 或 "DM"
+    :param rows: 行数
+    :param cols: 列数
+    :param rng: random.Random
+    :param cell: 每个孔位的边长（像素）
+    :param code_ratio: 条码边长占孔位边长的比例
+    :param blur: 高斯模糊的sigma，0表示不模糊
+    :param rotation: 每个条码随机旋转的最大角度（度）
+    :param empty: 空孔位（没有试管）的比例
+    :return: (BGR图像, 模板相对坐标positions, {孔位: 条码内容}，空孔位不在其中)
+    """
+    margin = cell // 2
+    height = rows * cell + 2 * margin
+    width = cols * cell + 2 * margin
+    image = np.full((height, width), 200, dtype=np.uint8)
+    code_px = int(cell * code_ratio)
+    positions = []
+    truth = {}
+    for row in range(rows):
+        for col in range(cols):
+            x0 = margin + col * cell
+            y0 = margin + row * cell
+            # 模板角点顺序为 [左上, 右上, 左下, 右下]，使用相对坐标
+            positions.append([[x0 / width, y0 / height], [(x0 + cell) / width, y0 / height],
+                              [x0 / width, (y0 + cell) / height], [(x0 + cell) / width, (y0 + cell) / height]])
+            if rng.random() < empty:
+                continue
+            label = f"{chr(ord('A') + row)}{col + 1}"
+            payload = random_payload(rng)
+            truth[label] = payload
+
+            # 试管管口和条码
+            center = (x0 + cell // 2, y0 + cell // 2)
+            cv2.circle(image, center, int(cell * 0.46), 120, thickness=-1)
+            cv2.circle(image, center, int(cell * 0.42), 235, thickness=-1)
+            symbol = cv2.resize(encode_symbol(mode, payload), (code_px, code_px), interpolation=cv2.INTER_NEAREST)
+            if rotation:
+                matrix = cv2.getRotationMatrix2D((code_px / 2, code_px / 2), rng.uniform(-rotation, rotation), 1.0)
+                symbol = cv2.warpAffine(symbol, matrix, (code_px, code_px), flags=cv2.INTER_LINEAR,
+                                        borderValue=235)
+            sy = center[1] - code_px // 2
+            sx = center[0] - code_px // 2
+            image[sy:sy + code_px, sx:sx + code_px] = symbol
+
+    if blur > 0:
+        image = cv2.GaussianBlur(image, (0, 0), blur)
+    return cv2.cvtColor(image, cv2.COLOR_GRAY2BGR), positions, truth
+
+def percentiles(samples):
+    """毫秒为单位的耗时分布"""
+    values = np.asarray(samples, dtype=np.float64) * 1000
+    if values.size == 0:
+        return {}
+    return {
+        "p50": round(float(np.percentile(values, 50)), 2),
+        "p90": round(float(np.percentile(values, 90)), 2),
+        "p99": round(float(np.percentile(values, 99)), 2),
+        "max": round(float(values.max()), 2),
+        "mean": round(float(values.mean()), 2),
+    }
+
+def bench_size(mode, rows, cols, args, rng, work_dir):
+    """对一种孔板尺寸运行测试，返回该尺寸的统计结果"""
+    if mode == "QR":
+        from QR import decode_qr_rois as decode_rois
+    else:
+        from DM import decode_dm_rois as decode_rois
+
+    processor = TubePlateProcessor(None)
+    processor.rows = rows
+    processor.cols = cols
+    processor.labels = processor._generate_labels()
+
+    stages = {"imread": [], "cut": [], "decode": [], "plate": []}
+    stats = StrategyStats()
+    wells = non_empty = recognized = wrong = 0
+    for index in range(args.plates):
+        image, positions, truth = make_plate(mode, rows, cols, rng, args.cell, args.code_ratio, args.blur,
+                                             args.rotation, args.empty)
+        image_path = os.path.join(work_dir, f"plate_{rows}x{cols}_{index}.png")
+        cv2.imwrite(image_path, image)
+        processor.positions = positions
+
+        plate_start = time.perf_counter()
+        image = cv2.imread(image_path)
+        cut_start = time.perf_counter()
+        rois = processor.cut_image(image)
+        decode_start = time.perf_counter()
+        results = decode_rois(rois, None, args.workers, args.processes, stats, None,
+                              args.well_budget_ms / 1000 if args.well_budget_ms else None, None, None,
+                              not args.no_skip_empty)
+        end = time.perf_counter()
+
+        stages["imread"].append(cut_start - plate_start)
+        stages["cut"].append(decode_start - cut_start)
+        stages["decode"].append(end - decode_start)
+        stages["plate"].append(end - plate_start)
+        wells += len(rois)
+        non_empty += len(truth)
+        recognized += sum(1 for label, payload in truth.items() if results.get(label) == payload)
+        wrong += sum(1 for label, data in results.items() if truth.get(label) != data)
+
+    total_time = sum(stages["plate"])
+    return {
+        "plates": args.plates,
+        "wells": wells,
+        "non_empty_wells": non_empty,
+        "recognized": recognized,
+        "wrong": wrong,
+        "recognition_rate": round(recognized / non_empty, 4) if non_empty else None,
+        "wells_per_s": round(wells / total_time, 1) if total_time else None,
+        "stages_ms": {name: percentiles(samples) for name, samples in stages.items()},
+        "strategies": {name: {"attempts": entry["attempts"], "hits": entry["hits"],
+                              "time_ms": round(entry["time"] * 1000, 1)}
+                       for name, entry in stats.snapshot().items()},
+    }
+
+def parse_sizes(text):
+    sizes = []
+    for item in text.split(","):
+        rows, cols = item.lower().split("x")
+        sizes.append((int(rows), int(cols)))
+    return sizes
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Geese Gaze 切割和识别流程性能测试")
+    parser.add_argument("--mode", choices=("QR", "DM"), default="QR", help="条码类型（默认QR）")
+    parser.add_argument("--sizes", default=DEFAULT_SIZES, help=f"孔板尺寸，行x列，逗号分隔（默认{DEFAULT_SIZES}）")
+    parser.add_argument("--plates", type=int, default=3, help="每种尺寸的孔板数（默认3）")
+    parser.add_argument("--cell", type=int, default=100, help="孔位边长像素（默认100）")
+    parser.add_argument("--code-ratio", type=float, default=0.6, help="条码边长占孔位的比例（默认0.6）")
+    parser.add_argument("--blur", type=float, default=0.0, help="高斯模糊sigma（默认0）")
+    parser.add_argument("--rotation", type=float, default=0.0, help="条码随机旋转的最大角度（默认0）")
+    parser.add_argument("--empty", type=float, default=0.1, help="空孔位比例（默认0.1）")
+    parser.add_argument("--seed", type=int, default=0, help="随机种子，相同种子生成相同的孔板（默认0）")
+    parser.add_argument("--workers", type=int, default=None, help="并行识别的工作数（默认自动）")
+    parser.add_argument("--processes", action="store_true", help="使用进程池识别（默认线程池）")
+    parser.add_argument("--well-budget-ms", type=int, default=1500, help="单个孔位的识别时间预算，0表示不限（默认1500）")
+    parser.add_argument("--no-skip-empty", action="store_true", help="不跳过空孔位")
+    parser.add_argument("--output", help="结果JSON写入的文件（默认输出到标准输出）")
+    args = parser.parse_args(argv)
+
+    rng = random.Random(args.seed)
+    report = {
+        "mode": args.mode,
+        "settings": {name: value for name, value in vars(args).items() if name != "output"},
+        "sizes": {},
+    }
+    try:
+        with tempfile.TemporaryDirectory(prefix="geese_bench_") as work_dir:
+            # 识别模块逐孔打印的日志转到标准错误，标准输出只保留JSON结果
+            with contextlib.redirect_stdout(sys.stderr):
+                for rows, cols in parse_sizes(args.sizes):
+                    start = time.perf_counter()
+                    report["sizes"][f"{rows}x{cols}"] = bench_size(args.mode, rows, cols, args, rng, work_dir)
+                    print(f"{rows}x{cols} 完成，耗时 {time.perf_counter() - start:.1f} 秒")
+    finally:
+        shutdown_executors()
+
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + "\n")
+        print(f"结果已保存到: {args.output}", file=sys.stderr)
+    else:
+        print(text)
+    return 0
+
+if __name__ == "__main__":
+    # 使用进程池识别时需要
+    import multiprocessing
+    multiprocessing.freeze_support()
+    sys.exit(main())
@@ -2,6 +2,7 @@ import cv2
 import numpy as np
 import json
 import os
+import threading
 
 # 可配置参数：ROI扩展比例
 # 1.0 表示不扩展，1.2 表示向四个方向各扩展20%，以此类推
@@ -15,6 +16,9 @@ class TubePlateProcessor:
         """
         self.template_file = template_file
         self.positions = None
+        self._position_array = None  # positions对应的 (N,4,2) 相对坐标数组
+        self._position_source = None  # 生成_position_array时的positions对象
+        self._box_cache = {}  # (宽, 高, 扩展比例) -> (ROI框数组, 有效标记)
         self.rows = 9  # 默认行数
         self.cols = 9   # 默认列数
         self.labels = self._generate_labels()
@@ -63,6 +67,7 @@ class TubePlateProcessor:
                 template_data = json.load(f)
             
             self.positions = template_data.get('positions', [])
+            self._build_position_array()
             
             # 加载孔版行列数信息，如果不存在则使用默认值
             self.rows = template_data.get('rows', 9)
@@ -84,99 +89,182 @@ class TubePlateProcessor:
         :param image_path: 图像文件路径
         :return: 切割后的图像列表，每个元素为 (label, roi)
         """
+        results = list(self.iter_cut_image(image_path))
+        if results:
+            print(f"已切割图像: {len(results)} 个区域")
+        return results
+    
+    def iter_cut_image(self, image):
+        """
+        逐个生成孔位ROI，识别可以在整块孔板切割完成前开始
+        ROI是原图的切片视图，不复制像素，峰值内存接近一张原图
+        :param image: 图像文件路径或已读取的图像数组
+        :return: 生成器，每个元素为 (label, roi)
+        """
         if self.positions is None:
             print("没有可用的模板，请先加载或创建模板")
-            return []
+            return
         
         # 读取图像
-        image = cv2.imread(image_path)
-        if image is None:
-            print(f"无法读取图像: {image_path}")
-            return []
+        if isinstance(image, str):
+            image_path = image
+            image = cv2.imread(image_path)
+            if image is None:
+                print(f"无法读取图像: {image_path}")
+                return
         
         # 获取图像尺寸
         img_height = image.shape[0]
         img_width = image.shape[1]
         print(f"处理图片尺寸: {img_width}x{img_height}")
         
-        # 将相对坐标转换为绝对坐标
-        absolute_positions = []
-        for corner_points in self.positions:
-            absolute_corner_points = []
-            for relative_x, relative_y in corner_points:
-                absolute_x = int(relative_x * img_width)
-                absolute_y = int(relative_y * img_height)
-                absolute_corner_points.append((absolute_x, absolute_y))
-            absolute_positions.append(absolute_corner_points)
+        # 一次性计算所有孔位的ROI框（同一尺寸的图片直接使用缓存）
+        boxes, valid = self.get_roi_boxes(img_width, img_height)
+        if len(boxes) > len(self.labels):
+            print(f"警告: 位置数量({len(boxes)})大于标签数量({len(self.labels)})")
         
         # 切割图像
-        results = []
-        for i, corner_points in enumerate(absolute_positions):
-            if i >= len(self.labels):
-                print(f"警告: 位置数量({len(absolute_positions)})大于标签数量({len(self.labels)})")
-                break
-                
-            # 使用_extract_roi方法提取ROI
-            roi = self._extract_roi(image, corner_points)
-            if roi is None:
-                print(f"警告: 无法提取位置 {self.labels[i]} 的ROI")
+        for i in range(min(len(boxes), len(self.labels))):
+            x1, y1, x2, y2 = boxes[i]
+            if not valid[i]:
+                print(f"警告: 无法提取位置 {self.labels[i]} 的ROI，区域太小: {x2-x1}x{y2-y1}")
                 continue
             
-            # 添加到结果列表
-            results.append((self.labels[i], roi))
+            yield self.labels[i], image[y1:y2, x1:x2]
+    
+    def count_rois(self, image):
+        """
+        统计图像中可以切割出的孔位数量（不切割图像）
+        :param image: 已读取的图像数组
+        :return: 有效ROI数量
+        """
+        if self.positions is None:
+            print("没有可用的模板，请先加载或创建模板")
+            return 0
+        _, valid = self.get_roi_boxes(image.shape[1], image.shape[0])
+        return int(valid[:len(self.labels)].sum())
+    
+    def assign_symbols(self, symbols, img_width, img_height):
+        """
+        按中心点把整图识别出的条码分配到孔位
+        :param symbols: [(识别结果, 中心x, 中心y), ...]，坐标为原图像素坐标
+        :param img_width: 图片宽度
+        :param img_height: 图片高度
+        :return: {label: 识别结果}；同一孔位出现不同结果时视为不可靠，不分配
+        """
+        boxes, valid = self.get_roi_boxes(img_width, img_height)
+        n = min(len(boxes), len(self.labels))
+        if n == 0 or not symbols:
+            return {}
+        boxes = boxes[:n]
+        valid = valid[:n]
         
-        print(f"已切割图像: {len(results)} 个区域")
-        return results
+        # (M,1) 的中心点与 (N,) 的ROI框批量比较，落在多个扩展框内时取距离框中心最近的孔位
+        points = np.array([(x, y) for _, x, y in symbols], dtype=np.float64)
+        x = points[:, 0:1]
+        y = points[:, 1:2]
+        inside = (x >= boxes[:, 0]) & (x < boxes[:, 2]) & (y >= boxes[:, 1]) & (y < boxes[:, 3]) & valid
+        center_x = (boxes[:, 0] + boxes[:, 2]) / 2
+        center_y = (boxes[:, 1] + boxes[:, 3]) / 2
+        distance = np.where(inside, (x - center_x) ** 2 + (y - center_y) ** 2, np.inf)
+        nearest = distance.argmin(axis=1)
+        
+        assigned = {}
+        conflicts = set()
+        for m, (text, _, _) in enumerate(symbols):
+            i = nearest[m]
+            if not np.isfinite(distance[m, i]):
+                continue
+            label = self.labels[i]
+            if label in assigned and assigned[label] != text:
+                conflicts.add(label)
+            assigned[label] = text
+        for label in conflicts:
+            print(f"警告: 孔位 {label} 在整板识别中出现多个不同结果，改为单孔识别")
+            del assigned[label]
+        return assigned
+    
+    def _build_position_array(self):
+        """把模板中的相对角点坐标转换为 (N,4,2) 数组，并清空ROI框缓存"""
+        positions = self.positions if self.positions is not None else []
+        self._position_array = np.asarray(positions, dtype=np.float64).reshape(-1, 4, 2)
+        self._position_source = self.positions
+        self._box_cache = {}
     
-    def _extract_roi(self, img, corner_points):
+    def get_roi_boxes(self, img_width, img_height):
         """
-        提取孔的ROI区域
-        :param img: 输入图片
-        :param corner_points: 孔的四个角点坐标 [左上, 右上, 左下, 右下]
-        :return: ROI区域
+        计算所有孔位在给定图片尺寸下的ROI框（向量化计算，按尺寸缓存）
+        :param img_width: 图片宽度
+        :param img_height: 图片高度
+        :return: (boxes, valid)，boxes为 (N,4) 整数数组 [x1, y1, x2, y2]，valid为 (N,) 布尔数组
         """
-        # 获取四个角点坐标
-        top_left, top_right, bottom_left, bottom_right = corner_points
+        if self._position_array is None or self._position_source is not self.positions:
+            self._build_position_array()
         
-        # 确保坐标是整数
-        top_left = (int(top_left[0]), int(top_left[1]))
-        top_right = (int(top_right[0]), int(top_right[1]))
-        bottom_left = (int(bottom_left[0]), int(bottom_left[1]))
-        bottom_right = (int(bottom_right[0]), int(bottom_right[1]))
+        key = (img_width, img_height, ROI_EXPANSION_RATIO)
+        cached = self._box_cache.get(key)
+        if cached is not None:
+            return cached
         
-        # 计算原始宽度和高度
-        width = top_right[0] - top_left[0]
-        height = bottom_left[1] - top_left[1]
+        # 相对坐标转换为绝对坐标，角点顺序为 [左上, 右上, 左下, 右下]
+        corners = (self._position_array * (img_width, img_height)).astype(np.int64)
+        top_left = corners[:, 0]
+        top_right = corners[:, 1]
+        bottom_left = corners[:, 2]
+        bottom_right = corners[:, 3]
         
-        # 应用ROI扩展比例
+        # 计算原始宽度和高度，并应用ROI扩展比例
+        width = top_right[:, 0] - top_left[:, 0]
+        height = bottom_left[:, 1] - top_left[:, 1]
         expansion = ROI_EXPANSION_RATIO - 1.0  # 计算扩展比例（例如1.2-1.0=0.2，表示扩展20%）
-        expand_x = int(width * expansion)
-        expand_y = int(height * expansion)
+        expand_x = (width * expansion).astype(np.int64)
+        expand_y = (height * expansion).astype(np.int64)
         
-        # 计算扩展后的坐标
-        x1 = max(0, top_left[0] - expand_x)
-        y1 = max(0, top_left[1] - expand_y)
-        x2 = min(img.shape[1], bottom_right[0] + expand_x)
-        y2 = min(img.shape[0], bottom_right[1] + expand_y)
+        # 计算扩展后的坐标并限制在图片范围内
+        x1 = np.maximum(0, top_left[:, 0] - expand_x)
+        y1 = np.maximum(0, top_left[:, 1] - expand_y)
+        x2 = np.minimum(img_width, bottom_right[:, 0] + expand_x)
+        y2 = np.minimum(img_height, bottom_right[:, 1] + expand_y)
         
         # 确保包含边界线：如果扩展比例为1.0，则向右和向下扩展1个像素，包含边界线
         if ROI_EXPANSION_RATIO == 1.0:
-            x2 = min(img.shape[1], x2 + 1)  # 向右扩展1个像素，包含右边界线
-            y2 = min(img.shape[0], y2 + 1)  # 向下扩展1个像素，包含下边界线
-        
-        # 如果ROI区域太小，可能是因为位置在图片边缘
-        if (x2 - x1) < 10 or (y2 - y1) < 10:
-            print(f"警告：位置 {top_left} 的ROI区域太小: {x2-x1}x{y2-y1}")
-            return None
+            x2 = np.minimum(img_width, x2 + 1)
+            y2 = np.minimum(img_height, y2 + 1)
         
-        roi = img[y1:y2, x1:x2]
+        boxes = np.stack([x1, y1, x2, y2], axis=1)
+        # ROI区域太小（可能是因为位置在图片边缘）或为空时视为无效
+        valid = ((x2 - x1) >= 10) & ((y2 - y1) >= 10)
         
-        # 检查ROI是否为空
-        if roi.size == 0:
-            print(f"警告：位置 {top_left} 的ROI为空")
-            return None
-            
-        return roi
+        # 不同尺寸的图片通常只有少数几种，超过上限时清空缓存
+        if len(self._box_cache) >= 8:
+            self._box_cache.clear()
+        self._box_cache[key] = (boxes, valid)
+        return boxes, valid
+
+def save_rois_async(rois, output_dir="cut_results"):
+    """
+    在后台线程中把切割结果写入目录（调试用，不阻塞识别流程）
+    :param rois: (label, roi) 列表
+    :param output_dir: 输出目录，写入前会清空其中的旧文件
+    :return: 写入线程
+    """
+    rois = list(rois)
+
+    def _write():
+        try:
+            os.makedirs(output_dir, exist_ok=True)
+            for old_name in os.listdir(output_dir):
+                old_path = os.path.join(output_dir, old_name)
+                if os.path.isfile(old_path):
+                    os.remove(old_path)
+            for label, roi in rois:
+                cv2.imwrite(os.path.join(output_dir, f"{label}.png"), roi)
+        except Exception as e:
+            print(f"保存切割结果失败: {e}")
+
+    thread = threading.Thread(target=_write, daemon=True)
+    thread.start()
+    return thread
 
 
 if __name__ == "__main__":
@@ -0,0 +1,146 @@
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+import numpy as np
+
+# 内存中最多缓存的孔位识别结果数
+DEFAULT_MEMORY_ENTRIES = 4096
+# 磁盘缓存文件大小上限（MB）
+DEFAULT_DB_MAX_MB = 64
+
+def roi_key(mode, roi):
+    """
+    按ROI像素内容计算缓存键
+    :param mode: 识别模式，"QR" 或 "DM"
+    :param roi: 孔位图像
+    :return: 16字节摘要，像素、尺寸和识别模式都相同时才相同
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(f"{mode}|{roi.shape}|{roi.dtype}".encode())
+    digest.update(np.ascontiguousarray(roi).data)
+    return digest.digest()
+
+class DecodeCache:
+    """按ROI内容寻址的识别结果缓存
+
+    内存层为LRU，可选的磁盘层使用sqlite保存，重启后继续有效。
+    同一张图片重复提交时，各孔位直接返回缓存结果而不必重新跑识别链。
+    未识别的结果也会缓存（只有完整跑完识别链的才缓存），避免对同一张图片重复做最慢的失败识别。
+    """
+
+    def __init__(self, max_entries=DEFAULT_MEMORY_ENTRIES, db_path=None, max_db_mb=DEFAULT_DB_MAX_MB):
+        """
+        :param max_entries: 内存层最多保存的结果数
+        :param db_path: sqlite文件路径，None表示只使用内存
+        :param max_db_mb: 磁盘层文件大小上限（MB），超过时删除最久未使用的结果
+        """
+        self.max_entries = max(1, int(max_entries))
+        self.max_db_bytes = int(max_db_mb * 1024 * 1024)
+        self._memory = OrderedDict()  # key -> (method, data)
+        self._lock = threading.Lock()
+        self._db = None
+        self._dirty = False
+        if db_path:
+            self._open_db(db_path)
+
+    def _open_db(self, db_path):
+        try:
+            directory = os.path.dirname(db_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            db = sqlite3.connect(db_path, check_same_thread=False)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            db.execute("CREATE TABLE IF NOT EXISTS results ("
+                       "key BLOB PRIMARY KEY, method TEXT, data TEXT, used REAL)")
+            db.execute("CREATE INDEX IF NOT EXISTS results_used ON results (used)")
+            db.commit()
+            self._db = db
+        except sqlite3.Error as e:
+            print(f"打开识别结果缓存失败，只使用内存缓存: {e}")
+
+    def get(self, key):
+        """
+        查找缓存
+        :param key: roi_key返回的缓存键
+        :return: (是否命中, (识别方法, 识别结果))，缓存的未识别结果为 (True, (None, None))
+        """
+        with self._lock:
+            value = self._memory.get(key)
+            if value is not None:
+                self._memory.move_to_end(key)
+                return True, value
+            if self._db is None:
+                return False, None
+            try:
+                row = self._db.execute("SELECT method, data FROM results WHERE key = ?", (key,)).fetchone()
+                if row is None:
+                    return False, None
+                self._db.execute("UPDATE results SET used = ? WHERE key = ?", (time.time(), key))
+                self._dirty = True
+            except sqlite3.Error as e:
+                print(f"读取识别结果缓存失败: {e}")
+                return False, None
+            value = (row[0], row[1])
+            self._remember(key, value)
+            return True, value
+
+    def put(self, key, method, data):
+        """
+        保存识别结果（磁盘层在flush时提交）
+        :param key: roi_key返回的缓存键
+        :param method: 识别方法标签，未识别时为None
+        :param data: 识别结果，未识别时为None
+        """
+        value = (method, data)
+        with self._lock:
+            self._remember(key, value)
+            if self._db is None:
+                return
+            try:
+                self._db.execute("INSERT OR REPLACE INTO results (key, method, data, used) VALUES (?, ?, ?, ?)",
+                                 (key, method, data, time.time()))
+                self._dirty = True
+            except sqlite3.Error as e:
+                print(f"写入识别结果缓存失败: {e}")
+
+    def _remember(self, key, value):
+        self._memory[key] = value
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def _db_bytes(self):
+        """磁盘层正在使用的字节数（删除的结果所占页面会被复用，不计入）"""
+        page_count = self._db.execute("PRAGMA page_count").fetchone()[0]
+        free_count = self._db.execute("PRAGMA freelist_count").fetchone()[0]
+        page_size = self._db.execute("PRAGMA page_size").fetchone()[0]
+        return (page_count - free_count) * page_size
+
+    def flush(self):
+        """提交磁盘层的修改，超过大小上限时按最久未使用的顺序删除结果"""
+        with self._lock:
+            if self._db is None or not self._dirty:
+                return
+            try:
+                while self._db_bytes() > self.max_db_bytes:
+                    total = self._db.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+                    if total == 0:
+                        break
+                    self._db.execute("DELETE FROM results WHERE key IN "
+                                     "(SELECT key FROM results ORDER BY used LIMIT ?)", (max(1, total // 4),))
+                self._db.commit()
+                self._dirty = False
+            except sqlite3.Error as e:
+                print(f"保存识别结果缓存失败: {e}")
+
+    def close(self):
+        """提交并关闭磁盘层"""
+        self.flush()
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
@@ -0,0 +1,514 @@
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+from functools import partial
+import cv2
+
+from decode_pool import decode_labeled, TIMED_OUT
+from well_filter import find_empty_wells
+from decode_cache import roi_key
+from stage_trace import span, trace_strategies
+
+# ---------- 图像变体 ----------
+def _to_gray(img):
+    return img if img.ndim == 2 else cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+
+def _binarize(gray):
+    _, binary = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    return binary
+
+# 变体名 -> 构造函数（参数为ImageVariants，可以依赖其他变体）
+# 2倍放大使用INTER_NEAREST插值避免边缘伪影
+VARIANT_BUILDERS = {
+    "original": lambda v: v.original,
+    "2x": lambda v: cv2.resize(v.original, None, fx=2.0, fy=2.0, interpolation=cv2.INTER_NEAREST),
+    "gray": lambda v: _to_gray(v.original),
+    "2x_gray": lambda v: _to_gray(v.get("2x")),
+    "binary": lambda v: _binarize(v.get("gray")),
+    "2x_binary": lambda v: _binarize(v.get("2x_gray")),
+}
+
+def iter_tiles(image, tiles=1, overlap=0.15):
+    """
+    生成整图和分块子图，用于整板多码识别
+    :param image: 整板图像
+    :param tiles: 每个方向的分块数，1表示只使用整图
+    :param overlap: 相邻分块的重叠比例，避免条码被切断
+    :return: 生成器，每个元素为 (x偏移, y偏移, 子图)
+    """
+    yield 0, 0, image
+    if tiles <= 1:
+        return
+    height, width = image.shape[:2]
+    tile_h = height / tiles
+    tile_w = width / tiles
+    pad_y = int(tile_h * overlap)
+    pad_x = int(tile_w * overlap)
+    for row in range(tiles):
+        for col in range(tiles):
+            y0 = max(0, int(row * tile_h) - pad_y)
+            y1 = min(height, int((row + 1) * tile_h) + pad_y)
+            x0 = max(0, int(col * tile_w) - pad_x)
+            x1 = min(width, int((col + 1) * tile_w) + pad_x)
+            yield x0, y0, image[y0:y1, x0:x1]
+
+class ImageVariants:
+    """单个ROI的图像变体，第一次用到时才计算，之后复用"""
+
+    def __init__(self, img):
+        self.original = img
+        self._cache = {}
+
+    def get(self, name):
+        variant = self._cache.get(name)
+        if variant is None:
+            variant = VARIANT_BUILDERS[name](self)
+            self._cache[name] = variant
+        return variant
+
+# ---------- 识别策略 ----------
+class StrategyUnavailable(Exception):
+    """策略暂时不可用（例如模型还在后台加载），识别链跳过该策略且不记录耗时"""
+
+class Strategy:
+    """识别链中的一级策略"""
+
+    def __init__(self, name, variant, run, timeout_ms=None):
+        """
+        :param name: 识别方法标签，例如 "M1-Pyzbar-2x"
+        :param variant: 使用的图像变体名，见VARIANT_BUILDERS
+        :param run: 识别函数 run(img, detectors)，返回识别结果字符串或None；
+            设置了timeout_ms时调用方式为 run(img, detectors, timeout_ms)
+        :param timeout_ms: 识别库自身支持的超时上限（毫秒），会按孔位剩余预算缩短
+        """
+        self.name = name
+        self.variant = variant
+        self.run = run
+        self.timeout_ms = timeout_ms
+
+class StrategyStats:
+    """各策略的尝试次数、命中次数和累计耗时（线程安全）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def record(self, timings):
+        """
+        记录一次识别的各策略耗时
+        :param timings: [(策略名, 耗时秒数, 是否命中[, 开始时间]), ...]
+        """
+        with self._lock:
+            for name, elapsed, hit, *_ in timings:
+                entry = self._stats.setdefault(name, {"attempts": 0, "hits": 0, "time": 0.0})
+                entry["attempts"] += 1
+                entry["hits"] += int(hit)
+                entry["time"] += elapsed
+
+    def merge(self, other):
+        """合并另一个StrategyStats的统计"""
+        for name, entry in other.snapshot().items():
+            with self._lock:
+                mine = self._stats.setdefault(name, {"attempts": 0, "hits": 0, "time": 0.0})
+                mine["attempts"] += entry["attempts"]
+                mine["hits"] += entry["hits"]
+                mine["time"] += entry["time"]
+
+    def snapshot(self):
+        """返回 {策略名: {"attempts", "hits", "time"}} 的副本"""
+        with self._lock:
+            return {name: dict(entry) for name, entry in self._stats.items()}
+
+    def summary(self):
+        """格式化为每个策略一行的文本"""
+        lines = []
+        for name, entry in self.snapshot().items():
+            lines.append(f"{name}: 命中 {entry['hits']}/{entry['attempts']}，耗时 {entry['time'] * 1000:.0f} ms")
+        return "\n".join(lines)
+
+# 当前线程在识别链中不计入孔位时间预算的累计时间（秒）
+_unbudgeted = threading.local()
+
+@contextmanager
+def unbudgeted():
+    """在识别策略中使用，其中花费的时间不计入孔位的时间预算（例如第一次用到时加载模型）"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _unbudgeted.seconds = getattr(_unbudgeted, "seconds", 0.0) + time.perf_counter() - start
+
+@contextmanager
+def serialized(lock):
+    """
+    在识别策略中获取串行执行的锁（例如多个工作线程共享的模型推理锁）
+    排队等待的时间不计入孔位的时间预算，排在后面的孔位不会因为等锁而跳过后续的廉价策略
+    :param lock: threading.Lock
+    """
+    with unbudgeted():
+        lock.acquire()
+    try:
+        yield
+    finally:
+        lock.release()
+
+class DecoderChain:
+    """按顺序尝试各策略的识别链
+
+    识别器对象（例如cv2.QRCodeDetector）在每个工作线程/进程中只创建一次，
+    图像变体按ROI惰性计算并复用，每个策略的耗时和命中情况都会返回给调用方。
+    """
+
+    def __init__(self, strategies, detector_factories=None, mode=None, code_name=None):
+        """
+        :param strategies: Strategy列表，默认按此顺序尝试
+        :param detector_factories: {名称: 无参构造函数}，构造的对象通过detectors传给策略
+        :param mode: 识别模式，"QR" 或 "DM"（用于结果缓存的键）
+        :param code_name: 日志中的条码名称，例如 "二维码"
+        """
+        self.strategies = list(strategies)
+        self.detector_factories = detector_factories or {}
+        self.mode = mode
+        self.code_name = code_name or f"{mode}码"
+        self.stats = StrategyStats()
+        self._local = threading.local()
+
+    @property
+    def names(self):
+        return [strategy.name for strategy in self.strategies]
+
+    def detectors(self):
+        """获取当前线程的识别器对象"""
+        detectors = getattr(self._local, "detectors", None)
+        if detectors is None:
+            detectors = {name: factory() for name, factory in self.detector_factories.items()}
+            self._local.detectors = detectors
+        return detectors
+
+    def ordered(self, order=None):
+        """
+        按给定顺序排列策略，未列出的策略按默认顺序排在后面
+        :param order: 策略名列表，None表示默认顺序
+        """
+        if not order:
+            return self.strategies
+        by_name = {strategy.name: strategy for strategy in self.strategies}
+        ordered = [by_name[name] for name in order if name in by_name]
+        ordered += [strategy for strategy in self.strategies if strategy.name not in order]
+        return ordered
+
+    def decode(self, img, order=None, budget=None):
+        """
+        依次尝试各策略识别图像
+        :param img: 输入图像
+        :param order: 策略尝试顺序（策略名列表），None表示默认顺序
+        :param budget: 单个孔位的时间预算（秒），用完后不再尝试后续策略，None表示不限；
+            策略在unbudgeted()或serialized()中花费的时间（加载模型、等待串行锁）不计入预算
+        :return: (识别方法标签, 识别结果, 各策略耗时列表) ，未识别时前两项为None；
+            耗时列表的每一项为 (策略名, 耗时秒数, 是否命中, 开始时间time.perf_counter())
+        """
+        variants = ImageVariants(img)
+        detectors = self.detectors()
+        timings = []
+        well_start = time.perf_counter()
+        _unbudgeted.seconds = 0.0
+        for strategy in self.ordered(order):
+            start = time.perf_counter()
+            remaining_ms = None
+            if budget is not None:
+                remaining_ms = int((budget - (start - well_start - _unbudgeted.seconds)) * 1000)
+                if remaining_ms <= 0:
+                    break
+            try:
+                image = variants.get(strategy.variant)
+                if strategy.timeout_ms is None:
+                    data = strategy.run(image, detectors)
+                else:
+                    timeout_ms = strategy.timeout_ms if remaining_ms is None else min(strategy.timeout_ms, remaining_ms)
+                    data = strategy.run(image, detectors, timeout_ms)
+            except StrategyUnavailable:
+                # 跳过的策略不计入timings，调用方据此知道识别链没有完整跑完
+                continue
+            except Exception:
+                data = None
+            timings.append((strategy.name, time.perf_counter() - start, bool(data), start))
+            if data:
+                return strategy.name, data, timings
+        return None, None, timings
+
+# ---------- 批量识别 ----------
+def _decode_job(decode_fn, budget, job):
+    # job为 (图像, 策略顺序)，同一块孔板的孔位可以使用不同的策略顺序（进程池中调用，必须是模块级函数）
+    img, order = job
+    return decode_fn(img, order=order, budget=budget)
+
+def _hinted_order(names, first):
+    """把指定策略排到最前，其余保持原顺序"""
+    return [first] + [name for name in names if name != first]
+
+def decode_rois(chain, decode_fn, rois, output_file=None, workers=None, use_processes=False, stats=None,
+                ranking=None, well_budget=None, plate_timeout=None, statuses=None, skip_empty=False, known=None,
+                well_cache=None, decode_cache=None, on_result=None, reuse_wells=False):
+    """批量识别内存中的ROI图像，无需先写入cut_results目录（QR码和DM码共用的流程）
+    
+    Args:
+        chain: 使用的DecoderChain
+        decode_fn: 单孔识别函数 decode_fn(img, order, budget)，返回 (识别方法标签, 识别结果, 各策略耗时列表)；
+            使用进程池时必须是模块级函数
+        rois: 可迭代的 (label, ndarray) 序列，例如 TubePlateProcessor.cut_image 的返回值
+        output_file: 结果JSON保存路径，为None时不保存
+        workers: 并行识别的工作线程/进程数，None或0表示自动，1表示顺序识别
+        use_processes: 是否使用进程池代替线程池
+        stats: 可选的StrategyStats，记录本次识别各策略的命中次数和耗时
+        ranking: 可选的StrategyRanking，按历史成功率决定策略顺序并在识别后更新
+        well_budget: 单个孔位的时间预算（秒），None表示不限
+        plate_timeout: 整块孔板的时间上限（秒），到时后剩余孔位标记为超时并立即返回已有结果
+        statuses: 可选的dict，填入每个孔位的状态："ok"、"failed"、"timeout" 或 "empty"
+        skip_empty: 是否先判断空孔位并跳过识别（空孔位状态为 "empty"）。空孔位按整块孔板的参考对比度判断，
+            因此开启时要先取完rois（只保存切片视图和缩小的特征图）再开始识别，rois是生成器时不再边切割边识别
+        known: 已经识别出的 {label: 识别结果}（例如整板识别的结果），这些孔位不再单独识别
+        well_cache: 可选的WellResultCache，识别后保存各孔位的结果和识别成功的策略（重拍时还保存指纹）
+        decode_cache: 可选的DecodeCache，像素完全相同的孔位直接返回缓存的识别结果
+        on_result: 可选的回调 on_result(label, 识别结果, 状态)，每个孔位有结果时立即调用（在调用线程中），
+            用于边识别边显示
+        reuse_wells: 是否为重拍同一块孔板：与well_cache中上次拍摄相比未变化的孔位先用上次成功的策略识别，
+            结果仍由本次识别得到（与上次相同时不必再尝试其他策略）
+        
+    Returns:
+        dict: {label: 识别结果}，只包含识别成功的孔位
+    """
+    results = {}
+    plate_stats = stats if stats is not None else StrategyStats()
+    # 整块孔板使用同一策略顺序，保证结果可复现
+    order = ranking.order(chain.names) if ranking is not None else None
+    job_fn = partial(_decode_job, decode_fn, well_budget)
+    deadline = time.monotonic() + plate_timeout if plate_timeout else None
+    known = known or {}
+    seen_labels = []
+    fingerprints = {}
+    hints = {}  # label -> (上次识别结果, 上次识别成功的策略, 指纹比较耗时)
+    methods = {}
+    cache_keys = {}
+
+    def _report(label, data, status):
+        # 记录孔位状态，并立即通知调用方
+        if statuses is not None:
+            statuses[label] = status
+        if on_result is not None:
+            on_result(label, data, status)
+
+    def _pending(rois):
+        # 记录孔位原始顺序，已知结果的孔位、空孔位和缓存命中的孔位直接跳过
+        for label, img in rois:
+            seen_labels.append(label)
+            # 指纹只在重拍时计算，平时每块孔板只记录结果和识别成功的策略
+            if well_cache is not None and reuse_wells:
+                start = time.perf_counter()
+                fingerprints[label] = well_cache.fingerprint(img)
+                previous = well_cache.lookup(label, fingerprints[label])
+                if previous and label not in known:
+                    hints[label] = previous + (time.perf_counter() - start,)
+            if label in known:
+                results[label] = known[label]
+                _report(label, known[label], "ok")
+                print(f"整板识别成功: {label} -> {known[label]}")
+                continue
+            # 空孔位先于缓存判断：不计算哈希，也不会因为缓存里有"未识别"的记录而被标记为失败
+            if label in empty_wells:
+                _report(label, None, "empty")
+                print(f"空孔位: {label}")
+                continue
+            if decode_cache is not None:
+                start = time.perf_counter()
+                key = roi_key(chain.mode, img)
+                hit, cached = decode_cache.get(key)
+                plate_stats.record([("C-结果缓存", time.perf_counter() - start, hit)])
+                if hit:
+                    method, data = cached
+                    methods[label] = method
+                    if data:
+                        results[label] = data
+                    _report(label, data, "ok" if data else "failed")
+                    if data:
+                        print(f"缓存命中: {label} -> {data} ({method})")
+                    else:
+                        print(f"缓存命中（未识别）: {label}")
+                    continue
+                cache_keys[label] = key
+            yield label, img
+
+    # 预先筛掉没有试管的空孔位，避免对空孔位跑完整个识别链。
+    # 参考对比度按整块孔板的全部孔位计算（包括整板识别已识别和缓存命中的孔位），
+    # 否则剩下的孔位大多是空孔时参考对比度过低，一个空孔位也判断不出来。
+    # 只计算缩小后的中心区域特征（8x12孔板约4 ms），哈希、指纹和缓存查询仍在提交识别时逐个进行
+    empty_wells = set()
+    if skip_empty:
+        rois = list(rois)
+        empty_wells = find_empty_wells(rois)
+    rois = _pending(rois)
+
+    # 重拍时未变化的孔位先尝试上次成功的策略，其余孔位使用整块孔板的策略顺序
+    jobs = ((label, (img, _hinted_order(order or chain.names, hints[label][1]) if label in hints else order))
+            for label, img in rois)
+    for label, (method, data, timings) in decode_labeled(jobs, job_fn, workers, use_processes,
+                                                         default=(None, None, []), deadline=deadline,
+                                                         timed_out=(TIMED_OUT, None, [])):
+        if method == TIMED_OUT:
+            _report(label, None, "timeout")
+            print(f"识别超时: {label}")
+            continue
+        if data:
+            results[label] = data
+        methods[label] = method
+        _report(label, data, "ok" if data else "failed")
+        plate_stats.record(timings)
+        if label in hints:
+            previous, previous_method, lookup_time = hints[label]
+            unchanged = data == previous
+            plate_stats.record([("C-沿用上次结果", lookup_time, unchanged)])
+            if unchanged:
+                print(f"孔位未变化（已用 {method} 重新识别确认）: {label}")
+            elif data:
+                print(f"孔位已变化: {label} 上次 {previous}，本次 {data}")
+        trace_strategies(label, timings, method)
+        if ranking is not None:
+            ranking.record(method)
+        # 未识别的结果只有在完整跑完识别链时才缓存（预算用完或出错时下次重新识别）
+        key = cache_keys.get(label)
+        if key is not None and (data or len(timings) == len(chain.strategies)):
+            decode_cache.put(key, method, data)
+        if data:
+            print(f"识别成功: {label} -> {data} ({method})")
+        else:
+            print(f"未识别到{chain.code_name}: {label}")
+
+    # 结果按完成顺序到达，按孔位原始顺序整理
+    results = {label: results[label] for label in seen_labels if label in results}
+
+    # 保存本次指纹、结果和识别成功的策略，供重拍时使用
+    if well_cache is not None:
+        for label in seen_labels:
+            well_cache.update(label, fingerprints.get(label), results.get(label), methods.get(label))
+    if decode_cache is not None:
+        decode_cache.flush()
+
+    if output_file:
+        with span("json_write"), open(output_file, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"识别结果已保存到: {output_file}")
+
+    # 累计到全局统计，便于观察各策略是否值得保留
+    chain.stats.merge(plate_stats)
+    print(plate_stats.summary())
+    if ranking is not None:
+        ranking.save()
+    return results
+
+# ---------- 自适应策略顺序 ----------
+def strategy_tier(name):
+    """策略所在的档，即策略名的前缀，例如 "M1-Pyzbar-2x" -> "M1" """
+    return name.split("-", 1)[0]
+
+class StrategyRanking:
+    """按模板和识别模式学习哪个策略最常识别成功
+
+    每个孔位的识别结果都会让各策略的得分按decay衰减，识别成功的策略加1分，
+    因此得分反映最近一段时间的成功率。新孔板在同一档策略中优先尝试得分最高的策略，
+    学到的得分保存在模板文件旁边，重启后继续使用。
+    """
+
+    def __init__(self, path, decay=0.99):
+        """
+        :param path: 保存得分的JSON文件路径
+        :param decay: 每个孔位的得分衰减系数
+        """
+        self.path = path
+        self.decay = decay
+        self.scores = {}
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        """从文件加载得分，文件不存在或损坏时从零开始"""
+        try:
+            if os.path.exists(self.path):
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    self.scores = {name: float(score) for name, score in json.load(f).get("scores", {}).items()}
+        except Exception as e:
+            print(f"加载策略顺序失败: {e}")
+            self.scores = {}
+
+    def save(self):
+        """保存得分到文件（先写临时文件再替换，中途崩溃或同时保存不会留下损坏的文件）"""
+        with self._lock:
+            data = {"decay": self.decay, "scores": dict(self.scores)}
+        data["best"] = self.best()
+        temp_path = self.path + ".tmp"
+        with self._save_lock:
+            try:
+                with open(temp_path, 'w', encoding='utf-8') as f:
+                    json.dump(data, f, ensure_ascii=False, indent=2)
+                os.replace(temp_path, self.path)
+            except Exception as e:
+                print(f"保存策略顺序失败: {e}")
+
+    def record(self, method):
+        """
+        记录一个孔位的识别结果
+        :param method: 识别成功的策略名，未识别时为None
+        """
+        with self._lock:
+            for name in self.scores:
+                self.scores[name] *= self.decay
+            if method:
+                self.scores[method] = self.scores.get(method, 0.0) + 1.0
+
+    def best(self, names=None):
+        """
+        返回历史得分最高的策略名
+        :param names: 候选策略名，None表示所有已记录的策略
+        :return: 策略名，没有任何记录时返回None
+        """
+        with self._lock:
+            candidates = [(score, name) for name, score in self.scores.items()
+                          if score > 0 and (names is None or name in names)]
+        return max(candidates)[1] if candidates else None
+
+    def order(self, default_names):
+        """
+        返回建议的策略顺序
+        :param default_names: 默认顺序的策略名列表
+        :return: 各档（策略名前缀，例如 "M1"）之间保持默认顺序，同一档内按得分从高到低排列，
+            得分相同时保持默认顺序；慢的策略（例如串行推理的M2-QReader）学得再好也不会排到廉价策略前面
+        """
+        with self._lock:
+            scores = dict(self.scores)
+        tiers = {}
+        for name in default_names:
+            tiers.setdefault(strategy_tier(name), []).append(name)
+        order = []
+        for names in tiers.values():
+            order += sorted(names, key=lambda name: -scores.get(name, 0.0))
+        return order
+
+# 按文件路径缓存，同一模板和模式只加载一次
+_rankings = {}
+_rankings_lock = threading.Lock()
+
+def get_ranking(template_path, mode):
+    """
+    获取某个模板和识别模式的策略顺序
+    :param template_path: 模板文件路径，例如 template_9x9.json
+    :param mode: 识别模式，"QR" 或 "DM"
+    :return: StrategyRanking，得分保存在 template_9x9_QR_strategy.json
+    """
+    path = f"{os.path.splitext(template_path)[0]}_{mode}_strategy.json"
+    with _rankings_lock:
+        ranking = _rankings.get(path)
+        if ranking is None:
+            ranking = StrategyRanking(path)
+            _rankings[path] = ranking
+    return ranking
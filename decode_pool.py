@@ -0,0 +1,103 @@
+import os
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+# 默认工作线程数：pyzbar、zxing-cpp、libdmtx和OpenCV在解码时大多会释放GIL，
+# 因此线程池即可利用多核；最多使用8个
+DEFAULT_WORKERS = min(8, os.cpu_count() or 1)
+
+# 整板截止时间到达时未识别完的孔位使用的识别方法标签
+TIMED_OUT = "timeout"
+
+# 按 (工作数, 是否多进程) 缓存执行器，避免每块孔板重复创建线程/进程
+_executors = {}
+_executors_lock = threading.Lock()
+
+def resolve_workers(workers):
+    """把配置中的workers值转换为实际工作数（None或0表示自动）"""
+    try:
+        workers = int(workers or 0)
+    except (TypeError, ValueError):
+        workers = 0
+    return workers if workers > 0 else DEFAULT_WORKERS
+
+def get_executor(workers=None, use_processes=False):
+    """获取共享的执行器
+
+    Args:
+        workers: 工作线程/进程数，None或0表示自动
+        use_processes: 是否使用进程池（默认线程池）
+
+    Returns:
+        Executor: 线程池或进程池
+    """
+    workers = resolve_workers(workers)
+    key = (workers, bool(use_processes))
+    with _executors_lock:
+        executor = _executors.get(key)
+        if executor is None:
+            executor_cls = ProcessPoolExecutor if use_processes else ThreadPoolExecutor
+            executor = executor_cls(max_workers=workers)
+            _executors[key] = executor
+    return executor
+
+def shutdown_executors():
+    """关闭所有缓存的执行器（程序退出时调用）"""
+    with _executors_lock:
+        executors = list(_executors.values())
+        _executors.clear()
+    for executor in executors:
+        executor.shutdown(wait=False)
+
+def decode_labeled(rois, decode_fn, workers=None, use_processes=False, default=(None, None),
+                   deadline=None, timed_out=None):
+    """并行识别多个孔位，结果按完成顺序返回，慢的孔位不会阻塞其他孔位的结果
+
+    Args:
+        rois: 可迭代的 (label, ndarray) 序列
+        decode_fn: 单孔识别函数，接收图像并返回识别结果；使用进程池时必须是模块级函数
+        workers: 工作线程/进程数，None或0表示自动，1表示在当前线程中顺序执行
+        use_processes: 是否使用进程池
+        default: decode_fn出错时使用的结果
+        deadline: 整块孔板的截止时间（time.monotonic()时间），None表示不限
+        timed_out: 截止时间已到、尚未识别完的孔位使用的结果，None表示与default相同
+
+    Yields:
+        tuple: (label, decode_fn的返回值)
+    """
+    if timed_out is None:
+        timed_out = default
+
+    if resolve_workers(workers) == 1:
+        for label, img in rois:
+            if deadline is not None and time.monotonic() >= deadline:
+                yield label, timed_out
+                continue
+            try:
+                result = decode_fn(img)
+            except Exception as e:
+                print(f"识别孔位 {label} 时出错: {e}")
+                result = default
+            yield label, result
+        return
+
+    # 截止时间到达时其余孔位取消并标记为超时
+    executor = get_executor(workers, use_processes)
+    pending = {executor.submit(decode_fn, img): label for label, img in rois}
+    while pending:
+        timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+        done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+        if not done:
+            for future, label in pending.items():
+                future.cancel()
+                yield label, timed_out
+            return
+        for future in done:
+            label = pending.pop(future)
+            try:
+                result = future.result()
+            except Exception as e:
+                print(f"识别孔位 {label} 时出错: {e}")
+                result = default
+            yield label, result
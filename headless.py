@@ -0,0 +1,301 @@
+"""无界面运行：监控文件夹或处理给定的图片，识别后上传结果（不需要Tk和matplotlib）
+
+用法:
+    python headless.py                     # 监控config.json中的watch_dir
+    python headless.py --watch picture     # 监控指定文件夹
+    python headless.py a.jpg b.jpg --json  # 处理给定的图片，每块孔板的结果以JSON输出到标准输出
+"""
+import os
+import sys
+import json
+import time
+import signal
+import argparse
+import threading
+import contextlib
+from datetime import datetime
+import cv2
+
+from cut import TubePlateProcessor, save_rois_async
+from QR import decode_qr_rois, detect_qr_plate
+from DM import decode_dm_rois, detect_dm_plate
+from decode_pool import shutdown_executors
+from decode_chain import StrategyStats, get_ranking
+from well_cache import get_well_cache
+from decode_cache import DecodeCache
+from watcher import FolderWatcher
+from job_queue import JobQueue
+from uploader import ResultUploader
+from payload_codec import build_plate_payload
+from stage_trace import configure_tracing, close_tracing, trace_context, span, traced_iter
+
+def log(message):
+    """带时间戳的日志，写到标准错误（标准输出留给--json的结果）"""
+    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    print(f"[{timestamp}] {message}", file=sys.stderr, flush=True)
+
+class HeadlessRunner:
+    """无界面的孔板识别服务
+
+    与GeeseUI使用同一个config.json、同一套切割、识别和上传模块，
+    只是没有界面：结果写入Result目录并通过发件箱上传，日志输出到标准错误。
+    """
+
+    def __init__(self, config_path="config.json", upload=True, complete_only=True, on_plate=None):
+        """
+        :param config_path: 配置文件路径（与界面共用）
+        :param upload: 是否上传识别结果
+        :param complete_only: 是否只上传全部孔位都识别成功的孔板（默认是，与界面的自动发送一致）
+        :param on_plate: 每块孔板识别完成后的回调 on_plate(图片路径, 识别结果, 各孔位状态)
+        """
+        self.complete_only = complete_only
+        self.on_plate = on_plate
+        self.load_config(config_path)
+        if configure_tracing(self.trace_path, self.trace_format, self.trace_max_mb, self.trace_backups):
+            log(f"阶段耗时记录到: {self.trace_path}")
+
+        self.processor = TubePlateProcessor(self.get_template_path())
+        self.processor.rows = self.rows
+        self.processor.cols = self.cols
+        self.processor.labels = self.processor._generate_labels()
+
+        self.decode_cache = None
+        if self.decode_cache_size:
+            self.decode_cache = DecodeCache(self.decode_cache_size, self.decode_cache_db or None,
+                                            self.decode_cache_db_mb)
+
+        self.uploader = None
+        if upload:
+            self.uploader = ResultUploader(self.outbox_path or None, on_outcome=self.on_upload_done, log=log,
+                                           batch_url=self.batch_url or None, batch_size=self.batch_size,
+                                           compression=self.compression)
+            # 上次运行留下的结果发往当前配置的接口地址
+            retargeted = self.uploader.retarget(self.server_url)
+            if retargeted:
+                log(f"发件箱中 {retargeted} 条结果改为发往当前接口地址")
+            if self.uploader.pending_count():
+                log(f"待发送: {self.uploader.pending_count()}")
+
+        self.job_queue = JobQueue(self.process_image, workers=self.queue_workers, maxsize=self.queue_size,
+                                  log=log)
+        self.running = True
+
+    def load_config(self, config_path):
+        """从配置文件加载设置，缺少的项使用与界面相同的默认值"""
+        config = {}
+        if os.path.exists(config_path):
+            with open(config_path, "r") as f:
+                config = json.load(f)
+            log(f"已加载配置: {config_path}")
+        else:
+            log(f"配置文件 {config_path} 不存在，使用默认配置")
+
+        self.server_url = config.get('server_url', "http://172.16.1.141:10511/apiEntitySample/GetSampleScanData.json")
+        self.watch_dir = config.get('watch_dir', "picture")
+        self.rows = config.get('rows', 9)
+        self.cols = config.get('cols', 9)
+        self.machine_code = config.get('machine_code', 1)
+        self.code_mode = config.get('code_mode', 'QR')
+        self.save_cut_results = config.get('save_cut_results', False)
+        self.workers = config.get('workers', 0)
+        self.worker_mode = config.get('worker_mode', 'thread')
+        self.queue_workers = config.get('queue_workers', 1)
+        self.queue_size = config.get('queue_size', 32)
+        self.adaptive_order = config.get('adaptive_order', True)
+        self.well_budget_ms = config.get('well_budget_ms', 1500)
+        self.plate_timeout_s = config.get('plate_timeout_s', 60)
+        self.skip_empty_wells = config.get('skip_empty_wells', True)
+        self.plate_first = config.get('plate_first', False)
+        self.plate_tiles = config.get('plate_tiles', 1)
+        self.reuse_unchanged_wells = config.get('reuse_unchanged_wells', False)
+        self.decode_cache_size = config.get('decode_cache_size', 4096)
+        self.decode_cache_db = config.get('decode_cache_db', "decode_cache.db")
+        self.decode_cache_db_mb = config.get('decode_cache_db_mb', 64)
+        self.outbox_path = config.get('outbox_path', "outbox.jsonl")
+        self.batch_url = config.get('batch_url', "")
+        self.batch_size = config.get('batch_size', 10)
+        self.compression = config.get('compression', "none")
+        self.compact_payload = config.get('compact_payload', False)
+        self.trace_path = config.get('trace_path', "")
+        self.trace_format = config.get('trace_format', "jsonl")
+        self.trace_max_mb = config.get('trace_max_mb', 20)
+        self.trace_backups = config.get('trace_backups', 3)
+
+        log(f"孔版布局: {self.rows}行 x {self.cols}列，机器码: {self.machine_code}，识别模式: {self.code_mode}码")
+
+    def get_template_path(self):
+        """根据当前行列数生成模板文件名"""
+        return f"template_{self.rows}x{self.cols}.json"
+
+    def process_image(self, image_path):
+        """
+        切割并识别一张图片，识别完成后上传结果
+        :return: (识别结果, 各孔位状态)，失败时返回None
+        """
+        with trace_context(image=os.path.basename(image_path)), span("plate"):
+            return self._process_image(image_path)
+
+    def _process_image(self, image_path):
+        file_name = os.path.basename(image_path)
+        template_file = self.get_template_path()
+        if not os.path.exists(template_file):
+            log(f"模板文件 {template_file} 不存在，请先在界面中画模板")
+            return None
+
+        with span("imread"):
+            image = cv2.imread(image_path)
+        if image is None:
+            log(f"无法读取图片: {image_path}")
+            return None
+        with span("geometry"):
+            roi_count = self.processor.count_rois(image)
+        if roi_count == 0:
+            log(f"{file_name}: 切割失败，跳过识别")
+            return None
+        results = traced_iter("crop", self.processor.iter_cut_image(image))
+        if self.save_cut_results:
+            results = list(results)
+            save_rois_async(results, "cut_results")
+
+        os.makedirs("Result", exist_ok=True)
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        output_file = os.path.join("Result", f"qr_results_{timestamp}_{os.path.splitext(file_name)[0]}.json")
+
+        plate_stats = StrategyStats()
+        ranking = get_ranking(template_file, self.code_mode) if self.adaptive_order else None
+        well_budget = self.well_budget_ms / 1000 if self.well_budget_ms else None
+        statuses = {}
+        known = None
+        if self.plate_first:
+            detect_plate = detect_qr_plate if self.code_mode == "QR" else detect_dm_plate
+            with span("plate_detect"):
+                known = detect_plate(image, self.processor, self.plate_tiles, plate_stats)
+        well_cache = get_well_cache(template_file, self.code_mode)
+
+        decode_rois = decode_qr_rois if self.code_mode == "QR" else decode_dm_rois
+        with span("decode", mode=self.code_mode):
+            qr_results = decode_rois(results, output_file, self.workers, self.worker_mode == "process", plate_stats,
+                                     ranking, well_budget, self.plate_timeout_s, statuses, self.skip_empty_wells,
+                                     known, well_cache, self.decode_cache, None, self.reuse_unchanged_wells)
+
+        total_positions = self.rows * self.cols
+        timed_out = sum(1 for status in statuses.values() if status == "timeout")
+        log(f"{file_name}: 识别 {len(qr_results)}/{total_positions} 个孔位"
+            + (f"，{timed_out} 个孔位超时" if timed_out else ""))
+
+        if self.on_plate is not None:
+            self.on_plate(image_path, qr_results, statuses)
+        if self.uploader is not None:
+            if not qr_results:
+                log(f"{file_name}: 没有识别结果，不上传")
+            elif self.complete_only and len(qr_results) < total_positions:
+                log(f"{file_name}: 未全部识别，不上传")
+            else:
+                data = build_plate_payload(qr_results, self.rows, self.cols, self.machine_code,
+                                           compact=self.compact_payload)
+                self.uploader.submit(self.server_url, data, {"file": file_name})
+        return qr_results, statuses
+
+    def on_upload_done(self, data, outcome, meta):
+        """记录上传结果（在上传线程中调用）"""
+        source = f"{meta.get('file', '')} (data_id {data['data_id']})"
+        if outcome.status == "client_error":
+            log(f"错误: 上传 {source} 失败: {outcome.message}（接口地址: {self.server_url}），"
+                f"结果保留在发件箱中，{outcome.retry_in:.0f} 秒后重试")
+        elif outcome.retry_in is not None:
+            log(f"上传 {source} 失败: {outcome.message}，{outcome.retry_in:.0f} 秒后重试")
+        elif outcome.status == "success":
+            log(f"上传 {source} 成功")
+        elif outcome.status == "rejected":
+            log(f"后端拒绝了 {source}: {outcome.message}")
+        else:
+            log(f"上传 {source} 失败: {outcome.message}")
+
+    def submit(self, image_path):
+        """加入处理队列（队列满时阻塞）"""
+        if self.job_queue.submit(image_path) == "duplicate":
+            log(f"图片已在处理队列中，忽略重复提交: {os.path.basename(image_path)}")
+
+    def wait_idle(self):
+        """等待已提交的图片全部处理完（stop()后不再等待）"""
+        # 按提交到处理完成计数，不会漏掉已从队列取出、尚未开始处理的图片
+        while self.running and not self.job_queue.join(timeout=0.1):
+            pass
+
+    def watch(self, directory=None):
+        """监控文件夹，阻塞直到stop()（或收到SIGINT/SIGTERM）"""
+        directory = directory or self.watch_dir
+        os.makedirs(directory, exist_ok=True)
+        watcher = FolderWatcher(directory, self.submit, log=log)
+        log(f"开始监控: {directory}")
+        watcher.run(lambda: self.running)
+
+    def stop(self):
+        """停止监控和等待"""
+        self.running = False
+
+    def close(self, upload_timeout=0):
+        """
+        停止处理并释放资源
+        :param upload_timeout: 最多等待多少秒让发件箱中的结果上传完，未上传的结果保留在发件箱中下次启动时继续上传
+        """
+        self.job_queue.stop()
+        if self.uploader is not None:
+            deadline = time.monotonic() + upload_timeout
+            while self.uploader.pending_count() and time.monotonic() < deadline:
+                time.sleep(0.1)
+            if self.uploader.pending_count():
+                log(f"还有 {self.uploader.pending_count()} 条结果未上传，已保存在发件箱中")
+            self.uploader.close()
+        shutdown_executors()
+        if self.decode_cache is not None:
+            self.decode_cache.close()
+        close_tracing()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Geese Gaze 无界面识别服务")
+    parser.add_argument("images", nargs="*", help="要处理的图片；不指定时监控文件夹")
+    parser.add_argument("--config", default="config.json", help="配置文件（默认config.json，与界面共用）")
+    parser.add_argument("--watch", metavar="DIR", help="监控的文件夹（默认使用配置中的watch_dir）")
+    parser.add_argument("--no-upload", action="store_true", help="只识别，不上传结果")
+    parser.add_argument("--allow-partial", action="store_true",
+                        help="也上传未全部识别的孔板（默认只上传全部孔位都识别成功的孔板，与界面的自动发送一致）")
+    parser.add_argument("--json", action="store_true", help="每块孔板的结果以一行JSON输出到标准输出")
+    parser.add_argument("--upload-timeout", type=float, default=30,
+                        help="处理完给定图片后最多等待上传的秒数（默认30）")
+    args = parser.parse_args(argv)
+
+    output_lock = threading.Lock()
+    json_out = sys.stdout
+    def print_plate(image_path, qr_results, statuses):
+        with output_lock:
+            print(json.dumps({"image": image_path, "results": qr_results, "statuses": statuses},
+                             ensure_ascii=False), file=json_out, flush=True)
+
+    # 切割和识别模块逐孔打印的日志转到标准错误，标准输出只保留--json的结果
+    with contextlib.redirect_stdout(sys.stderr):
+        runner = HeadlessRunner(args.config, upload=not args.no_upload, complete_only=not args.allow_partial,
+                                on_plate=print_plate if args.json else None)
+        # Ctrl+C和SIGTERM（systemd、docker stop）都正常退出，未上传的结果留在发件箱中
+        signal.signal(signal.SIGINT, lambda signum, frame: runner.stop())
+        signal.signal(signal.SIGTERM, lambda signum, frame: runner.stop())
+        upload_timeout = 0
+        try:
+            if args.images:
+                for image_path in args.images:
+                    runner.submit(image_path)
+                runner.wait_idle()
+                # 处理完后等待结果上传（被中断时不再等待）
+                upload_timeout = args.upload_timeout if runner.running else 0
+            else:
+                runner.watch(args.watch)
+        finally:
+            runner.close(upload_timeout)
+    log("已退出")
+    return 0
+
+if __name__ == "__main__":
+    # 使用进程池识别时需要
+    import multiprocessing
+    multiprocessing.freeze_support()
+    sys.exit(main())
@@ -0,0 +1,126 @@
+import os
+import queue
+import threading
+
+class JobQueue:
+    """有界先进先出的图片处理队列
+
+    固定数量的消费线程按提交顺序处理图片；队列满时提交方阻塞（背压）；
+    同一路径在排队或处理中时重复提交会被丢弃。
+    """
+
+    def __init__(self, handler, workers=1, maxsize=32, on_depth_change=None, log=print):
+        """
+        :param handler: 处理函数，参数为图片路径
+        :param workers: 消费线程数
+        :param maxsize: 队列容量
+        :param on_depth_change: 队列深度变化时的回调，参数为 (排队数, 处理中数)
+        :param log: 日志函数
+        """
+        self.handler = handler
+        self.on_depth_change = on_depth_change
+        self.log = log
+        self._queue = queue.Queue(maxsize=max(1, maxsize))
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)  # 没有排队或处理中的图片时通知
+        self._queued = set()  # 排队中或处理中的路径（从submit到处理函数返回）
+        self._active = 0
+        self._stopped = False
+        self._threads = []
+        for i in range(max(1, workers)):
+            thread = threading.Thread(target=self._worker, name=f"JobQueue-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    @staticmethod
+    def _key(path):
+        return os.path.normcase(os.path.abspath(path))
+
+    def submit(self, path, block=True, timeout=None):
+        """
+        提交图片
+        :param path: 图片路径
+        :param block: 队列满时是否阻塞等待
+        :param timeout: 阻塞等待的超时时间（秒），None表示一直等待
+        :return: "queued" 已入队，"duplicate" 重复提交已丢弃，"full" 队列已满，"stopped" 队列已停止
+        """
+        key = self._key(path)
+        with self._lock:
+            if self._stopped:
+                return "stopped"
+            if key in self._queued:
+                return "duplicate"
+            self._queued.add(key)
+
+        try:
+            self._queue.put(path, block=block, timeout=timeout)
+        except queue.Full:
+            with self._lock:
+                self._discard(key)
+            return "full"
+
+        self._notify_depth()
+        return "queued"
+
+    def _discard(self, key):
+        # 调用方持有self._lock
+        self._queued.discard(key)
+        if not self._queued:
+            self._idle.notify_all()
+
+    def join(self, timeout=None):
+        """
+        等待已提交的图片全部处理完（处理函数返回）
+        :param timeout: 最多等待的秒数，None表示一直等待
+        :return: 是否已全部处理完
+        """
+        with self._lock:
+            return self._idle.wait_for(lambda: not self._queued, timeout)
+
+    def depth(self):
+        """返回 (排队数, 处理中数)"""
+        with self._lock:
+            return self._queue.qsize(), self._active
+
+    def stop(self):
+        """停止接收新任务，已排队的任务会被丢弃"""
+        with self._lock:
+            self._stopped = True
+        while True:
+            try:
+                path = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if path is not None:
+                with self._lock:
+                    self._discard(self._key(path))
+        for _ in self._threads:
+            try:
+                self._queue.put_nowait(None)
+            except queue.Full:
+                break
+
+    def _notify_depth(self):
+        if self.on_depth_change is not None:
+            waiting, active = self.depth()
+            self.on_depth_change(waiting, active)
+
+    def _worker(self):
+        while True:
+            path = self._queue.get()
+            if path is None:
+                return
+
+            with self._lock:
+                self._active += 1
+            self._notify_depth()
+
+            try:
+                self.handler(path)
+            except Exception as e:
+                self.log(f"处理图片 {path} 时出错: {e}")
+            finally:
+                with self._lock:
+                    self._active -= 1
+                    self._discard(self._key(path))
+                self._notify_depth()
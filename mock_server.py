@@ -1,61 +1,133 @@
 from flask import Flask, request, jsonify
 import os
+import json
 from datetime import datetime
 import random
+from payload_codec import decompress_body, expand_results
 
 app = Flask(__name__)
 
 # 存储接收到的数据
 received_data = []
 
+class UnsupportedEncoding(Exception):
+    """请求体使用了不支持的压缩方式"""
+
+def read_json():
+    """
+    读取JSON请求体：按Content-Encoding解压（gzip、zstd），
+    并打印传输字节数和解压后的字节数，便于比较不同编码方式的带宽
+    """
+    raw = request.get_data()
+    encoding = request.headers.get('Content-Encoding')
+    try:
+        body = decompress_body(raw, encoding)
+    except ValueError as e:
+        raise UnsupportedEncoding(str(e))
+    print(f"请求体: 传输 {len(raw)} 字节，解压后 {len(body)} 字节（{encoding or 'identity'}）")
+    return json.loads(body.decode('utf-8'))
+
+def unsupported_encoding(e):
+    """不支持的压缩方式返回415，客户端会改为不压缩重发"""
+    print(f"不支持的请求编码: {e}")
+    return jsonify({
+        'status': 'error',
+        'message': str(e)
+    }), 415
+
+def process_result(data):
+    """处理一块孔板的识别结果，返回该孔板的响应内容"""
+    # 紧凑格式（只包含有结果的孔位）还原为完整格式
+    expand_results(data)
+    
+    # 添加接收时间戳
+    data['received_at'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    
+    # 存储数据
+    received_data.append(data)
+    
+    # 打印接收到的数据
+    print(f"接收到二维码识别结果: {data}")
+    
+    # 获取results中的所有键
+    results_keys = list(data.get('results', {}).keys())
+    
+    # 随机选择5个键作为negative
+    warning = random.sample(results_keys, min(5, len(results_keys))) if results_keys else []
+    
+    # 随机选择5个键作为loc_err，确保有2个与warning重复
+    if len(results_keys) >= 5:
+        # 从warning中随机选择2个
+        common_keys = random.sample(warning, 2) if len(warning) >= 2 else warning
+        # 从剩余键中选择3个
+        remaining_keys = [k for k in results_keys if k not in common_keys]
+        additional_keys = random.sample(remaining_keys, 3) if len(remaining_keys) >= 3 else remaining_keys
+        loc_err = common_keys + additional_keys
+    else:
+        # 如果键不足5个，使用所有键
+        loc_err = results_keys.copy()
+    
+    # 检查请求中是否包含data_id
+    request_data_id = data.get('data_id')
+    response_data_id = request_data_id if request_data_id is not None else len(received_data)
+    
+    return {
+        'status': 'success',
+        'message': '二维码识别结果已接收',
+        'data_id': response_data_id,
+        'warning': warning,
+        'loc_err': loc_err
+    }
+
 @app.route('/api/qr_results', methods=['POST'])
 def receive_qr_results():
     """接收二维码识别结果的接口"""
     try:
-        data = request.json
-        
-        # 添加接收时间戳
-        data['received_at'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        
-        # 存储数据
-        received_data.append(data)
-        
-        # 打印接收到的数据
-        print(f"接收到二维码识别结果: {data}")
-        
-        # 获取results中的所有键
-        results_keys = list(data.get('results', {}).keys())
+        data = read_json()
         
-        # 随机选择5个键作为negative
-        warning = random.sample(results_keys, min(5, len(results_keys))) if results_keys else []
-        
-        # 随机选择5个键作为loc_err，确保有2个与warning重复
-        if len(results_keys) >= 5:
-            # 从warning中随机选择2个
-            common_keys = random.sample(warning, 2) if len(warning) >= 2 else warning
-            # 从剩余键中选择3个
-            remaining_keys = [k for k in results_keys if k not in common_keys]
-            additional_keys = random.sample(remaining_keys, 3) if len(remaining_keys) >= 3 else remaining_keys
-            loc_err = common_keys + additional_keys
-        else:
-            # 如果键不足5个，使用所有键
-            loc_err = results_keys.copy()
+        # 返回成功响应
+        return jsonify(process_result(data)), 200
         
-        # 检查请求中是否包含data_id
-        request_data_id = data.get('data_id')
-        response_data_id = request_data_id if request_data_id is not None else len(received_data)
+    except UnsupportedEncoding as e:
+        return unsupported_encoding(e)
+    except Exception as e:
+        print(f"处理请求时出错: {e}")
+        return jsonify({
+            'status': 'error',
+            'message': f'处理请求时出错: {str(e)}'
+        }), 500
+
+@app.route('/api/qr_results/batch', methods=['POST'])
+def receive_qr_results_batch():
+    """批量接收多块孔板的识别结果，请求格式为 {"items": [孔板数据, ...]}
+    
+    每块孔板单独确认：results中每一项都带有该孔板的data_id、warning和loc_err，
+    单块孔板处理失败不影响其他孔板。
+    """
+    try:
+        items = read_json().get('items', [])
+        results = []
+        for data in items:
+            try:
+                results.append(process_result(data))
+            except Exception as e:
+                print(f"处理批量数据中的一项时出错: {e}")
+                results.append({
+                    'status': 'error',
+                    'message': f'处理请求时出错: {str(e)}',
+                    'data_id': data.get('data_id') if isinstance(data, dict) else None
+                })
         
-        # 返回成功响应
         return jsonify({
             'status': 'success',
-            'message': '二维码识别结果已接收',
-            'data_id': response_data_id,
-            'warning': warning,
-            'loc_err': loc_err
+            'message': f'已接收 {len(items)} 块孔板的识别结果',
+            'results': results
         }), 200
         
+    except UnsupportedEncoding as e:
+        return unsupported_encoding(e)
     except Exception as e:
-        print(f"处理请求时出错: {e}")
+        print(f"处理批量请求时出错: {e}")
         return jsonify({
             'status': 'error',
             'message': f'处理请求时出错: {str(e)}'
@@ -103,6 +175,8 @@ def index():
                 <div class="section">
                     <h2>API接口</h2>
                     <p><strong>POST /api/qr_results</strong> - 接收二维码识别结果</p>
+                    <p><strong>POST /api/qr_results/batch</strong> - 批量接收多块孔板的识别结果</p>
+                    <p>请求体可以用gzip或zstd压缩（Content-Encoding），results可以是只包含有结果孔位的紧凑格式（format为compact，附带rows和cols）</p>
                     <p><strong>GET /api/qr_results</strong> - 获取已接收的数据</p>
                     <p><strong>POST /api/qr_results/clear</strong> - 清空已接收的数据</p>
                 </div>
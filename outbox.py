@@ -0,0 +1,140 @@
+import os
+import json
+import threading
+
+# 已确认的记录超过该数量且多于待发送记录时压缩文件
+COMPACT_THRESHOLD = 200
+
+class Outbox:
+    """待上传结果的磁盘发件箱（只追加的JSON Lines文件）
+
+    每次提交追加一条 {"op": "add", "seq", "url", "payload", "meta"} 记录，
+    上传完成后追加一条 {"op": "ack", "seq"} 记录，修改接口地址时追加 {"op": "url", "seq", "url"} 记录，
+    写入后立即fsync。
+    启动时重放文件，未确认的记录按提交顺序继续上传，程序崩溃或断网都不会丢失结果。
+    """
+
+    def __init__(self, path=None):
+        """
+        :param path: 发件箱文件路径，None表示只保存在内存中
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self._pending = []  # 按提交顺序排列的未确认记录
+        self._next_seq = 1
+        self._acked = 0  # 文件中已确认的记录数，用于判断是否需要压缩
+        if path:
+            self._replay()
+
+    def _replay(self):
+        """从文件恢复未确认的记录，忽略崩溃时写了一半的最后一行"""
+        if not os.path.exists(self.path):
+            return
+        pending = {}
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                seq = record.get("seq", 0)
+                self._next_seq = max(self._next_seq, seq + 1)
+                if record.get("op") == "add":
+                    pending[seq] = record
+                elif record.get("op") == "url" and seq in pending:
+                    pending[seq]["url"] = record.get("url")
+                elif record.get("op") == "ack" and pending.pop(seq, None) is not None:
+                    self._acked += 1
+        self._pending = [pending[seq] for seq in sorted(pending)]
+        if self._pending:
+            print(f"发件箱中有 {len(self._pending)} 条未上传的结果，将继续上传")
+
+    def _write(self, record):
+        if not self.path:
+            return
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def append(self, url, payload, meta=None):
+        """
+        追加一条待上传记录（写入磁盘后才返回）
+        :param url: 后端接口地址
+        :param payload: 要发送的JSON数据
+        :param meta: 只在本地使用的附加信息（不发送），上传完成后随记录返回
+        :return: 记录
+        """
+        with self._lock:
+            record = {"op": "add", "seq": self._next_seq, "url": url, "payload": payload, "meta": meta or {}}
+            self._next_seq += 1
+            self._write(record)
+            self._pending.append(record)
+            return record
+
+    def peek(self):
+        """返回最早的未确认记录，没有时返回None"""
+        with self._lock:
+            return self._pending[0] if self._pending else None
+
+    def peek_many(self, limit):
+        """返回最早的最多limit条未确认记录（发往同一地址），用于批量上传"""
+        with self._lock:
+            if not self._pending:
+                return []
+            url = self._pending[0]["url"]
+            records = []
+            for record in self._pending:
+                if record["url"] != url or len(records) >= limit:
+                    break
+                records.append(record)
+            return records
+
+    def retarget(self, url, old_url=None):
+        """
+        把未确认的记录改为发往新的接口地址
+        :param url: 新的接口地址
+        :param old_url: 只修改发往该地址的记录，None表示全部
+        :return: 修改的记录数
+        """
+        with self._lock:
+            count = 0
+            for record in self._pending:
+                if record["url"] == url or (old_url is not None and record["url"] != old_url):
+                    continue
+                self._write({"op": "url", "seq": record["seq"], "url": url})
+                record["url"] = url
+                count += 1
+            return count
+
+    def ack(self, record):
+        """确认记录已上传（或后端明确拒绝，不再重试）"""
+        with self._lock:
+            if record not in self._pending:
+                return
+            self._write({"op": "ack", "seq": record["seq"]})
+            self._pending.remove(record)
+            self._acked += 1
+            if self._acked >= COMPACT_THRESHOLD and self._acked > len(self._pending):
+                self._compact()
+
+    def _compact(self):
+        """只保留未确认的记录重写文件（先写临时文件再替换，中途崩溃不会丢失记录）"""
+        if not self.path:
+            self._acked = 0
+            return
+        temp_path = self.path + ".tmp"
+        try:
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                for record in self._pending:
+                    f.write(json.dumps(record, ensure_ascii=False) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_path, self.path)
+            self._acked = 0
+        except OSError as e:
+            print(f"压缩发件箱失败: {e}")
+
+    def __len__(self):
+        with self._lock:
+            return len(self._pending)
@@ -0,0 +1,117 @@
+import json
+import gzip
+import random
+import string
+from datetime import datetime
+
+# zstd压缩为可选依赖（pip install zstandard），未安装时使用gzip
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# 支持的Content-Encoding
+COMPRESSIONS = ("none", "gzip", "zstd")
+
+def available_compression(compression):
+    """
+    返回实际可用的压缩方式
+    :param compression: 配置的压缩方式，"none"、"gzip" 或 "zstd"
+    :return: 未安装zstandard时zstd退化为gzip，未知的值视为"none"
+    """
+    if compression == "zstd" and zstandard is None:
+        return "gzip"
+    return compression if compression in COMPRESSIONS else "none"
+
+def encode_body(obj, compression="none"):
+    """
+    把JSON数据编码为请求体
+    :param obj: 要发送的数据
+    :param compression: "none"、"gzip" 或 "zstd"
+    :return: (请求体字节, 请求头)
+    """
+    body = json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    headers = {"Content-Type": "application/json"}
+    if compression == "gzip":
+        body = gzip.compress(body, compresslevel=6)
+        headers["Content-Encoding"] = "gzip"
+    elif compression == "zstd":
+        body = zstandard.ZstdCompressor(level=3).compress(body)
+        headers["Content-Encoding"] = "zstd"
+    return body, headers
+
+def decompress_body(raw, encoding=None):
+    """
+    按Content-Encoding解压请求体
+    :param raw: 请求体字节
+    :param encoding: Content-Encoding请求头，None或identity表示未压缩
+    :return: 解压后的字节
+    :raises ValueError: 不支持的压缩方式
+    """
+    encoding = (encoding or "identity").strip().lower()
+    if encoding == "gzip":
+        return gzip.decompress(raw)
+    if encoding == "zstd":
+        if zstandard is None:
+            raise ValueError("不支持zstd压缩（未安装zstandard）")
+        return zstandard.ZstdDecompressor().decompressobj().decompress(raw)
+    if encoding != "identity":
+        raise ValueError(f"不支持的压缩方式: {encoding}")
+    return raw
+
+def generate_data_id():
+    """生成15位随机数字作为data_id"""
+    return ''.join(random.choices(string.digits, k=15))
+
+def build_plate_payload(qr_results, rows, cols, machine_id, data_id=None, compact=False):
+    """
+    生成一块孔板的上传数据
+    :param qr_results: 已识别的孔位结果 {孔位: 识别结果}
+    :param rows: 孔板行数
+    :param cols: 孔板列数
+    :param machine_id: 机器码
+    :param data_id: 数据ID，None时随机生成
+    :param compact: 是否使用紧凑格式（只发送有结果的孔位和行列数，后端按行列数还原空孔位）
+    :return: 上传数据
+    """
+    # 生成所有孔位的位置标签
+    all_results = {}
+    for row in range(rows):
+        for col in range(cols):
+            pos_label = f"{chr(ord('A') + row)}{col + 1}"
+            all_results[pos_label] = qr_results.get(pos_label, "")
+    
+    data = {
+        "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "total_positions": rows * cols,
+        "detected_count": len(qr_results),
+        "data_id": data_id if data_id is not None else generate_data_id(),
+        "machine_id": machine_id,
+        "results": all_results
+    }
+    if compact:
+        data["format"] = "compact"
+        data["rows"] = rows
+        data["cols"] = cols
+        data["results"] = compact_results(all_results)
+    return data
+
+def compact_results(results):
+    """紧凑格式只保留有识别结果的孔位"""
+    return {label: value for label, value in results.items() if value}
+
+def expand_results(data):
+    """
+    把紧凑格式的孔板数据还原为完整格式（所有孔位都有键，未识别的为空字符串）
+    :param data: 孔板数据，format为"compact"时包含rows和cols
+    :return: 完整格式的孔板数据（原地修改并返回）
+    """
+    if data.get("format") != "compact":
+        return data
+    rows = int(data.get("rows", 0))
+    cols = int(data.get("cols", 0))
+    compact = data.get("results", {})
+    data["results"] = {f"{chr(ord('A') + row)}{col + 1}": compact.get(f"{chr(ord('A') + row)}{col + 1}", "")
+                       for row in range(rows) for col in range(cols)}
+    del data["format"]
+    return data
@@ -0,0 +1,174 @@
+import numpy as np
+from matplotlib.patches import Rectangle
+from matplotlib.transforms import Bbox, TransformedBbox
+
+# 孔位状态对应的颜色：未识别(灰色)、成功(绿色)、warning(黄色)、loc_err(红色)
+CELL_COLORS = ['lightgray', 'green', 'yellow', 'red']
+# 各状态的孔位序号文字颜色，成功的孔位不显示序号（选中时除外）
+TEXT_COLORS = ['white', None, 'black', 'white']
+# 变化的孔位超过该比例时直接整图重绘，比逐个孔位局部刷新更快
+FULL_REDRAW_RATIO = 0.25
+# 文字和选中边框的裁剪区域比孔位方块向内缩进的比例，
+# 保证它们不会画到相邻孔位共用的边缘像素上，局部重绘时不会留下残影
+CLIP_INSET = 0.08
+
+class PlateGridView:
+    """孔板网格的增量渲染器
+
+    每个孔位的方块、序号文字和选中边框都是常驻的matplotlib对象，
+    状态变化时只修改变化的孔位并局部刷新（blit）这些孔位所在的区域，
+    不再每次清空坐标轴、重新imshow和重新创建几百个文字对象。
+    """
+
+    def __init__(self, ax, canvas, title="QR Code Recognition Results"):
+        """
+        :param ax: matplotlib坐标轴
+        :param canvas: FigureCanvasTkAgg
+        :param title: 网格标题
+        """
+        self.ax = ax
+        self.canvas = canvas
+        self.title = title
+        self._shape = None  # 当前网格的 (行数, 列数)，None表示显示"No Data"
+        self._cells = []  # 每个孔位的方块，按行优先排列
+        self._texts = []  # 每个孔位的序号文字
+        self._selection = None  # 选中孔位的蓝色边框
+        self._grid = None  # 当前显示的各孔位状态
+        self._selected = None  # 当前选中的孔位 (行, 列)
+
+    def show_no_data(self):
+        """显示"No Data"（没有识别结果也没有选中孔位时）"""
+        if self._shape is None and self._grid is not None:
+            return
+        self.ax.clear()
+        self.ax.text(0.5, 0.5, "No Data", horizontalalignment='center', verticalalignment='center',
+                     transform=self.ax.transAxes)
+        self._shape = None
+        self._cells = []
+        self._texts = []
+        self._selection = None
+        self._grid = np.zeros(0)
+        self._selected = None
+        self.canvas.draw()
+
+    def render(self, grid, selected=None):
+        """
+        显示各孔位状态，只重绘有变化的孔位
+        :param grid: (行数, 列数) 整数数组，取值见CELL_COLORS
+        :param selected: 选中孔位的 (行, 列)，None表示没有选中
+        """
+        grid = np.asarray(grid, dtype=np.int64)
+        if grid.shape != self._shape:
+            self._build(grid.shape)
+
+        if self._grid is None:
+            changed = np.ones(grid.shape, dtype=bool)
+        else:
+            changed = grid != self._grid
+        for position in (self._selected, selected):
+            if position is not None:
+                changed[position] = True
+        self._grid = grid.copy()
+        self._selected = selected
+
+        rows, cols = np.nonzero(changed)
+        for row, col in zip(rows, cols):
+            self._update_cell(row, col)
+        if selected is not None:
+            self._selection.set_xy((selected[1] - 0.45, selected[0] - 0.45))
+            self._selection.set_clip_box(self._clip_box(*selected))
+        self._selection.set_visible(selected is not None)
+
+        if len(rows) > FULL_REDRAW_RATIO * grid.size:
+            self.canvas.draw()
+        elif len(rows):
+            self._blit_cells(zip(rows, cols))
+
+    def _build(self, shape):
+        """按行列数创建所有孔位对象（行列数变化时）"""
+        n_rows, n_cols = shape
+        self.ax.clear()
+        self._cells = []
+        self._texts = []
+        for row in range(n_rows):
+            for col in range(n_cols):
+                # 关闭抗锯齿，相邻方块的边缘不会互相叠加，局部重绘和整图重绘的结果一致
+                cell = Rectangle((col - 0.5, row - 0.5), 1, 1, facecolor=CELL_COLORS[0], edgecolor='none',
+                                 antialiased=False)
+                self.ax.add_patch(cell)
+                self._cells.append(cell)
+                text = self.ax.text(col, row, f"{chr(ord('A') + row)}{col + 1}",
+                                    ha='center', va='center',
+                                    color=TEXT_COLORS[0], fontsize=10, weight='bold')
+                # 文字裁剪在本孔位内，重绘一个孔位时不会留下相邻孔位文字的残影
+                text.set_clip_box(self._clip_box(row, col))
+                text.set_clip_on(True)
+                self._texts.append(text)
+        # 蓝色矩形边框标记选中的孔位
+        self._selection = Rectangle((-0.45, -0.45), 0.9, 0.9, fill=False, edgecolor='blue', linewidth=1.5,
+                                    visible=False)
+        self.ax.add_patch(self._selection)
+
+        # 坐标范围和imshow一致：行从上到下，方块为正方形
+        self.ax.set_xlim(-0.5, n_cols - 0.5)
+        self.ax.set_ylim(n_rows - 0.5, -0.5)
+        self.ax.set_aspect('equal')
+
+        # 添加标签
+        self.ax.set_xticks(np.arange(n_cols))
+        self.ax.set_yticks(np.arange(n_rows))
+        self.ax.set_xticklabels([str(i + 1) for i in range(n_cols)])
+        self.ax.set_yticklabels([chr(ord('A') + i) for i in range(n_rows)])
+        self.ax.set_title(self.title)
+
+        # 边框和刻度放在孔位方块下面（边框线宽加倍，露出的外侧一半与原来相同），
+        # 重绘边缘孔位时不会盖掉边框和刻度
+        self.ax.set_axisbelow(True)
+        for spine in self.ax.spines.values():
+            spine.set_zorder(0.5)
+            spine.set_linewidth(spine.get_linewidth() * 2)
+
+        self._shape = shape
+        self._grid = None
+        self._selected = None
+
+    def _clip_box(self, row, col):
+        """孔位内部的裁剪区域（随坐标轴缩放）"""
+        inner = 0.5 - CLIP_INSET
+        return TransformedBbox(Bbox.from_extents(col - inner, row - inner, col + inner, row + inner),
+                               self.ax.transData)
+
+    def _update_cell(self, row, col):
+        """根据状态设置孔位的颜色和序号文字"""
+        state = self._grid[row, col]
+        index = row * self._shape[1] + col
+        self._cells[index].set_facecolor(CELL_COLORS[state])
+        text = self._texts[index]
+        if (row, col) == self._selected:
+            text.set_color('white')
+            text.set_visible(True)
+        elif TEXT_COLORS[state] is None:
+            text.set_visible(False)
+        else:
+            text.set_color(TEXT_COLORS[state])
+            text.set_visible(True)
+
+    def _blit_cells(self, positions):
+        """只重绘并刷新给定孔位所在的区域"""
+        renderer = getattr(self.canvas, "get_renderer", lambda: None)()
+        if renderer is None:
+            self.canvas.draw()
+            return
+        n_cols = self._shape[1]
+        for row, col in positions:
+            index = row * n_cols + col
+            # 不透明的方块会覆盖旧内容，因此不需要恢复背景；绘制顺序与整图重绘相同（方块、边框、文字）
+            self.ax.draw_artist(self._cells[index])
+            if (row, col) == self._selected:
+                self.ax.draw_artist(self._selection)
+            if self._texts[index].get_visible():
+                self.ax.draw_artist(self._texts[index])
+            corners = self.ax.transData.transform([(col - 0.5, row - 0.5), (col + 0.5, row + 0.5)])
+            bbox = Bbox.from_extents(corners[:, 0].min() - 1, corners[:, 1].min() - 1,
+                                     corners[:, 0].max() + 1, corners[:, 1].max() + 1)
+            self.canvas.blit(bbox)
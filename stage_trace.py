@@ -0,0 +1,215 @@
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+
+# 跟踪文件格式：jsonl每行一个事件；chrome为Chrome Trace Event格式（可在chrome://tracing或Perfetto中打开），
+# 两种格式的事件内容相同，chrome格式的文件以"["开头，允许省略结尾的"]"
+TRACE_FORMATS = ("jsonl", "chrome")
+# perf_counter时间换算为墙上时间的偏移，跟踪事件的时间戳可以和日志对应
+_EPOCH_OFFSET = time.time() - time.perf_counter()
+# 孔位识别的泳道使用的tid起始值，避免与真实线程号混淆
+_LANE_TID_BASE = 1000000
+
+_tracer = None
+_context = threading.local()
+
+class Tracer:
+    """按阶段记录耗时的跟踪器，事件写入按大小轮转的文件（线程安全）"""
+
+    def __init__(self, path, fmt="jsonl", max_bytes=20 * 1024 * 1024, backups=3):
+        """
+        :param path: 跟踪文件路径，轮转后的旧文件为 path.1、path.2 ...
+        :param fmt: "jsonl" 或 "chrome"
+        :param max_bytes: 单个文件的大小上限
+        :param backups: 保留的旧文件数
+        """
+        self.path = path
+        self.fmt = fmt if fmt in TRACE_FORMATS else "jsonl"
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.pid = os.getpid()
+        self._lock = threading.Lock()
+        self._lane_ends = []  # 孔位识别泳道的最后结束时间
+        self._file = None
+        self._open()
+
+    def _open(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._file = open(self.path, 'a', encoding='utf-8')
+        if self.fmt == "chrome" and self._file.tell() == 0:
+            self._file.write("[\n")
+        self._lane_ends = []  # 新文件中重新声明泳道名称
+
+    def _rotate(self):
+        self._file.close()
+        for index in range(self.backups - 1, 0, -1):
+            source = f"{self.path}.{index}"
+            if os.path.exists(source):
+                os.replace(source, f"{self.path}.{index + 1}")
+        if self.backups > 0:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+        self._open()
+
+    def _write(self, event):
+        line = json.dumps(event, ensure_ascii=False)
+        self._file.write(line + (",\n" if self.fmt == "chrome" else "\n"))
+        self._file.flush()
+        if self._file.tell() >= self.max_bytes:
+            self._rotate()
+
+    def emit(self, name, start, duration, tid=None, args=None):
+        """
+        写入一个完整的阶段事件
+        :param name: 阶段名
+        :param start: 开始时间（time.perf_counter()）
+        :param duration: 耗时（秒）
+        :param tid: 所在的线程或泳道，None表示当前线程
+        :param args: 附加信息
+        """
+        event = {
+            "name": name,
+            "cat": "geese",
+            "ph": "X",
+            "ts": round((start + _EPOCH_OFFSET) * 1e6),
+            "dur": round(duration * 1e6),
+            "pid": self.pid,
+            "tid": tid if tid is not None else threading.get_ident(),
+            "args": args or {},
+        }
+        with self._lock:
+            try:
+                self._write(event)
+            except (OSError, ValueError) as e:
+                print(f"写入跟踪文件失败: {e}")
+
+    def lane(self, start, end):
+        """
+        为并行识别的孔位分配不重叠的泳道（Chrome中同一tid的事件必须依次嵌套）
+        :return: 泳道的tid
+        """
+        with self._lock:
+            for index, lane_end in enumerate(self._lane_ends):
+                if lane_end <= start:
+                    self._lane_ends[index] = end
+                    return _LANE_TID_BASE + index
+            self._lane_ends.append(end)
+            tid = _LANE_TID_BASE + len(self._lane_ends) - 1
+            try:
+                self._write({"name": "thread_name", "ph": "M", "pid": self.pid, "tid": tid,
+                             "args": {"name": f"孔位识别 {len(self._lane_ends)}"}})
+            except (OSError, ValueError) as e:
+                print(f"写入跟踪文件失败: {e}")
+            return tid
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+def configure_tracing(path, fmt="jsonl", max_mb=20, backups=3):
+    """
+    开启或关闭阶段跟踪
+    :param path: 跟踪文件路径，为空时关闭跟踪
+    :param fmt: "jsonl" 或 "chrome"
+    :param max_mb: 单个文件的大小上限（MB）
+    :param backups: 保留的旧文件数
+    :return: Tracer，关闭时为None
+    """
+    global _tracer
+    close_tracing()
+    if path:
+        try:
+            _tracer = Tracer(path, fmt, int(max_mb * 1024 * 1024), backups)
+        except OSError as e:
+            print(f"打开跟踪文件失败: {e}")
+    return _tracer
+
+def close_tracing():
+    """关闭跟踪文件"""
+    global _tracer
+    tracer, _tracer = _tracer, None
+    if tracer is not None:
+        tracer.close()
+
+def _merged_args(args):
+    merged = dict(getattr(_context, "args", {}))
+    merged.update(args)
+    return merged
+
+@contextmanager
+def trace_context(**args):
+    """当前线程中记录的事件都附带这些信息（例如图片名），可以嵌套"""
+    previous = getattr(_context, "args", {})
+    _context.args = dict(previous, **args)
+    try:
+        yield
+    finally:
+        _context.args = previous
+
+def record_span(name, start, duration, **args):
+    """记录一个已经测得耗时的阶段（start为time.perf_counter()），未开启跟踪时不做任何事"""
+    tracer = _tracer
+    if tracer is not None:
+        tracer.emit(name, start, duration, args=_merged_args(args))
+
+@contextmanager
+def span(name, **args):
+    """记录with代码块的耗时"""
+    if _tracer is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_span(name, start, time.perf_counter() - start, **args)
+
+def traced_iter(name, iterable, **args):
+    """
+    逐个生成iterable的元素，结束时记录生成元素的累计耗时（不含调用方处理元素的时间）
+    用于按需切割这类与识别交错进行的阶段
+    """
+    if _tracer is None:
+        yield from iterable
+        return
+    iterator = iter(iterable)
+    first = None
+    total = 0.0
+    count = 0
+    while True:
+        start = time.perf_counter()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            break
+        finally:
+            total += time.perf_counter() - start
+            if first is None:
+                first = start
+        count += 1
+        yield item
+    record_span(name, first, total, count=count, cumulative=True, **args)
+
+def trace_strategies(label, timings, method=None):
+    """
+    记录一个孔位的识别耗时，按识别策略拆分
+    :param label: 孔位
+    :param timings: DecoderChain.decode返回的各策略耗时 [(策略名, 耗时, 是否命中, 开始时间), ...]
+    :param method: 识别成功的策略名
+    """
+    tracer = _tracer
+    if tracer is None or not timings:
+        return
+    start = timings[0][3]
+    end = timings[-1][3] + timings[-1][1]
+    tid = tracer.lane(start, end)
+    tracer.emit("decode_well", start, end - start, tid, _merged_args({"well": label, "method": method}))
+    for name, elapsed, hit, strategy_start in timings:
+        tracer.emit(name, strategy_start, elapsed, tid, _merged_args({"well": label, "hit": hit}))
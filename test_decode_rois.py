@@ -0,0 +1,112 @@
+import time
+import threading
+import cv2
+import numpy as np
+import pytest
+
+from decode_chain import DecoderChain, Strategy, decode_rois, serialized
+from decode_cache import DecodeCache
+
+def _run_opencv(img, detectors):
+    data, _, _ = detectors["opencv"].detectAndDecode(img)
+    return data or None
+
+CHAIN = DecoderChain([
+    Strategy("M1-OpenCV", "original", _run_opencv),
+    Strategy("M1-OpenCV-2x", "2x", _run_opencv),
+], detector_factories={"opencv": cv2.QRCodeDetector}, mode="QR", code_name="二维码")
+
+def _well(payload=None, background=200, cell=100):
+    """合成一个孔位：有试管时画出管口和二维码，空孔位只有均匀的背景"""
+    well = np.full((cell, cell), background, dtype=np.uint8)
+    if payload is not None:
+        center = (cell // 2, cell // 2)
+        cv2.circle(well, center, int(cell * 0.46), 120, thickness=-1)
+        cv2.circle(well, center, int(cell * 0.42), 235, thickness=-1)
+        code_px = int(cell * 0.6)
+        symbol = cv2.resize(cv2.QRCodeEncoder.create().encode(payload), (code_px, code_px),
+                            interpolation=cv2.INTER_NEAREST)
+        offset = (cell - code_px) // 2
+        well[offset:offset + code_px, offset:offset + code_px] = symbol
+    return cv2.cvtColor(well, cv2.COLOR_GRAY2BGR)
+
+def _plate():
+    """8个孔位：偶数列有试管，奇数列为空孔位"""
+    truth = {}
+    rois = []
+    for index in range(8):
+        label = f"A{index + 1}"
+        payload = f"SAMPLE{index:04d}" if index % 2 == 0 else None
+        if payload:
+            truth[label] = payload
+        # 各空孔位背景亮度略有不同，像素内容不重复，每个孔位各占一条缓存
+        rois.append((label, _well(payload, 200 + index)))
+    return rois, truth
+
+@pytest.mark.parametrize("on_disk", [False, True])
+def test_resubmitted_plate_keeps_empty_wells_without_decoding(tmp_path, on_disk):
+    rois, truth = _plate()
+    calls = []
+
+    def decode_fn(img, order=None, budget=None):
+        calls.append(img)
+        return CHAIN.decode(img, order, budget)
+
+    db_path = str(tmp_path / "decode_cache.sqlite") if on_disk else None
+    cache = DecodeCache(db_path=db_path)
+    first = {}
+    results = decode_rois(CHAIN, decode_fn, rois, workers=1, statuses=first, skip_empty=True, decode_cache=cache)
+    assert results == truth
+    assert first == {label: "ok" if label in truth else "empty" for label, _ in rois}
+    assert len(calls) == len(truth)
+
+    # 磁盘缓存模拟重启：新建的缓存对象只能从sqlite文件中读到上次的结果
+    if on_disk:
+        cache.close()
+        cache = DecodeCache(db_path=db_path)
+    calls.clear()
+    second = {}
+    results = decode_rois(CHAIN, decode_fn, rois, workers=1, statuses=second, skip_empty=True, decode_cache=cache)
+    assert results == truth
+    assert second == first
+    assert calls == []
+
+def test_cached_failure_does_not_hide_empty_well():
+    rois, truth = _plate()
+    calls = []
+
+    def decode_fn(img, order=None, budget=None):
+        calls.append(img)
+        return CHAIN.decode(img, order, budget)
+
+    # 关闭空孔位预判时空孔位会跑完整个识别链，"未识别"的结果进入缓存
+    cache = DecodeCache()
+    decode_rois(CHAIN, decode_fn, rois, workers=1, skip_empty=False, decode_cache=cache)
+    assert len(calls) == len(rois)
+
+    calls.clear()
+    statuses = {}
+    results = decode_rois(CHAIN, decode_fn, rois, workers=1, statuses=statuses, skip_empty=True, decode_cache=cache)
+    assert results == truth
+    assert statuses == {label: "ok" if label in truth else "empty" for label, _ in rois}
+    assert calls == []
+
+def test_waiting_for_serialized_strategy_does_not_use_well_budget():
+    # 模拟多个工作线程共享、推理需要串行的模型：排在后面的孔位等锁的时间远超单孔预算
+    lock = threading.Lock()
+
+    def run_locked(img, detectors):
+        with serialized(lock):
+            time.sleep(0.05)
+        return None
+
+    def run_cheap(img, detectors):
+        return f"CODE{int(img[0, 0, 0])}"
+
+    chain = DecoderChain([
+        Strategy("M2-Locked", "original", run_locked),
+        Strategy("M3-Cheap", "original", run_cheap),
+    ], mode="QR")
+    rois = [(f"A{index + 1}", np.full((20, 20, 3), index, dtype=np.uint8)) for index in range(8)]
+    results = decode_rois(chain, chain.decode, rois, workers=8, well_budget=0.1)
+    assert results == {label: f"CODE{index}" for index, (label, _) in enumerate(rois)}
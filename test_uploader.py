@@ -0,0 +1,55 @@
+import time
+import threading
+
+from uploader import ResultUploader, UploadOutcome
+
+class FakeBatchUploader(ResultUploader):
+    """不发送HTTP请求，记录每个批量请求的地址；发往down_urls中地址的请求按后端不可用处理"""
+
+    def __init__(self, down_urls=(), **kwargs):
+        self.requests = []
+        self.down_urls = set(down_urls)
+        self._requests_lock = threading.Lock()
+        super().__init__(backoff_base=0.05, backoff_max=0.05, batch_wait=0, log=lambda message: None, **kwargs)
+
+    def _post_batch(self, url, payloads):
+        with self._requests_lock:
+            self.requests.append((url, [payload["data_id"] for payload in payloads]))
+        if url in self.down_urls:
+            return UploadOutcome("connection_error", None, "后端不可用", None), {}
+        outcomes = {payload["data_id"]: UploadOutcome("success", {}, None, None) for payload in payloads}
+        return UploadOutcome("success", {}, None, None), outcomes
+
+def _wait_sent(uploader, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while uploader.pending_count() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return uploader.pending_count() == 0
+
+def test_batch_path_follows_retargeted_record_url():
+    old_url = "http://old-host:10511/api/qr_results"
+    new_url = "http://new-host:10511/api/qr_results"
+    uploader = FakeBatchUploader(down_urls={"http://old-host:10511/api/qr_results/batch"},
+                                 batch_url="/api/qr_results/batch")
+    try:
+        for data_id in ("P1", "P2"):
+            uploader.submit(old_url, {"data_id": data_id})
+        time.sleep(0.1)
+        assert uploader.retarget(new_url) == 2
+        assert _wait_sent(uploader)
+    finally:
+        uploader.close()
+    assert uploader.requests[0][0] == "http://old-host:10511/api/qr_results/batch"
+    assert uploader.requests[-1] == ("http://new-host:10511/api/qr_results/batch", ["P1", "P2"])
+
+def test_full_batch_url_overrides_record_url():
+    uploader = FakeBatchUploader(batch_url="http://batch-host/api/qr_results/batch", batch_size=10)
+    try:
+        uploader.submit("http://host-a/api/qr_results", {"data_id": "P1"})
+        uploader.submit("http://host-b/api/qr_results", {"data_id": "P2"})
+        assert _wait_sent(uploader)
+    finally:
+        uploader.close()
+    # 发往不同接口地址的结果不会合并到同一批中
+    assert sorted(uploader.requests) == [("http://batch-host/api/qr_results/batch", ["P1"]),
+                                         ("http://batch-host/api/qr_results/batch", ["P2"])]
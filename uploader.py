@@ -0,0 +1,334 @@
+import time
+import random
+import threading
+from collections import namedtuple
+from urllib.parse import urljoin
+import requests
+from requests.adapters import HTTPAdapter
+from outbox import Outbox
+from payload_codec import available_compression, encode_body
+from stage_trace import record_span
+
+# 上传结果：status为 "success"、"mismatch"（返回的data_id不一致）、"rejected"（后端在返回的JSON中明确拒绝该孔板）、
+# "http_error"（5xx、超时、限流）、"client_error"（其他HTTP错误）、"connection_error" 或 "error"；
+# result为后端返回的JSON，message为错误说明；retry_in为下次重试前等待的秒数，不再重试时为None
+UploadOutcome = namedtuple("UploadOutcome", ["status", "result", "message", "retry_in"])
+
+# 这些结果说明孔板没有被后端处理，保留在发件箱中稍后重试，只有后端明确拒绝的孔板才从发件箱中移除
+RETRYABLE = ("http_error", "client_error", "connection_error", "error")
+# 可以很快恢复的HTTP错误，按指数退避重试
+TRANSIENT_HTTP_STATUS = (408, 429)
+NOT_JSON_MESSAGE = "后端返回的不是JSON（可能是代理或维护页面）"
+
+class ResultUploader:
+    """后台上传识别结果
+
+    提交的结果先写入磁盘发件箱，上传线程持有一个保持连接的requests.Session，
+    按提交顺序逐个POST；后端不可用时按指数退避（带随机抖动）重试，恢复后按顺序补发，
+    程序重启后继续上传上次未发送的结果。
+    """
+
+    def __init__(self, outbox_path=None, timeout=10, backoff_base=1.0, backoff_max=60.0,
+                 on_outcome=None, on_pending_change=None, log=print,
+                 batch_url=None, batch_size=10, batch_wait=0.5, compression="none", client_error_backoff=300.0):
+        """
+        :param outbox_path: 发件箱文件路径，None表示只保存在内存中
+        :param timeout: 单次请求的超时时间（秒）
+        :param backoff_base: 第一次重试前的等待时间（秒），之后每次翻倍
+        :param backoff_max: 重试等待时间上限（秒）
+        :param on_outcome: 每次上传尝试后的回调 on_outcome(payload, UploadOutcome, meta)，在上传线程中调用
+        :param on_pending_change: 待上传数量变化时的回调，参数为待上传数量
+        :param log: 日志函数
+        :param batch_url: 批量上传接口地址，设置后多块孔板合并为一个请求，None表示逐块上传；
+                          可以只写路径（例如 "/api/qr_results/batch"），按各条结果的接口地址解析，
+                          retarget之后批量请求也发往新的后端；写完整地址时所有结果都发往该地址
+        :param batch_size: 每个批量请求最多包含的孔板数
+        :param batch_wait: 待上传的孔板不足batch_size时，最多再等待多少秒凑批
+        :param compression: 请求体压缩方式，"none"、"gzip" 或 "zstd"（未安装zstandard时使用gzip）；
+                            后端返回415（不支持该压缩方式）时自动改为不压缩
+        :param client_error_backoff: 出现4xx等非临时HTTP错误后的重试间隔（秒）；这类错误多半是接口地址或认证配置错误，
+                                     结果保留在发件箱中，修正配置后调用retarget或retry_now立即补发
+        """
+        self.timeout = timeout
+        self.batch_url = batch_url
+        self.batch_size = max(1, batch_size)
+        self.batch_wait = batch_wait
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.client_error_backoff = client_error_backoff
+        self.on_outcome = on_outcome
+        self.on_pending_change = on_pending_change
+        self.log = log
+        self.compression = available_compression(compression)
+        if self.compression != compression:
+            self.log(f"不支持的压缩方式 {compression}，改用 {self.compression}")
+        self.outbox = Outbox(outbox_path)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=2)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._wakeup = threading.Condition()
+        self._stopped = False
+        self._idle = False  # 上传线程是否在等待新的结果（不是在退避等待）
+        self._retry_requested = False  # retry_now在上传过程中被调用时，本次失败后不再退避等待
+        self._thread = threading.Thread(target=self._worker, name="ResultUploader", daemon=True)
+        self._thread.start()
+
+    def submit(self, url, payload, meta=None):
+        """
+        提交一次上传（写入发件箱后立即返回）
+        :param url: 后端接口地址
+        :param payload: 要发送的JSON数据，必须包含data_id
+        :param meta: 只在本地使用的附加信息，随on_outcome回调返回
+        """
+        self.outbox.append(url, payload, meta)
+        self._notify_pending()
+        # 只唤醒空闲的上传线程，后端不可用时不打断退避等待
+        with self._wakeup:
+            if self._idle:
+                self._wakeup.notify_all()
+
+    def pending_count(self):
+        """待上传的结果数"""
+        return len(self.outbox)
+
+    def retarget(self, url, old_url=None):
+        """
+        把发件箱中未上传的结果改为发往新的接口地址，并立即重试
+        :param url: 新的接口地址
+        :param old_url: 只修改发往该地址的结果，None表示全部
+        :return: 修改的结果数
+        """
+        count = self.outbox.retarget(url, old_url)
+        if count:
+            self.retry_now()
+        return count
+
+    def retry_now(self):
+        """唤醒上传线程，立即尝试上传（不等待退避时间）"""
+        with self._wakeup:
+            self._retry_requested = True
+            self._wakeup.notify_all()
+
+    def close(self):
+        """停止上传线程并关闭连接，未上传的结果保留在发件箱中"""
+        with self._wakeup:
+            self._stopped = True
+            self._wakeup.notify_all()
+        self._thread.join(timeout=self.timeout)
+        self.session.close()
+
+    def post(self, url, payload):
+        """
+        同步上传一次并校验返回的data_id
+        :return: UploadOutcome（retry_in为None）
+        """
+        start = time.perf_counter()
+        outcome = self._post(url, payload)
+        record_span("upload", start, time.perf_counter() - start, data_id=payload.get('data_id'),
+                    status=outcome.status)
+        return outcome
+
+    def _post(self, url, payload):
+        try:
+            response = self._post_json(url, payload)
+            rejection = self._rejection(response, payload.get('data_id'))
+            if rejection is not None:
+                return UploadOutcome("rejected", rejection, rejection.get('message', '未知错误'), None)
+            if response.status_code != 200:
+                return self._http_error(response)
+            result = self._json(response)
+            if result is None:
+                return UploadOutcome("error", None, NOT_JSON_MESSAGE, None)
+            if result.get('status') != 'success':
+                return UploadOutcome("error", result, f"后端返回的数据无法识别: {str(result)[:200]}", None)
+            # 验证返回的data_id是否与发送的一致
+            if result.get('data_id') != payload.get('data_id'):
+                return UploadOutcome("mismatch", result, f"发送的data_id({payload.get('data_id')})"
+                                                         f"与返回的data_id({result.get('data_id')})不一致", None)
+            return UploadOutcome("success", result, None, None)
+        except requests.exceptions.RequestException as e:
+            return UploadOutcome("connection_error", None, str(e), None)
+        except Exception as e:
+            return UploadOutcome("error", None, str(e), None)
+
+    def post_batch(self, url, payloads):
+        """
+        同步批量上传，每块孔板按data_id单独确认
+        :param url: 批量上传接口地址
+        :param payloads: 要发送的孔板数据列表
+        :return: (整体结果, {data_id: UploadOutcome})；整体结果不是success时没有孔板被确认
+        """
+        start = time.perf_counter()
+        overall, outcomes = self._post_batch(url, payloads)
+        record_span("upload_batch", start, time.perf_counter() - start, count=len(payloads),
+                    acked=len(outcomes), status=overall.status)
+        return overall, outcomes
+
+    def _post_batch(self, url, payloads):
+        try:
+            response = self._post_json(url, {"items": payloads})
+            if response.status_code != 200:
+                return self._http_error(response), {}
+            result = self._json(response)
+            if result is None:
+                return UploadOutcome("error", None, NOT_JSON_MESSAGE, None), {}
+            if result.get('status') != 'success':
+                # 整个批量请求失败不代表某块孔板被拒绝，全部留在发件箱中重试
+                return UploadOutcome("error", result, f"批量上传失败: {result.get('message', '未知错误')}", None), {}
+        except requests.exceptions.RequestException as e:
+            return UploadOutcome("connection_error", None, str(e), None), {}
+        except Exception as e:
+            return UploadOutcome("error", None, str(e), None), {}
+
+        # 返回中没有出现的孔板不确认，留在发件箱中重试
+        sent_ids = {payload.get('data_id') for payload in payloads}
+        outcomes = {}
+        for item in result.get('results', []):
+            data_id = item.get('data_id')
+            if data_id not in sent_ids:
+                continue
+            if item.get('status') == 'success':
+                outcomes[data_id] = UploadOutcome("success", item, None, None)
+            elif item.get('status'):
+                outcomes[data_id] = UploadOutcome("rejected", item, item.get('message', '未知错误'), None)
+        return UploadOutcome("success", result, None, None), outcomes
+
+    @staticmethod
+    def _json(response):
+        """解析返回的JSON对象，不是JSON对象时（例如代理或维护页面）返回None"""
+        try:
+            result = response.json()
+        except ValueError:
+            return None
+        return result if isinstance(result, dict) else None
+
+    @classmethod
+    def _rejection(cls, response, data_id):
+        """
+        判断后端是否在返回的JSON中明确拒绝了该孔板
+        :return: 后端返回的JSON，不是明确拒绝时返回None（HTTP错误、代理错误页面等都不算）
+        """
+        result = cls._json(response)
+        if result is None or result.get('status') in (None, 'success'):
+            return None
+        # 非200的响应只有带着该孔板的data_id时才视为针对该孔板的拒绝
+        if response.status_code != 200 and result.get('data_id') != data_id:
+            return None
+        return result
+
+    @staticmethod
+    def _http_error(response):
+        """HTTP层面的错误：结果没有被后端处理，需要重试"""
+        status = response.status_code
+        message = f"HTTP状态码: {status}"
+        if status >= 500 or status in TRANSIENT_HTTP_STATUS:
+            return UploadOutcome("http_error", None, message, None)
+        return UploadOutcome("client_error", None, f"{message}，请检查接口地址和认证配置", None)
+
+    def _post_json(self, url, obj):
+        """按当前压缩方式发送JSON，后端不支持该压缩方式时改为不压缩重发"""
+        body, headers = encode_body(obj, self.compression)
+        response = self.session.post(url, data=body, headers=headers, timeout=self.timeout)
+        if response.status_code == 415 and self.compression != "none":
+            self.log(f"后端不支持 {self.compression} 压缩，改为不压缩上传")
+            self.compression = "none"
+            body, headers = encode_body(obj, self.compression)
+            response = self.session.post(url, data=body, headers=headers, timeout=self.timeout)
+        return response
+
+    def _backoff(self, failures, outcome=None):
+        """第failures次失败后的等待时间：指数增长，乘以0.5~1的随机系数避免多台机器同时重试；
+        非临时的HTTP错误（接口地址或认证配置错误）使用较长的固定间隔"""
+        if outcome is not None and outcome.status == "client_error":
+            delay = max(self.client_error_backoff, self.backoff_max)
+        else:
+            delay = min(self.backoff_max, self.backoff_base * (2 ** (failures - 1)))
+        return delay * random.uniform(0.5, 1.0)
+
+    def _wait_backoff(self, delay):
+        """退避等待，调用retry_now或close时提前结束"""
+        with self._wakeup:
+            if not self._stopped and not self._retry_requested:
+                self._wakeup.wait(delay)
+            self._retry_requested = False
+
+    def _notify_pending(self):
+        if self.on_pending_change is not None:
+            self.on_pending_change(len(self.outbox))
+
+    def _report(self, record, outcome):
+        if self.on_outcome is not None:
+            try:
+                self.on_outcome(record["payload"], outcome, record["meta"])
+            except Exception as e:
+                self.log(f"处理上传结果时出错: {e}")
+
+    def _worker(self):
+        failures = 0
+        while True:
+            with self._wakeup:
+                while not self._stopped and self.outbox.peek() is None:
+                    self._idle = True
+                    self._wakeup.wait()
+                self._idle = False
+                if self._stopped:
+                    return
+            if self.batch_url:
+                failures = self._send_batch(failures)
+                continue
+            record = self.outbox.peek()
+
+            outcome = self.post(record["url"], record["payload"])
+            if outcome.status in RETRYABLE:
+                # 保留在发件箱队首，等待后重试（保证按提交顺序上传）
+                failures += 1
+                delay = self._backoff(failures, outcome)
+                self._report(record, outcome._replace(retry_in=delay))
+                self._wait_backoff(delay)
+                continue
+
+            failures = 0
+            self.outbox.ack(record)
+            self._notify_pending()
+            self._report(record, outcome)
+
+    def _send_batch(self, failures):
+        """
+        批量上传最早的若干块孔板
+        :param failures: 之前连续失败的次数
+        :return: 本次之后连续失败的次数
+        """
+        # 待上传的孔板不足一批时稍等片刻，让后续孔板一起发送
+        if len(self.outbox) < self.batch_size and self.batch_wait > 0:
+            with self._wakeup:
+                if not self._stopped:
+                    self._wakeup.wait(self.batch_wait)
+        records = self.outbox.peek_many(self.batch_size)
+        if not records:
+            return failures
+
+        # 同一批的结果发往同一个接口地址，批量接口按该地址解析（batch_url为完整地址时不变）
+        url = urljoin(records[0]["url"], self.batch_url)
+        overall, outcomes = self.post_batch(url, [record["payload"] for record in records])
+        for record in records:
+            outcome = outcomes.get(record["payload"].get("data_id"))
+            if outcome is None:
+                continue
+            self.outbox.ack(record)
+            self._report(record, outcome)
+        if outcomes:
+            self._notify_pending()
+
+        if overall.status in RETRYABLE or len(outcomes) < len(records):
+            # 整批失败或部分孔板未确认：未确认的孔板留在发件箱中，等待后重试
+            failures += 1
+            delay = self._backoff(failures, overall)
+            if overall.status not in RETRYABLE:
+                overall = UploadOutcome("error", overall.result, "批量上传的返回中缺少部分孔板的确认", None)
+            for record in records:
+                if record["payload"].get("data_id") not in outcomes:
+                    self._report(record, overall._replace(retry_in=delay))
+            self._wait_backoff(delay)
+            return failures
+        return 0
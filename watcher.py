@@ -0,0 +1,187 @@
+import os
+import sys
+import stat
+import time
+import select
+import struct
+import ctypes
+import ctypes.util
+from stage_trace import record_span
+
+# 监控的图片扩展名
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+
+# inotify事件掩码（见 <sys/inotify.h>）
+_IN_MOVED_FROM = 0x00000040
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_DELETE = 0x00000200
+_IN_Q_OVERFLOW = 0x00004000
+_IN_IGNORED = 0x00008000
+_IN_EVENT_HEADER = struct.Struct("iIII")
+
+class FolderWatcher:
+    """文件夹监控器
+
+    Linux下使用inotify接收文件事件，其他平台退化为定时扫描目录。
+    新文件的大小和修改时间在settle_interval内保持不变时才认为传输完成，
+    然后调用on_file_ready回调。
+    """
+
+    def __init__(self, directory, on_file_ready, extensions=IMAGE_EXTENSIONS,
+                 poll_interval=1.0, settle_interval=0.2, log=print):
+        """
+        :param directory: 监控的文件夹
+        :param on_file_ready: 文件传输完成后的回调，参数为文件路径
+        :param extensions: 需要处理的文件扩展名
+        :param poll_interval: 轮询模式下的扫描间隔（秒）
+        :param settle_interval: 文件大小和修改时间保持不变多久视为传输完成（秒）
+        :param log: 日志函数
+        """
+        self.directory = directory
+        self.on_file_ready = on_file_ready
+        self.extensions = tuple(ext.lower() for ext in extensions)
+        self.poll_interval = poll_interval
+        self.settle_interval = settle_interval
+        self.log = log
+        self.backend = None
+        # 等待传输完成的文件：路径 -> ((大小, 修改时间), 首次观察到该状态的时间)
+        self._pending = {}
+        # 等待传输完成的文件第一次被发现的时间（time.perf_counter()），用于记录等待耗时
+        self._first_seen = {}
+        self._fd = None
+
+    def run(self, should_continue):
+        """
+        阻塞运行监控循环，直到should_continue()返回False
+        :param should_continue: 无参数函数，返回是否继续监控
+        """
+        known = self._scan()
+        self.backend = "inotify" if self._open_inotify() else "polling"
+        try:
+            while should_continue():
+                try:
+                    events = self._read_inotify(self._next_timeout()) if self._fd is not None else None
+                    if events is not None:
+                        names = set()
+                        for mask, name in events:
+                            if mask & (_IN_CREATE | _IN_MOVED_TO):
+                                if name not in known:
+                                    known.add(name)
+                                    names.add(name)
+                            else:
+                                known.discard(name)
+                                names.discard(name)
+                    else:
+                        # 轮询模式，或inotify事件队列溢出后重新扫描目录避免漏掉文件
+                        if self._fd is None:
+                            time.sleep(self._next_timeout())
+                        current = self._scan()
+                        names = current - known
+                        known = current
+
+                    for name in names:
+                        if name.lower().endswith(self.extensions):
+                            path = os.path.join(self.directory, name)
+                            self._pending.setdefault(path, None)
+                            self._first_seen.setdefault(path, time.perf_counter())
+
+                    self._check_pending()
+                except Exception as e:
+                    self.log(f"监控过程中出错: {e}")
+                    time.sleep(5)  # 出错后等待5秒再继续
+        finally:
+            self._close_inotify()
+
+    def _next_timeout(self):
+        """有等待完成的文件时按settle_interval检查，否则按poll_interval"""
+        return self.settle_interval if self._pending else self.poll_interval
+
+    def _scan(self):
+        """列出目录中的文件名"""
+        try:
+            with os.scandir(self.directory) as entries:
+                return {entry.name for entry in entries if entry.is_file()}
+        except FileNotFoundError:
+            return set()
+
+    def _check_pending(self):
+        """检查等待中的文件，大小和修改时间稳定后触发回调"""
+        now = time.monotonic()
+        for path, last in list(self._pending.items()):
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                del self._pending[path]
+                self._first_seen.pop(path, None)
+                continue
+            if not stat.S_ISREG(st.st_mode):
+                del self._pending[path]
+                self._first_seen.pop(path, None)
+                continue
+
+            signature = (st.st_size, st.st_mtime_ns)
+            if last is None or last[0] != signature:
+                self._pending[path] = (signature, now)
+            elif st.st_size > 0 and now - last[1] >= self.settle_interval:
+                del self._pending[path]
+                first_seen = self._first_seen.pop(path, None)
+                if first_seen is not None:
+                    record_span("file_settle", first_seen, time.perf_counter() - first_seen,
+                                file=os.path.basename(path))
+                self.on_file_ready(path)
+
+    def _open_inotify(self):
+        """尝试打开inotify，非Linux平台或失败时返回False"""
+        if not sys.platform.startswith("linux"):
+            return False
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+            fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+            if fd < 0:
+                return False
+            mask = _IN_CREATE | _IN_MOVED_TO | _IN_DELETE | _IN_MOVED_FROM
+            if libc.inotify_add_watch(fd, os.fsencode(self.directory), mask) < 0:
+                os.close(fd)
+                return False
+        except (OSError, AttributeError):
+            return False
+        self._fd = fd
+        return True
+
+    def _close_inotify(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def _read_inotify(self, timeout):
+        """
+        等待inotify事件
+        :return: 按发生顺序排列的 (事件掩码, 文件名) 列表；事件队列溢出时返回None
+        """
+        readable, _, _ = select.select([self._fd], [], [], timeout)
+        if not readable:
+            return []
+
+        try:
+            buffer = os.read(self._fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+
+        events = []
+        offset = 0
+        while offset + _IN_EVENT_HEADER.size <= len(buffer):
+            _, mask, _, name_len = _IN_EVENT_HEADER.unpack_from(buffer, offset)
+            offset += _IN_EVENT_HEADER.size
+            name = buffer[offset:offset + name_len].rstrip(b"\0")
+            offset += name_len
+            if mask & _IN_Q_OVERFLOW:
+                return None
+            if mask & _IN_IGNORED:
+                # 监控目录被删除或卸载，退回轮询模式
+                self._close_inotify()
+                self.backend = "polling"
+                return None
+            if name:
+                events.append((mask, os.fsdecode(name)))
+        return events
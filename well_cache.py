@@ -0,0 +1,80 @@
+import threading
+import numpy as np
+from well_filter import well_fingerprint
+
+# 两次拍摄的孔位指纹相差不超过该位数时视为可能未变化（256位中）。
+# 指纹无法可靠区分不同的条码（不同条码可能只差十几位，重拍时平移两个像素就差几十位），
+# 因此只用来决定先尝试哪个识别策略，结果仍然由本次识别得到；阈值取得较宽，
+# 使轻微平移的重拍也能命中，误判的代价只是多一次策略尝试
+MAX_FINGERPRINT_DISTANCE = 96
+
+class WellResultCache:
+    """按孔位保存上一次的识别结果、识别成功的策略和（重拍时计算的）指纹
+
+    操作员修正一两个试管后重新拍摄同一块孔板时，指纹未变化的孔位先用上次成功的策略验证识别：
+    识别结果与上次相同即可结束，不必再从头尝试整个识别链。
+    缓存的结果不会未经识别直接沿用，避免把上一块孔板的样本号分配给新的试管。
+    """
+
+    def __init__(self, max_distance=MAX_FINGERPRINT_DISTANCE):
+        """
+        :param max_distance: 指纹汉明距离上限，不超过时视为孔位可能未变化
+        """
+        self.max_distance = max_distance
+        self._entries = {}  # label -> (指纹, 识别结果, 识别策略)
+        self._lock = threading.Lock()
+
+    def fingerprint(self, roi):
+        """计算孔位指纹，用于lookup和update"""
+        return well_fingerprint(roi)
+
+    def lookup(self, label, fingerprint):
+        """
+        查找孔位上次的识别结果
+        :param label: 孔位标签
+        :param fingerprint: 本次的孔位指纹
+        :return: (上次识别结果, 上次识别成功的策略)，孔位有变化或上次未识别时为None；
+            上次不是重拍、没有保存指纹时无法判断是否变化，仍返回上次的结果（只用来决定先尝试的策略）
+        """
+        with self._lock:
+            entry = self._entries.get(label)
+        if entry is None or entry[1] is None or entry[2] is None:
+            return None
+        if entry[0] is not None:
+            if entry[0].shape != fingerprint.shape or np.count_nonzero(entry[0] != fingerprint) > self.max_distance:
+                return None
+        return entry[1], entry[2]
+
+    def update(self, label, fingerprint, result, method=None):
+        """
+        保存孔位本次的指纹和识别结果
+        :param label: 孔位标签
+        :param fingerprint: fingerprint返回的指纹，没有计算指纹时为None
+        :param result: 识别结果，未识别时为None
+        :param method: 识别成功的策略名，不是识别链中的策略（例如整板识别）时为None
+        """
+        with self._lock:
+            self._entries[label] = (fingerprint, result, method)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+# 按模板和识别模式缓存，不同模板或模式的孔位结果互不影响
+_caches = {}
+_caches_lock = threading.Lock()
+
+def get_well_cache(template_path, mode):
+    """
+    获取某个模板和识别模式的孔位结果缓存
+    :param template_path: 模板文件路径
+    :param mode: 识别模式，"QR" 或 "DM"
+    :return: WellResultCache
+    """
+    key = (template_path, mode)
+    with _caches_lock:
+        cache = _caches.get(key)
+        if cache is None:
+            cache = WellResultCache()
+            _caches[key] = cache
+    return cache
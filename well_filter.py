@@ -0,0 +1,93 @@
+import cv2
+import numpy as np
+
+# 特征计算时把每个孔位中心区域缩放到的边长
+FEATURE_SIZE = 32
+# 中心区域占ROI的比例（条码通常位于孔位中心，孔壁圆环在边缘）
+CENTER_RATIO = 0.6
+# 特征阈值都相对于本块孔板的对比度：曝光不足或偏软的孔板整体灰度差很小，
+# 绝对灰度阈值会把所有孔位都判为空孔。参考对比度取各孔位中心区域灰度标准差的分位数，
+# 即孔板上有条码的孔位的典型对比度
+REFERENCE_PERCENTILE = 90
+# 参考对比度低于该值时整块孔板几乎没有明暗变化（全是空孔或拍摄失败），不判定空孔
+MIN_REFERENCE_STD = 4.0
+# 强边缘阈值：灰度梯度|gx|+|gy|超过参考对比度的该倍数
+EDGE_RATIO = 0.4
+# 判定为空孔的阈值：中心区域强边缘比例低于上限，且灰度标准差明显低于参考对比度，
+# 模糊的条码边缘弱但对比度仍然接近其他有码孔位，因此不会被误判
+MAX_EMPTY_EDGE_DENSITY = 0.02
+MAX_EMPTY_STD_RATIO = 0.25
+
+def well_features(rois):
+    """
+    计算各孔位的简单特征（批量向量化计算），对比度相关的特征按整块孔板的参考对比度归一化
+    :param rois: (label, roi) 列表
+    :return: (labels, std_ratio, edge_density, transitions, reference)，中间三项为 (N,) 数组：
+        中心区域灰度标准差与参考对比度之比、强边缘像素比例、每行平均明暗交替次数（定位图案特征）；
+        reference为参考对比度（灰度标准差）
+    """
+    labels = []
+    patches = []
+    for label, roi in rois:
+        gray = roi if roi.ndim == 2 else cv2.cvtColor(roi, cv2.COLOR_BGR2GRAY)
+        h, w = gray.shape
+        dy = int(h * (1 - CENTER_RATIO) / 2)
+        dx = int(w * (1 - CENTER_RATIO) / 2)
+        center = gray[dy:h - dy, dx:w - dx]
+        # INTER_AREA缩小可以平滑噪声，均匀区域不会产生虚假边缘
+        patches.append(cv2.resize(center, (FEATURE_SIZE, FEATURE_SIZE), interpolation=cv2.INTER_AREA))
+        labels.append(label)
+
+    if not patches:
+        empty = np.zeros(0)
+        return labels, empty, empty, empty, 0.0
+
+    stack = np.stack(patches).astype(np.float32)  # (N, S, S)
+    std = stack.std(axis=(1, 2))
+    reference = float(np.percentile(std, REFERENCE_PERCENTILE))
+    edge_threshold = EDGE_RATIO * max(reference, MIN_REFERENCE_STD)
+
+    gx = np.abs(np.diff(stack, axis=2))[:, :-1, :]
+    gy = np.abs(np.diff(stack, axis=1))[:, :, :-1]
+    edge_density = ((gx + gy) > edge_threshold).mean(axis=(1, 2))
+
+    # 条码的定位图案和数据模块在每一行都会产生多次明暗交替，空孔几乎没有
+    mean = stack.mean(axis=(1, 2), keepdims=True)
+    dark = stack < mean
+    strong = np.abs(np.diff(stack, axis=2)) > edge_threshold
+    transitions = ((dark[:, :, 1:] != dark[:, :, :-1]) & strong).sum(axis=2).mean(axis=1)
+
+    return labels, std / max(reference, MIN_REFERENCE_STD), edge_density, transitions, reference
+
+def find_empty_wells(rois, max_edge_density=MAX_EMPTY_EDGE_DENSITY, max_std_ratio=MAX_EMPTY_STD_RATIO):
+    """
+    找出没有试管/条码的空孔位，用于跳过耗时的识别
+    只跳过与孔板上其他孔位相比明显平坦的孔位；整块孔板对比度过低时不跳过任何孔位
+    :param rois: (label, roi) 列表
+    :param max_edge_density: 中心区域强边缘比例上限
+    :param max_std_ratio: 中心区域灰度标准差与参考对比度之比的上限
+    :return: 空孔位标签集合
+    """
+    labels, std_ratio, edge_density, transitions, reference = well_features(rois)
+    if reference < MIN_REFERENCE_STD:
+        return set()
+    empty = (edge_density < max_edge_density) & (std_ratio < max_std_ratio) & (transitions < 1.0)
+    return {label for label, is_empty in zip(labels, empty) if is_empty}
+
+# 孔位指纹（差值哈希）的边长，16x16=256位，足以区分不同的条码
+FINGERPRINT_SIZE = 16
+
+def well_fingerprint(roi):
+    """
+    计算孔位中心区域的感知哈希（差值哈希），用于判断两次拍摄之间孔位是否变化
+    :param roi: 孔位图像
+    :return: (FINGERPRINT_SIZE*FINGERPRINT_SIZE,) 布尔数组
+    """
+    gray = roi if roi.ndim == 2 else cv2.cvtColor(roi, cv2.COLOR_BGR2GRAY)
+    h, w = gray.shape
+    dy = int(h * (1 - CENTER_RATIO) / 2)
+    dx = int(w * (1 - CENTER_RATIO) / 2)
+    center = gray[dy:h - dy, dx:w - dx]
+    # 比较相邻像素的明暗关系，对整体亮度变化和轻微模糊不敏感
+    small = cv2.resize(center, (FINGERPRINT_SIZE + 1, FINGERPRINT_SIZE), interpolation=cv2.INTER_AREA)
+    return (small[:, 1:] > small[:, :-1]).ravel()